@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+
+# 批量解析: 从文件或标准输入流式读取域名，经有界并发管道查询，结果逐行写为JSON Lines
+
+import asyncio
+import sys
+import time
+import json
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from dnscodec import QTYPE_MAP, RCODE_NXDOMAIN, get_qtype, get_qtype_name
+from dnscache import CachingResolver, DnsCache
+import udpdns
+import tcpdns
+import httpsdns
+
+# 默认的并发查询数，UDP在少量套接字上异步查询，TCP和DoH每个并发占用一个线程
+CONCURRENCY = {'udp': 1000, 'tcp': 64, 'doh': 64}
+
+# 每次从输入读取的字节数提示，按批读取以减少线程切换
+READ_BATCH_SIZE = 65536
+
+# 进度输出的间隔(秒)
+PROGRESS_INTERVAL = 1.0
+
+PROTOCOLS = ('udp', 'tcp', 'doh')
+
+def parse_query_line(line, query_type='A'):
+    """解析 "域名 [查询类型]" 格式的一行，忽略#注释，空行返回None"""
+    parts = line.split('#', 1)[0].split()
+    if not parts:
+        return None
+    return parts[0], parts[1].upper() if len(parts) > 1 else query_type
+
+class BulkStats(object):
+    """批量解析的计数器，只保存汇总值，内存占用与查询数量无关"""
+    
+    def __init__(self):
+        self.start_time = time.time()
+        self.submitted = 0
+        self.completed = 0
+        self.statuses = Counter()
+        self.rcodes = Counter()
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.retransmits = 0
+        self.total_rtt = 0
+        self.min_rtt = None
+        self.max_rtt = None
+    
+    def record(self, result):
+        self.completed += 1
+        if result['status'] == 'success':
+            self.statuses['success'] += 1
+        elif result.get('rcode') == RCODE_NXDOMAIN:
+            self.statuses['nxdomain'] += 1
+        else:
+            self.statuses[result['status']] += 1
+        if 'rcode_name' in result:
+            self.rcodes[result['rcode_name']] += 1
+        if result.get('cache_hit'):
+            self.cache_hits += 1
+        if result.get('coalesced'):
+            self.coalesced += 1
+        self.retransmits += max(result.get('attempts', 1) - 1, 0)
+        
+        if result['status'] == 'success' and 'rtt' in result:
+            rtt = result['rtt']
+            self.total_rtt += rtt
+            self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+            self.max_rtt = rtt if self.max_rtt is None else max(self.max_rtt, rtt)
+    
+    def snapshot(self):
+        elapsed = time.time() - self.start_time
+        success = self.statuses['success']
+        stats = {
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'success': success,
+            'nxdomain': self.statuses['nxdomain'],
+            'timeout': self.statuses['timeout'],
+            'error': self.statuses['error'],
+            'rcodes': dict(self.rcodes),
+            'cache_hits': self.cache_hits,
+            'coalesced': self.coalesced,
+            'retransmits': self.retransmits,
+            'duration': round(elapsed, 2),
+            'qps': round(self.completed / elapsed, 1) if elapsed > 0 else 0
+        }
+        if success > 0:
+            stats['min_rtt'] = round(self.min_rtt, 2)
+            stats['avg_rtt'] = round(self.total_rtt / success, 2)
+            stats['max_rtt'] = round(self.max_rtt, 2)
+        return stats
+
+def make_blocking_resolver(server, port, protocol, timeout, header_only, cache):
+    """返回TCP或DoH的阻塞查询函数 resolve(域名, 查询类型)"""
+    if cache is not None:
+        options = {'header_only': header_only} if protocol == 'tcp' else {}
+        return CachingResolver(server, port, protocol, cache, timeout, **options).query
+    if protocol == 'tcp':
+        return lambda domain, qtype: tcpdns.tcp_dns_query(domain, server, port, get_qtype_name(get_qtype(qtype)),
+                                                          timeout, header_only=header_only)
+    return lambda domain, qtype: httpsdns.https_dns_query_wire_format(domain, server, get_qtype_name(get_qtype(qtype)),
+                                                                      timeout)
+
+async def bulk_resolve_async(input_file, output_file, server, port=53, protocol='udp', query_type='A',
+                             concurrency=None, timeout=5, retries=udpdns.RETRIES, header_only=False, cache=None,
+                             progress=None):
+    """流式批量解析
+    
+    从input_file逐批读取 "域名 [查询类型]" 行，最多concurrency个查询同时进行，每个结果完成后立即
+    作为一行JSON写入output_file(按完成顺序，seq为输入中的序号)。输入队列有界，读取速度受查询速度限制，
+    内存占用不随输入规模增长。progress为回调函数，每隔PROGRESS_INTERVAL秒以统计快照调用一次。
+    protocol为doh时server为DoH URL。返回汇总统计
+    """
+    if protocol not in PROTOCOLS:
+        raise ValueError(f'不支持的协议: {protocol}')
+    concurrency = concurrency or CONCURRENCY[protocol]
+    loop = asyncio.get_running_loop()
+    stats = BulkStats()
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    
+    resolver = None
+    executor = None
+    if protocol == 'udp':
+        resolver = udpdns.AsyncDnsResolver(server, port, timeout=timeout, retries=retries, cache=cache)
+        await resolver.open()
+    else:
+        if protocol == 'doh':
+            # 按并发数扩大连接池，避免多余的连接在每次请求后被丢弃
+            httpsdns.get_session(server, concurrency)
+        resolve = make_blocking_resolver(server, port, protocol, timeout, header_only, cache)
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+    
+    async def reader():
+        seq = 0
+        while True:
+            lines = await loop.run_in_executor(None, input_file.readlines, READ_BATCH_SIZE)
+            if not lines:
+                break
+            for line in lines:
+                query = parse_query_line(line, query_type)
+                if query is None:
+                    continue
+                seq += 1
+                stats.submitted += 1
+                await queue.put((seq, query[0], query[1]))
+        for _ in range(concurrency):
+            await queue.put(None)
+    
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            seq, domain, qtype = item
+            if resolver is not None:
+                result = await resolver.query(domain, get_qtype(qtype), header_only=header_only)
+            else:
+                result = await loop.run_in_executor(executor, resolve, domain, qtype)
+            result['seq'] = seq
+            result['domain'] = domain
+            result['query_type'] = qtype
+            output_file.write(json.dumps(result, ensure_ascii=False) + '\n')
+            stats.record(result)
+    
+    async def reporter():
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            progress(stats.snapshot())
+    
+    reporter_task = loop.create_task(reporter()) if progress else None
+    try:
+        await asyncio.gather(reader(), *(worker() for _ in range(concurrency)))
+    finally:
+        if reporter_task is not None:
+            reporter_task.cancel()
+        if resolver is not None:
+            resolver.close()
+        if executor is not None:
+            executor.shutdown(wait=False)
+        output_file.flush()
+    
+    result = stats.snapshot()
+    result.update({
+        'server': server,
+        'port': port,
+        'protocol': protocol,
+        'concurrency': concurrency
+    })
+    if cache is not None:
+        result['cache'] = cache.stats()
+    return result
+
+def bulk_resolve(input_file, output_file, server, port=53, protocol='udp', query_type='A', concurrency=None,
+                 timeout=5, retries=udpdns.RETRIES, header_only=False, cache=None, progress=None):
+    """bulk_resolve_async的同步入口，在新的事件循环中运行"""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(bulk_resolve_async(input_file, output_file, server, port, protocol, query_type,
+                                                          concurrency, timeout, retries, header_only, cache, progress))
+    finally:
+        loop.close()
+
+def format_progress(stats):
+    return (f"已完成 {stats['completed']}/{stats['submitted']}, 成功 = {stats['success']}, "
+            f"NXDOMAIN = {stats['nxdomain']}, 超时 = {stats['timeout']}, 错误 = {stats['error']}, "
+            f"QPS = {stats['qps']}")
+
+# 命令行接口
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='批量DNS解析工具，结果以JSON Lines格式输出')
+    parser.add_argument('input', nargs='?', default='-', help='域名文件，每行为 "域名 [查询类型]"，- 表示标准输入 (默认: -)')
+    parser.add_argument('--output', '-o', default='-', help='结果文件，- 表示标准输出 (默认: -)')
+    parser.add_argument('--server', '-s', default='8.8.8.8', help='DNS服务器IP，doh时为DoH URL (默认: 8.8.8.8)')
+    parser.add_argument('--port', '-p', type=int, default=53, help='DNS服务器端口 (默认: 53)')
+    parser.add_argument('--protocol', '-P', default='udp', choices=PROTOCOLS, help='查询协议 (默认: udp)')
+    parser.add_argument('--type', '-t', default='A', choices=list(QTYPE_MAP.keys()), help='行中未指定时的查询类型 (默认: A)')
+    parser.add_argument('--concurrency', '-c', type=int, help='并发查询数 (默认: udp 1000，tcp和doh 64)')
+    parser.add_argument('--timeout', '-T', type=float, default=5, help='单个查询的超时(秒) (默认: 5)')
+    parser.add_argument('--retries', '-R', type=int, default=udpdns.RETRIES, help=f'UDP超时重传次数 (默认: {udpdns.RETRIES})')
+    parser.add_argument('--header-only', '-H', action='store_true', help='只解析响应头部')
+    parser.add_argument('--cache', '-C', action='store_true', help='缓存回答，重复的域名不再查询')
+    parser.add_argument('--quiet', '-q', action='store_true', help='不输出进度')
+    
+    args = parser.parse_args()
+    
+    input_file = sys.stdin if args.input == '-' else open(args.input)
+    output_file = sys.stdout if args.output == '-' else open(args.output, 'w')
+    
+    def show_progress(stats):
+        print(format_progress(stats), file=sys.stderr)
+    
+    try:
+        summary = bulk_resolve(input_file, output_file, args.server, args.port, args.protocol, args.type,
+                               args.concurrency, args.timeout, args.retries, args.header_only,
+                               DnsCache() if args.cache else None, None if args.quiet else show_progress)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+    
+    # 汇总输出到标准错误，标准输出只包含结果
+    print("\n批量解析统计:", file=sys.stderr)
+    print(format_progress(summary) + f", 耗时 = {summary['duration']:.2f} s", file=sys.stderr)
+    if summary['success'] > 0:
+        print(f"往返时间 (ms): 最小 = {summary['min_rtt']:.2f}, 平均 = {summary['avg_rtt']:.2f}, "
+              f"最大 = {summary['max_rtt']:.2f}", file=sys.stderr)
+    if summary['retransmits'] > 0:
+        print(f"重传 = {summary['retransmits']}", file=sys.stderr)
+    if 'cache' in summary:
+        cache_stats = summary['cache']
+        print(f"缓存: 命中 = {cache_stats['hits']}, 未命中 = {cache_stats['misses']}, "
+              f"命中率 = {cache_stats['hit_rate']}%, 合并的并发查询 = {summary['coalesced']}", file=sys.stderr)
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+
+# 进程内的DNS回答缓存: 按记录TTL过期，缓存否定回答(RFC 2308)，超过容量时按LRU淘汰
+
+import threading
+import time
+import json
+from collections import OrderedDict
+
+from dnscodec import QTYPE_MAP, RCODE_NXDOMAIN, get_qtype, get_qtype_name
+import udpdns
+import tcpdns
+import httpsdns
+
+# 缓存的最大条目数
+CACHE_MAXSIZE = 10000
+
+# 肯定回答的最长缓存时间(秒)，避免异常的大TTL长期占用缓存
+MAX_TTL = 86400
+
+# 否定回答的最长缓存时间(秒)，RFC 2308 建议不超过3小时
+MAX_NEGATIVE_TTL = 10800
+
+# 缓存条目中保留的结果字段，其余字段(查询ID、RTT、重传次数等)只属于某一次查询
+CACHED_FIELDS = ('status', 'rcode', 'rcode_name', 'message', 'answers', 'answer_count')
+
+def get_cache_ttl(result):
+    """计算查询结果的缓存时间(秒)，不可缓存时返回None
+    
+    肯定回答取所有记录TTL的最小值；NXDOMAIN和没有数据的回答使用结果中的negative_ttl，
+    没有SOA记录时不缓存；超时、SERVFAIL等其他错误以及被截断的不完整回答不缓存
+    """
+    if result.get('truncated') and 'fallback' not in result:
+        return None
+    if result['status'] == 'success':
+        answers = result.get('answers')
+        if answers is None:
+            # 只解析了头部的结果没有TTL
+            return None
+        if answers:
+            return min(answer['ttl'] for answer in answers)
+        return result.get('negative_ttl')
+    if result['status'] == 'error' and result.get('rcode') == RCODE_NXDOMAIN:
+        return result.get('negative_ttl')
+    return None
+
+class DnsCache(object):
+    """线程安全的DNS回答缓存
+    
+    键为 (协议, 服务器, 端口, 域名, 查询类型)；条目按各自的TTL过期，超过maxsize时淘汰最久未使用的条目。
+    命中时返回结果的副本，记录的TTL减去已缓存的时间
+    """
+    
+    def __init__(self, maxsize=CACHE_MAXSIZE, max_ttl=MAX_TTL, max_negative_ttl=MAX_NEGATIVE_TTL):
+        self.maxsize = maxsize
+        self.max_ttl = max_ttl
+        self.max_negative_ttl = max_negative_ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.inserts = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    @staticmethod
+    def make_key(protocol, server, port, domain, query_type):
+        """生成缓存键，域名不区分大小写，查询类型统一为代码"""
+        return (protocol, server, port, domain.rstrip('.').lower(), get_qtype(query_type))
+    
+    def get(self, key):
+        """读取未过期的缓存结果，没有时返回None"""
+        start_time = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, stored_at, negative, cached = entry
+            if expires <= start_time:
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            if negative:
+                self.negative_hits += 1
+        
+        # 返回副本，记录的TTL按已缓存的时间递减
+        age = int(start_time - stored_at)
+        result = dict(cached)
+        if 'answers' in cached:
+            result['answers'] = [dict(answer, ttl=max(answer['ttl'] - age, 0)) for answer in cached['answers']]
+        result['cache_hit'] = True
+        result['cache_ttl'] = int(expires - start_time)
+        if negative:
+            result['negative'] = True
+        result['rtt'] = (time.time() - start_time) * 1000
+        return result
+    
+    def put(self, key, result):
+        """按结果的TTL保存，返回是否已缓存"""
+        ttl = get_cache_ttl(result)
+        if ttl is None or ttl <= 0:
+            return False
+        negative = result['status'] != 'success' or not result['answers']
+        ttl = min(ttl, self.max_negative_ttl if negative else self.max_ttl)
+        cached = {field: result[field] for field in CACHED_FIELDS if field in result}
+        
+        now = time.time()
+        with self.lock:
+            self.entries[key] = (now + ttl, now, negative, cached)
+            self.entries.move_to_end(key)
+            self.inserts += 1
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return True
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits * 100.0 / lookups, 2) if lookups > 0 else 0,
+                'inserts': self.inserts,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+# 进程内共享的默认缓存
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_default_cache():
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = DnsCache()
+        return _default_cache
+
+class CachingResolver(object):
+    """在udpdns、tcpdns或httpsdns的单次查询之上加一层缓存
+    
+    protocol为 udp、tcp 或 doh；doh时server为DoH URL，使用二进制格式查询。
+    options原样传给对应的查询函数，例如udp的edns、retries，tcp的fastopen，doh的method。
+    cache为None时使用进程内共享的默认缓存，多个解析器可以共享同一个缓存
+    """
+    
+    PROTOCOLS = ('udp', 'tcp', 'doh')
+    
+    def __init__(self, server, port=53, protocol='udp', cache=None, timeout=5, **options):
+        if protocol not in self.PROTOCOLS:
+            raise ValueError(f'不支持的协议: {protocol}')
+        self.server = server
+        self.port = port
+        self.protocol = protocol
+        self.cache = cache if cache is not None else get_default_cache()
+        self.timeout = timeout
+        self.options = options
+    
+    def _query(self, domain, query_type):
+        if self.protocol == 'udp':
+            return udpdns.dns_query(domain, self.server, self.port, query_type, self.timeout, **self.options)
+        if self.protocol == 'tcp':
+            return tcpdns.tcp_dns_query(domain, self.server, self.port, get_qtype_name(get_qtype(query_type)),
+                                        self.timeout, **self.options)
+        return httpsdns.https_dns_query_wire_format(domain, self.server, get_qtype_name(get_qtype(query_type)),
+                                                    self.timeout, **self.options)
+    
+    def query(self, domain, query_type='A'):
+        """先查缓存，未命中时查询服务器并按TTL缓存结果；结果中cache_hit表示是否来自缓存"""
+        key = self.cache.make_key(self.protocol, self.server, self.port, domain, query_type)
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+        
+        result = self._query(domain, query_type)
+        self.cache.put(key, result)
+        result['cache_hit'] = False
+        return result
+    
+    def query_many(self, names, query_type='A'):
+        """依次查询多个名称，names的元素可以是域名或 (域名, 查询类型)"""
+        results = []
+        for name in names:
+            qtype = query_type
+            if isinstance(name, (tuple, list)):
+                name, qtype = name
+            result = self.query(name, qtype)
+            result['domain'] = name
+            results.append(result)
+        return results
+
+# 命令行接口
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='带缓存的DNS查询工具')
+    parser.add_argument('domains', nargs='+', help='要查询的域名')
+    parser.add_argument('--server', '-s', default='8.8.8.8', help='DNS服务器IP，doh时为DoH URL (默认: 8.8.8.8)')
+    parser.add_argument('--port', '-p', type=int, default=53, help='DNS服务器端口 (默认: 53)')
+    parser.add_argument('--protocol', '-P', default='udp', choices=CachingResolver.PROTOCOLS, help='查询协议 (默认: udp)')
+    parser.add_argument('--type', '-t', default='A', choices=list(QTYPE_MAP.keys()), help='查询类型 (默认: A)')
+    parser.add_argument('--rounds', '-r', type=int, default=2, help='重复查询的轮数 (默认: 2)')
+    parser.add_argument('--interval', '-i', type=int, default=1000, help='每轮之间的间隔(毫秒) (默认: 1000)')
+    parser.add_argument('--maxsize', '-m', type=int, default=CACHE_MAXSIZE, help=f'缓存最大条目数 (默认: {CACHE_MAXSIZE})')
+    parser.add_argument('--json', '-j', action='store_true', help='以JSON格式输出结果')
+    
+    args = parser.parse_args()
+    
+    resolver = CachingResolver(args.server, args.port, args.protocol, DnsCache(args.maxsize))
+    rounds = []
+    for i in range(args.rounds):
+        rounds.append(resolver.query_many(args.domains, args.type))
+        if i < args.rounds - 1:
+            time.sleep(args.interval / 1000)
+    
+    if args.json:
+        print(json.dumps({'rounds': rounds, 'stats': resolver.cache.stats()}, indent=2))
+    else:
+        for i, results in enumerate(rounds):
+            print(f"第 {i + 1} 轮:")
+            for result in results:
+                source = '缓存' if result.get('cache_hit') else '服务器'
+                if result['status'] == 'success':
+                    print(f"  {result['domain']}: 成功({source})，RTT = {result['rtt']:.2f} ms，"
+                          f"找到 {len(result.get('answers', []))} 条记录")
+                    for answer in result.get('answers', []):
+                        print(f"    {answer['name']} {answer['ttl']} IN {answer['type']} {answer['data']}")
+                else:
+                    print(f"  {result['domain']}: {result['status']}({source}) - {result.get('message', '未知错误')}")
+        
+        stats = resolver.cache.stats()
+        print("\n缓存统计:")
+        print(f"条目 = {stats['size']}, 命中 = {stats['hits']} (否定 {stats['negative_hits']}), "
+              f"未命中 = {stats['misses']}, 命中率 = {stats['hit_rate']}%")
+        print(f"写入 = {stats['inserts']}, 淘汰 = {stats['evictions']}, 过期 = {stats['expirations']}")
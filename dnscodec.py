@@ -0,0 +1,428 @@
+#!/usr/bin/env python
+
+import random
+import socket
+import struct
+import threading
+from collections import OrderedDict
+
+# DNS查询类型常量
+QTYPE_A = 1      # IPv4地址
+QTYPE_NS = 2     # 域名服务器
+QTYPE_CNAME = 5  # 规范名称
+QTYPE_SOA = 6    # 权威记录开始
+QTYPE_PTR = 12   # 指针记录
+QTYPE_MX = 15    # 邮件交换
+QTYPE_TXT = 16   # 文本记录
+QTYPE_AAAA = 28  # IPv6地址
+QTYPE_OPT = 41   # EDNS0伪记录
+QTYPE_ANY = 255  # 任何记录
+
+# DNS响应码
+RCODE_NOERROR = 0    # 没有错误
+RCODE_FORMERR = 1    # 格式错误
+RCODE_SERVFAIL = 2   # 服务器失败
+RCODE_NXDOMAIN = 3   # 不存在的域名
+RCODE_NOTIMP = 4     # 未实现
+RCODE_REFUSED = 5    # 查询被拒绝
+
+# 查询类型名称 -> 代码
+QTYPE_MAP = {
+    'A': QTYPE_A,
+    'NS': QTYPE_NS,
+    'CNAME': QTYPE_CNAME,
+    'SOA': QTYPE_SOA,
+    'PTR': QTYPE_PTR,
+    'MX': QTYPE_MX,
+    'TXT': QTYPE_TXT,
+    'AAAA': QTYPE_AAAA,
+    'ANY': QTYPE_ANY
+}
+
+# 查询类型代码 -> 名称，启动时计算一次
+QTYPE_NAMES = {v: k for k, v in QTYPE_MAP.items()}
+
+# 响应码名称
+RCODE_NAMES = {
+    RCODE_NOERROR: 'NOERROR',
+    RCODE_FORMERR: 'FORMERR',
+    RCODE_SERVFAIL: 'SERVFAIL',
+    RCODE_NXDOMAIN: 'NXDOMAIN',
+    RCODE_NOTIMP: 'NOTIMP',
+    RCODE_REFUSED: 'REFUSED'
+}
+
+# 响应码说明
+RCODE_MAP = {
+    RCODE_NOERROR: '没有错误',
+    RCODE_FORMERR: '格式错误',
+    RCODE_SERVFAIL: '服务器失败',
+    RCODE_NXDOMAIN: '不存在的域名',
+    RCODE_NOTIMP: '未实现',
+    RCODE_REFUSED: '查询被拒绝'
+}
+
+# 预编译的报文结构
+HEADER = struct.Struct('!HHHHHH')
+QUESTION_TAIL = struct.Struct('!HH')
+RR_FIXED = struct.Struct('!HHIH')
+UINT16 = struct.Struct('!H')
+OPT_RR = struct.Struct('!BHHIH')
+
+# 域名压缩指针最多跟随的次数，防止恶意报文构造指针环
+MAX_POINTER_JUMPS = 64
+
+# 查询模板缓存的最大条目数，超过后按LRU淘汰
+QUERY_TEMPLATE_MAXSIZE = 4096
+
+# 按 (域名, 查询类型, 标志, EDNS缓冲区大小, 是否TCP) 缓存编码好的查询报文
+_query_templates = OrderedDict()
+_query_templates_lock = threading.Lock()
+
+def generate_query_id():
+    """生成随机的DNS查询ID"""
+    return random.randint(0, 65535)
+
+def get_qtype(query_type):
+    """将查询类型名称或代码统一转换为代码，未知名称按A处理"""
+    if isinstance(query_type, int):
+        return query_type
+    return QTYPE_MAP.get(query_type, QTYPE_A)
+
+def get_qtype_name(qtype):
+    """将查询类型代码转换为名称"""
+    return QTYPE_NAMES.get(qtype, str(qtype))
+
+def encode_domain_name(domain):
+    """将域名编码为DNS查询格式"""
+    parts = []
+    for label in domain.rstrip('.').split('.'):
+        if label:
+            encoded = label.encode('idna') if not label.isascii() else label.encode('ascii')
+            parts.append(bytes((len(encoded),)))
+            parts.append(encoded)
+    parts.append(b'\x00')  # 以0字节结束
+    return b''.join(parts)
+
+def encode_query(domain, qtype, flags=0x0100, edns=None, query_id=0):
+    """编码一个完整的查询报文；edns为EDNS0的UDP缓冲区大小，为None时不附加OPT记录"""
+    arcount = 0 if edns is None else 1
+    packet = (HEADER.pack(query_id, flags, 1, 0, 0, arcount) + encode_domain_name(domain) +
+              QUESTION_TAIL.pack(qtype, 1))  # 查询类型和查询类(IN)
+    if edns is not None:
+        # OPT伪记录: 根域名、类型41、类字段为UDP缓冲区大小、TTL为扩展RCODE/版本/标志
+        packet += OPT_RR.pack(0, QTYPE_OPT, edns, 0, 0)
+    return packet
+
+def get_query_template(domain, qtype, flags=0x0100, edns=None, tcp=False):
+    """获取查询报文模板，TCP模板已包含长度前缀；模板中的查询ID为0"""
+    key = (domain, qtype, flags, edns, tcp)
+    with _query_templates_lock:
+        template = _query_templates.get(key)
+        if template is not None:
+            _query_templates.move_to_end(key)
+            return template
+    
+    template = encode_query(domain, qtype, flags, edns)
+    if tcp:
+        template = UINT16.pack(len(template)) + template
+    
+    with _query_templates_lock:
+        _query_templates[key] = template
+        while len(_query_templates) > QUERY_TEMPLATE_MAXSIZE:
+            _query_templates.popitem(last=False)
+    return template
+
+def clear_query_templates():
+    """清空查询模板缓存"""
+    with _query_templates_lock:
+        _query_templates.clear()
+
+def build_query(domain, query_type='A', query_id=None, flags=0x0100, edns=None, tcp=False):
+    """构建一个DNS查询报文，返回 (查询ID, 报文)
+    
+    报文由缓存的模板复制为bytearray后只写入16位查询ID；flags默认为标准查询并期望递归，
+    tcp为True时报文带2字节长度前缀
+    """
+    if query_id is None:
+        query_id = generate_query_id()
+    packet = bytearray(get_query_template(domain, get_qtype(query_type), flags, edns, tcp))
+    UINT16.pack_into(packet, 2 if tcp else 0, query_id)
+    return query_id, packet
+
+def decode_domain_name(message, offset, cache=None):
+    """从DNS报文中迭代解码域名，返回 (域名, 域名之后的偏移)
+    
+    message应为memoryview，标签直接从视图解码而不切片复制；cache为同一报文内
+    {偏移: (后缀域名, 该段结束偏移)} 的字典，压缩指针指向已解码的位置时直接复用
+    """
+    labels = []
+    starts = []
+    # 每个标签作为后缀单独解码时的结束偏移，即其后第一个压缩指针或结束标签之后的位置
+    ends = []
+    end = None
+    suffix = None
+    jumps = 0
+    
+    while True:
+        if cache is not None and offset in cache:
+            suffix, cached_end = cache[offset]
+            ends.extend([cached_end] * (len(starts) - len(ends)))
+            if end is None:
+                end = cached_end
+            break
+        
+        length = message[offset]
+        if length & 0xC0 == 0xC0:
+            # 压缩指针，跳转到指向的位置继续解码
+            ends.extend([offset + 2] * (len(starts) - len(ends)))
+            if end is None:
+                end = offset + 2
+            jumps += 1
+            if jumps > MAX_POINTER_JUMPS:
+                raise ValueError('域名压缩指针过多')
+            offset = ((length & 0x3F) << 8) | message[offset + 1]
+            continue
+        if length == 0:
+            ends.extend([offset + 1] * (len(starts) - len(ends)))
+            if end is None:
+                end = offset + 1
+            break
+        
+        starts.append(offset)
+        labels.append(str(message[offset + 1:offset + 1 + length], 'ascii', 'replace'))
+        offset += length + 1
+    
+    if suffix:
+        labels.append(suffix)
+    name = '.'.join(labels)
+    
+    # 记录每个标签起始位置对应的后缀域名，供后续记录中的压缩指针复用
+    if cache is not None:
+        for i, start in enumerate(starts):
+            cache[start] = ('.'.join(labels[i:]), ends[i])
+    
+    return name, end
+
+def skip_domain_name(message, offset):
+    """跳过一个域名而不解码，返回域名之后的偏移"""
+    while True:
+        length = message[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        if length == 0:
+            return offset + 1
+        offset += length + 1
+
+def decode_rdata(message, offset, rdlength, record_type, cache=None):
+    """按记录类型将记录数据解码为文本"""
+    if record_type == QTYPE_A and rdlength == 4:
+        return socket.inet_ntop(socket.AF_INET, message[offset:offset + 4])
+    if record_type == QTYPE_AAAA and rdlength == 16:
+        return socket.inet_ntop(socket.AF_INET6, message[offset:offset + 16])
+    if record_type == QTYPE_NS or record_type == QTYPE_CNAME or record_type == QTYPE_PTR:
+        return decode_domain_name(message, offset, cache)[0]
+    if record_type == QTYPE_MX:
+        preference = UINT16.unpack_from(message, offset)[0]
+        exchange = decode_domain_name(message, offset + 2, cache)[0]
+        return f'{preference} {exchange}'
+    if record_type == QTYPE_TXT:
+        # TXT记录由一个或多个字符串组成，依次拼接
+        end = offset + rdlength
+        chunks = []
+        while offset < end:
+            length = message[offset]
+            chunks.append(str(message[offset + 1:offset + 1 + length], 'utf-8', 'replace'))
+            offset += length + 1
+        return ''.join(chunks)
+    if record_type == QTYPE_SOA:
+        mname, pos = decode_domain_name(message, offset, cache)
+        rname, pos = decode_domain_name(message, pos, cache)
+        serial, refresh, retry, expire, minimum = struct.unpack_from('!IIIII', message, pos)
+        return f'{mname} {rname} {serial} {refresh} {retry} {expire} {minimum}'
+    # 其他记录类型，以十六进制显示
+    return message[offset:offset + rdlength].hex()
+
+class DnsResponse(object):
+    """DNS响应报文的惰性视图
+    
+    构造时只解析12字节头部，问题和回答部分在第一次访问时才解码并缓存结果；
+    解码过程共享同一个memoryview和域名压缩偏移缓存
+    """
+    
+    def __init__(self, response_data):
+        self.message = memoryview(response_data)
+        if len(self.message) < HEADER.size:
+            raise ValueError(f'响应数据太短: 只有{len(self.message)}字节')
+        (self.id, self.flags, self.qdcount, self.ancount,
+         self.nscount, self.arcount) = HEADER.unpack_from(self.message)
+        self.rcode = self.flags & 0x0F
+        self._name_cache = {}
+        self._question = None
+        self._question_end = None
+        self._answers = None
+        self._answers_end = None
+        self._authority = None
+    
+    @property
+    def is_response(self):
+        return bool(self.flags & 0x8000)
+    
+    @property
+    def truncated(self):
+        """TC标志，UDP响应被截断时置位"""
+        return bool(self.flags & 0x0200)
+    
+    @property
+    def rcode_name(self):
+        return RCODE_NAMES.get(self.rcode, f'未知({self.rcode})')
+    
+    @property
+    def question(self):
+        """第一个问题的 (域名, 查询类型, 查询类)，没有问题时为None"""
+        if self._question_end is None:
+            self._parse_question()
+        return self._question
+    
+    @property
+    def answers(self):
+        """解码后的回答记录列表"""
+        if self._answers is None:
+            if self._question_end is None:
+                self._parse_question()
+            self._answers, self._answers_end = self._parse_records(self.ancount, self._question_end)
+        return self._answers
+    
+    @property
+    def authority(self):
+        """解码后的授权部分记录列表，否定回答在这里携带SOA记录"""
+        if self._authority is None:
+            if self._answers_end is None:
+                self.answers
+            self._authority, _ = self._parse_records(self.nscount, self._answers_end)
+        return self._authority
+    
+    @property
+    def negative_ttl(self):
+        """否定回答(NXDOMAIN或没有数据)的缓存时间(秒)，取授权部分SOA记录的TTL与MINIMUM字段中较小者(RFC 2308)
+        
+        没有SOA记录时为None，此时否定回答不应被缓存
+        """
+        for record in self.authority:
+            if record['type'] == 'SOA':
+                return min(record['ttl'], int(record['data'].rsplit(' ', 1)[1]))
+        return None
+    
+    def _parse_question(self):
+        offset = HEADER.size
+        for i in range(self.qdcount):
+            if i == 0:
+                name, offset = decode_domain_name(self.message, offset, self._name_cache)
+                qtype, qclass = QUESTION_TAIL.unpack_from(self.message, offset)
+                self._question = (name, qtype, qclass)
+            else:
+                offset = skip_domain_name(self.message, offset)
+            offset += QUESTION_TAIL.size
+        self._question_end = offset
+    
+    def _parse_records(self, count, offset):
+        """从offset开始解码count条资源记录，返回 (记录列表, 结束偏移)"""
+        message = self.message
+        cache = self._name_cache
+        records = []
+        for _ in range(count):
+            name, offset = decode_domain_name(message, offset, cache)
+            record_type, record_class, ttl, rdlength = RR_FIXED.unpack_from(message, offset)
+            offset += RR_FIXED.size
+            if offset + rdlength > len(message):
+                raise ValueError('记录数据超出报文长度')
+            
+            records.append({
+                'name': name,
+                'type': QTYPE_NAMES.get(record_type, str(record_type)),
+                'class': 'IN' if record_class == 1 else str(record_class),
+                'ttl': ttl,
+                'data': decode_rdata(message, offset, rdlength, record_type, cache)
+            })
+            offset += rdlength
+        return records, offset
+
+def get_negative_ttl(response):
+    """读取否定回答的缓存时间，授权部分无法解析时返回None"""
+    try:
+        return response.negative_ttl
+    except (IndexError, ValueError, struct.error):
+        return None
+
+def parse_dns_response(response_data, header_only=False):
+    """解析DNS响应报文
+    
+    接受bytes、bytearray或memoryview，全程在同一个memoryview上按偏移读取；
+    成功时返回 status/id/rcode/rcode_name/answers/answer_count，否则返回 status 为 error 的结果。
+    header_only为True时只解析头部，结果中没有answers，answer_count取自头部
+    """
+    try:
+        response = DnsResponse(response_data)
+    except ValueError as e:
+        return {
+            'status': 'error',
+            'message': str(e)
+        }
+    
+    # 检查是否为响应
+    if not response.is_response:
+        return {
+            'id': response.id,
+            'status': 'error',
+            'message': '不是DNS响应'
+        }
+    
+    # 检查响应码
+    rcode_name = response.rcode_name
+    if response.rcode != RCODE_NOERROR:
+        result = {
+            'id': response.id,
+            'status': 'error',
+            'rcode': response.rcode,
+            'rcode_name': rcode_name,
+            'message': f'DNS响应错误: {RCODE_MAP.get(response.rcode, rcode_name)}'
+        }
+        if response.rcode == RCODE_NXDOMAIN and not header_only:
+            negative_ttl = get_negative_ttl(response)
+            if negative_ttl is not None:
+                result['negative_ttl'] = negative_ttl
+        return result
+    
+    if header_only:
+        return {
+            'id': response.id,
+            'status': 'success',
+            'rcode': response.rcode,
+            'rcode_name': rcode_name,
+            'answer_count': response.ancount
+        }
+    
+    try:
+        answers = response.answers
+    except (IndexError, ValueError, struct.error) as e:
+        return {
+            'id': response.id,
+            'status': 'error',
+            'message': f'解析DNS响应失败: {str(e)}'
+        }
+    
+    result = {
+        'id': response.id,
+        'status': 'success',
+        'rcode': response.rcode,
+        'rcode_name': rcode_name,
+        'answers': answers,
+        'answer_count': len(answers)
+    }
+    
+    # 没有数据的否定回答(NODATA)，同样按SOA记录给出缓存时间
+    if not answers:
+        negative_ttl = get_negative_ttl(response)
+        if negative_ttl is not None:
+            result['negative_ttl'] = negative_ttl
+    return result
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+
+import socket
+import selectors
+import threading
+import time
+import json
+import math
+from collections import deque, Counter
+
+from dnscodec import QTYPE_MAP, HEADER, UINT16, RCODE_NAMES, get_qtype, get_query_template
+
+# 默认的发送套接字数量，每个套接字使用独立的临时端口和16位查询ID空间
+SOCKETS = 8
+
+# 同时未完成的最大查询数，达到后发送方暂停，实际QPS会低于目标QPS
+MAX_OUTSTANDING = 20000
+
+# 发送线程每次补发后的休眠时间(秒)
+SEND_TICK = 0.001
+
+# 延迟百分位
+PERCENTILES = (50, 90, 99, 99.9)
+
+def load_query_file(path):
+    """读取dnsperf格式的查询文件，每行为 "域名 [查询类型]"，忽略空行和#注释"""
+    queries = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            parts = line.split()
+            queries.append((parts[0], parts[1].upper() if len(parts) > 1 else 'A'))
+    return queries
+
+def parse_query_lines(lines):
+    """解析 "域名 [查询类型]" 格式的字符串列表"""
+    queries = []
+    for line in lines:
+        parts = line.split('#', 1)[0].split()
+        if parts:
+            queries.append((parts[0], parts[1].upper() if len(parts) > 1 else 'A'))
+    return queries
+
+def percentile(sorted_values, p):
+    """按最近秩法计算百分位，sorted_values必须已排序"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, math.ceil(p / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def latency_stats(latencies):
+    """汇总延迟列表，返回最小/平均/最大值和各百分位(毫秒)"""
+    if not latencies:
+        return {}
+    latencies = sorted(latencies)
+    stats = {
+        'min_rtt': round(latencies[0], 2),
+        'avg_rtt': round(sum(latencies) / len(latencies), 2),
+        'max_rtt': round(latencies[-1], 2)
+    }
+    for p in PERCENTILES:
+        stats['p%s_rtt' % str(p).replace('.', '')] = round(percentile(latencies, p), 2)
+    return stats
+
+def dns_load_test(server, port=53, queries=None, domain='example.com', query_type='A', qps=1000, duration=10,
+                  timeout=2000, sockets=SOCKETS, max_outstanding=MAX_OUTSTANDING):
+    """以固定目标QPS开环发送UDP DNS查询并统计结果
+    
+    queries为 (域名, 查询类型) 列表，按顺序循环发送；为空时只查询domain。发送不等待响应，
+    响应按 (套接字, 查询ID) 匹配；超过timeout毫秒未收到的查询计为超时。
+    results为每秒的统计，stats为整体统计
+    """
+    if not queries:
+        queries = [(domain, query_type)]
+    templates = [get_query_template(name, get_qtype(qtype)) for name, qtype in queries]
+    
+    family = socket.AF_INET6 if server.find(':') != -1 else socket.AF_INET
+    socks = []
+    for _ in range(max(1, sockets)):
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        sock.connect((server, port))
+        sock.setblocking(False)
+        socks.append(sock)
+    
+    # (套接字序号, 查询ID) -> 发送时间
+    outstanding = {}
+    # 按发送顺序记录 (发送时间, 键)，用于按顺序检查超时
+    send_order = deque()
+    
+    sent_by_second = Counter()
+    received_by_second = Counter()
+    timeouts_by_second = Counter()
+    rcodes_by_second = {}
+    latencies_by_second = {}
+    counters = {'send_errors': 0, 'unexpected': 0, 'stalled': 0}
+    
+    timeout_s = timeout / 1000.0
+    stop_sending = threading.Event()
+    start_time = time.time()
+    end_time = start_time + duration
+    
+    def sender():
+        sent = 0
+        next_ids = [0] * len(socks)
+        while not stop_sending.is_set():
+            now = time.time()
+            if now >= end_time:
+                break
+            # 开环发送: 补齐到当前时刻应发送的查询数，不等待响应
+            target = int((now - start_time) * qps)
+            second = int(now - start_time)
+            while sent < target:
+                if len(outstanding) >= max_outstanding:
+                    counters['stalled'] += 1
+                    break
+                index = sent % len(socks)
+                query_id = next_ids[index]
+                while (index, query_id) in outstanding:
+                    query_id = (query_id + 1) & 0xFFFF
+                next_ids[index] = (query_id + 1) & 0xFFFF
+                
+                packet = bytearray(templates[sent % len(templates)])
+                UINT16.pack_into(packet, 0, query_id)
+                key = (index, query_id)
+                send_time = time.time()
+                outstanding[key] = send_time
+                try:
+                    socks[index].send(packet)
+                except (BlockingIOError, OSError):
+                    outstanding.pop(key, None)
+                    counters['send_errors'] += 1
+                else:
+                    send_order.append((send_time, key))
+                    sent_by_second[second] += 1
+                sent += 1
+            time.sleep(SEND_TICK)
+    
+    sender_thread = threading.Thread(target=sender)
+    sender_thread.daemon = True
+    sender_thread.start()
+    
+    selector = selectors.DefaultSelector()
+    for index, sock in enumerate(socks):
+        selector.register(sock, selectors.EVENT_READ, index)
+    
+    try:
+        # 发送结束后继续接收，直到所有查询都有结果或超时
+        while sender_thread.is_alive() or outstanding:
+            for key, _ in selector.select(0.01):
+                sock = key.fileobj
+                index = key.data
+                while True:
+                    try:
+                        data = sock.recv(65535)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    except OSError:
+                        # ICMP端口不可达等错误，查询按超时处理
+                        break
+                    now = time.time()
+                    if len(data) < HEADER.size:
+                        counters['unexpected'] += 1
+                        continue
+                    query_id, flags = HEADER.unpack_from(data)[:2]
+                    send_time = outstanding.pop((index, query_id), None)
+                    if send_time is None:
+                        counters['unexpected'] += 1
+                        continue
+                    second = int(now - start_time)
+                    received_by_second[second] += 1
+                    rcode_name = RCODE_NAMES.get(flags & 0x0F, str(flags & 0x0F))
+                    rcodes_by_second.setdefault(second, Counter())[rcode_name] += 1
+                    latencies_by_second.setdefault(second, []).append((now - send_time) * 1000)
+            
+            # 按发送顺序检查超时
+            now = time.time()
+            while send_order and send_order[0][0] + timeout_s <= now:
+                send_time, key = send_order.popleft()
+                if outstanding.get(key) == send_time:
+                    del outstanding[key]
+                    timeouts_by_second[int(send_time + timeout_s - start_time)] += 1
+    finally:
+        stop_sending.set()
+        sender_thread.join()
+        selector.close()
+        for sock in socks:
+            sock.close()
+    
+    elapsed = min(time.time(), end_time) - start_time
+    
+    # 每秒统计
+    results = []
+    all_latencies = []
+    rcodes = Counter()
+    seconds = set(sent_by_second) | set(received_by_second) | set(timeouts_by_second)
+    for second in range(max(seconds) + 1 if seconds else 0):
+        latencies = latencies_by_second.get(second, [])
+        all_latencies.extend(latencies)
+        second_rcodes = rcodes_by_second.get(second, Counter())
+        rcodes.update(second_rcodes)
+        entry = {
+            'second': second + 1,
+            'sent': sent_by_second[second],
+            'received': received_by_second[second],
+            'timeouts': timeouts_by_second[second],
+            'rcodes': dict(second_rcodes)
+        }
+        entry.update(latency_stats(latencies))
+        results.append(entry)
+    
+    transmitted = sum(sent_by_second.values())
+    received = sum(received_by_second.values())
+    stats = {
+        'target_qps': qps,
+        'duration': round(elapsed, 2),
+        'transmitted': transmitted,
+        'received': received,
+        'timeouts': sum(timeouts_by_second.values()),
+        'loss': round((transmitted - received) * 100.0 / transmitted, 2) if transmitted > 0 else 0,
+        'send_qps': round(transmitted / elapsed, 1) if elapsed > 0 else 0,
+        'achieved_qps': round(received / elapsed, 1) if elapsed > 0 else 0,
+        'rcodes': dict(rcodes),
+        'send_errors': counters['send_errors'],
+        'unexpected': counters['unexpected'],
+        'stalled': counters['stalled']
+    }
+    stats.update(latency_stats(all_latencies))
+    
+    return {
+        'server': server,
+        'port': port,
+        'queries': len(queries),
+        'sockets': len(socks),
+        'results': results,
+        'stats': stats
+    }
+
+# 命令行接口，参数与dnsperf保持一致
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='UDP DNS 压力测试工具 (dnsperf风格)')
+    parser.add_argument('--server', '-s', default='127.0.0.1', help='DNS服务器IP (默认: 127.0.0.1)')
+    parser.add_argument('--port', '-p', type=int, default=53, help='DNS服务器端口 (默认: 53)')
+    parser.add_argument('--datafile', '-d', help='查询文件，每行为 "域名 [查询类型]"')
+    parser.add_argument('--name', '-n', default='example.com', help='未指定查询文件时查询的域名 (默认: example.com)')
+    parser.add_argument('--type', '-T', default='A', choices=list(QTYPE_MAP.keys()), help='未指定查询文件时的查询类型 (默认: A)')
+    parser.add_argument('--qps', '-Q', type=int, default=1000, help='目标QPS (默认: 1000)')
+    parser.add_argument('--limit', '-l', type=float, default=10, help='发送时长(秒) (默认: 10)')
+    parser.add_argument('--timeout', '-t', type=int, default=2000, help='查询超时(毫秒) (默认: 2000)')
+    parser.add_argument('--clients', '-c', type=int, default=SOCKETS, help=f'发送套接字数量 (默认: {SOCKETS})')
+    parser.add_argument('--outstanding', '-q', type=int, default=MAX_OUTSTANDING,
+                        help=f'最大未完成查询数 (默认: {MAX_OUTSTANDING})')
+    parser.add_argument('--json', '-j', action='store_true', help='以JSON格式输出结果')
+    
+    args = parser.parse_args()
+    
+    queries = load_query_file(args.datafile) if args.datafile else None
+    result = dns_load_test(args.server, args.port, queries, args.name, args.type, args.qps, args.limit,
+                           args.timeout, args.clients, args.outstanding)
+    
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"DNS压力测试: {args.server}:{args.port}, 目标QPS = {args.qps}, 查询 {result['queries']} 种\n")
+        
+        for entry in result['results']:
+            line = f"第 {entry['second']} 秒: 发送 = {entry['sent']}, 接收 = {entry['received']}, 超时 = {entry['timeouts']}"
+            if 'p50_rtt' in entry:
+                line += f", P50 = {entry['p50_rtt']:.2f} ms, P99 = {entry['p99_rtt']:.2f} ms"
+            if entry['rcodes']:
+                line += ", " + " ".join(f"{name}={count}" for name, count in sorted(entry['rcodes'].items()))
+            print(line)
+        
+        stats = result['stats']
+        print("\n统计信息:")
+        print(f"发送 = {stats['transmitted']}, 接收 = {stats['received']}, 超时 = {stats['timeouts']}, 丢包率 = {stats['loss']}%")
+        print(f"发送QPS = {stats['send_qps']}, 完成QPS = {stats['achieved_qps']}, 耗时 = {stats['duration']:.2f} s")
+        if stats['received'] > 0:
+            print(f"往返时间 (ms): 最小 = {stats['min_rtt']:.2f}, 平均 = {stats['avg_rtt']:.2f}, 最大 = {stats['max_rtt']:.2f}")
+            print(f"百分位 (ms): P50 = {stats['p50_rtt']:.2f}, P90 = {stats['p90_rtt']:.2f}, "
+                  f"P99 = {stats['p99_rtt']:.2f}, P99.9 = {stats['p999_rtt']:.2f}")
+        print("响应码: " + " ".join(f"{name}={count}" for name, count in sorted(stats['rcodes'].items())))
+        if stats['stalled'] or stats['send_errors']:
+            print(f"发送受阻 = {stats['stalled']}, 发送错误 = {stats['send_errors']}")
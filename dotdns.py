@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+
+import socket
+import ssl
+import struct
+import time
+import json
+
+from tcpdns import QTYPE_MAP, create_dns_query, parse_dns_response, recv_exact
+
+# DoT默认端口 (RFC 7858)
+DOT_PORT = 853
+
+# 流水线模式下同时未完成的最大查询数
+PIPELINE_WINDOW = 100
+
+class DotConnection(object):
+    """到DoT服务器的持久连接，重连时复用上一次的TLS会话(会话票据)"""
+    
+    def __init__(self, server, port=DOT_PORT, server_name=None, timeout=5, verify=True):
+        self.server = server
+        self.port = port
+        self.server_name = server_name or server
+        self.timeout = timeout
+        self.context = ssl.create_default_context()
+        if not verify:
+            self.context.check_hostname = False
+            self.context.verify_mode = ssl.CERT_NONE
+        self.session = None
+        self.sock = None
+    
+    def connect(self):
+        """建立TCP连接并完成TLS握手，返回握手信息(时间单位为毫秒)"""
+        family = socket.AF_INET6 if self.server.find(':') != -1 else socket.AF_INET
+        raw_sock = socket.socket(family, socket.SOCK_STREAM)
+        raw_sock.settimeout(self.timeout)
+        raw_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        
+        try:
+            start_time = time.time()
+            raw_sock.connect((self.server, self.port))
+            tcp_time = (time.time() - start_time) * 1000
+            
+            tls_start = time.time()
+            sock = self.context.wrap_socket(raw_sock, server_hostname=self.server_name,
+                                            session=self.session, do_handshake_on_connect=False)
+            sock.do_handshake()
+            tls_time = (time.time() - tls_start) * 1000
+        except:
+            raw_sock.close()
+            raise
+        
+        self.sock = sock
+        return {
+            'tcp_connect': round(tcp_time, 2),
+            'tls_handshake': round(tls_time, 2),
+            'resumed': sock.session_reused,
+            'tls_version': sock.version()
+        }
+    
+    def close(self):
+        if self.sock is not None:
+            # TLS 1.3 的会话票据在握手之后才到达，关闭前保存以便下次恢复会话
+            self.session = self.sock.session or self.session
+            try:
+                self.sock.close()
+            except (OSError, ssl.SSLError):
+                pass
+            self.sock = None
+    
+    def read_response(self):
+        """读取一个带长度前缀的响应，连接关闭时返回None"""
+        length_bytes = recv_exact(self.sock, 2)
+        if len(length_bytes) < 2:
+            return None
+        response_length = struct.unpack('!H', length_bytes)[0]
+        response_data = recv_exact(self.sock, response_length)
+        if len(response_data) < response_length:
+            return None
+        return response_data
+    
+    def query(self, domain, query_type='A'):
+        """在持久连接上执行一次查询，需要时先建立连接；查询RTT不包含握手时间"""
+        handshake = None
+        try:
+            if self.sock is None:
+                handshake = self.connect()
+            
+            query_id, query_packet = create_dns_query(domain, query_type)
+            start_time = time.time()
+            self.sock.sendall(query_packet)
+            
+            # 跳过ID不匹配的响应
+            while True:
+                response_data = self.read_response()
+                if response_data is None:
+                    self.close()
+                    result = {'status': 'error', 'message': '连接被服务器关闭'}
+                    break
+                if struct.unpack_from('!H', response_data)[0] == query_id:
+                    rtt = (time.time() - start_time) * 1000
+                    result = parse_dns_response(response_data)
+                    if result['status'] == 'success':
+                        result['rtt'] = rtt
+                    break
+        except socket.timeout:
+            self.close()
+            result = {'status': 'timeout', 'message': 'DNS查询超时'}
+        except (socket.error, ssl.SSLError) as e:
+            self.close()
+            result = {'status': 'error', 'message': f'DoT错误: {str(e)}'}
+        
+        if handshake is not None:
+            result['handshake'] = handshake
+        return result
+    
+    def pipeline(self, domain, query_type='A', count=5, window=PIPELINE_WINDOW):
+        """在一个连接上连续发送count个查询，最多window个未完成，按查询ID匹配乱序响应"""
+        results = [None] * count
+        handshake = None
+        error = None
+        try:
+            if self.sock is None:
+                handshake = self.connect()
+            
+            pending = {}
+            sent = 0
+            received = 0
+            while received < count:
+                # 填满发送窗口
+                while sent < count and len(pending) < window:
+                    query_id, query_packet = create_dns_query(domain, query_type)
+                    if query_id in pending:
+                        continue
+                    pending[query_id] = (sent, time.time())
+                    self.sock.sendall(query_packet)
+                    sent += 1
+                
+                response_data = self.read_response()
+                if response_data is None:
+                    self.close()
+                    break
+                entry = pending.pop(struct.unpack_from('!H', response_data)[0], None)
+                if entry is None:
+                    continue
+                seq, start_time = entry
+                result = parse_dns_response(response_data)
+                if result['status'] == 'success':
+                    result['rtt'] = (time.time() - start_time) * 1000
+                results[seq] = result
+                received += 1
+        except socket.timeout:
+            self.close()
+        except (socket.error, ssl.SSLError) as e:
+            self.close()
+            error = f'DoT错误: {str(e)}'
+        
+        for i in range(count):
+            if results[i] is None:
+                if error:
+                    results[i] = {'status': 'error', 'message': error}
+                else:
+                    results[i] = {'status': 'timeout', 'message': 'DNS查询超时'}
+        return results, handshake
+
+def dot_dns_test(domain, server, port=DOT_PORT, query_type='A', count=5, interval=1000,
+                 server_name=None, verify=True, pipeline=False, reconnect=False):
+    """执行多次DoT查询测试
+    
+    默认在一个持久连接上依次查询；reconnect为True时每次查询后断开并复用TLS会话重连，
+    用于测量会话恢复的握手开销；pipeline为True时在一个连接上连续发送所有查询
+    """
+    conn = DotConnection(server, port, server_name, verify=verify)
+    handshakes = []
+    start_time = time.time()
+    
+    try:
+        if pipeline:
+            results, handshake = conn.pipeline(domain, query_type, count)
+            if handshake is not None and results:
+                handshakes.append(handshake)
+                results[0]['handshake'] = handshake
+        else:
+            results = []
+            for i in range(count):
+                result = conn.query(domain, query_type)
+                results.append(result)
+                if 'handshake' in result:
+                    handshakes.append(result['handshake'])
+                if reconnect:
+                    conn.close()
+                
+                # 等待指定的间隔时间
+                if i < count - 1:
+                    time.sleep(interval / 1000)  # 转换为秒
+    finally:
+        conn.close()
+    
+    duration = (time.time() - start_time) * 1000
+    
+    rtts = []
+    for i, result in enumerate(results):
+        result['seq'] = i + 1
+        if result['status'] == 'success':
+            rtts.append(result['rtt'])
+    
+    # 计算统计信息
+    stats = {
+        'transmitted': count,
+        'received': len(rtts),
+        'loss': 0 if count == 0 else round((count - len(rtts)) / count * 100, 1),
+        'handshakes': len(handshakes),
+        'resumed': sum(1 for h in handshakes if h['resumed'])
+    }
+    
+    if rtts:
+        stats['min_rtt'] = round(min(rtts), 2)
+        stats['avg_rtt'] = round(sum(rtts) / len(rtts), 2)
+        stats['max_rtt'] = round(max(rtts), 2)
+    
+    # 分别统计完整握手和会话恢复握手的耗时
+    if handshakes:
+        stats['avg_tcp_connect'] = round(sum(h['tcp_connect'] for h in handshakes) / len(handshakes), 2)
+    full = [h['tls_handshake'] for h in handshakes if not h['resumed']]
+    resumed = [h['tls_handshake'] for h in handshakes if h['resumed']]
+    if full:
+        stats['avg_tls_handshake_full'] = round(sum(full) / len(full), 2)
+    if resumed:
+        stats['avg_tls_handshake_resumed'] = round(sum(resumed) / len(resumed), 2)
+    
+    if pipeline:
+        stats['duration'] = round(duration, 2)
+        stats['qps'] = round(len(rtts) / (duration / 1000), 1) if duration > 0 else 0
+    
+    return {
+        'domain': domain,
+        'server': server,
+        'port': port,
+        'query_type': query_type,
+        'results': results,
+        'stats': stats
+    }
+
+# 命令行接口
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='DNS over TLS (DoT) 查询工具')
+    parser.add_argument('domain', help='要查询的域名')
+    parser.add_argument('--server', '-s', default='8.8.8.8', help='DoT服务器IP (默认: 8.8.8.8)')
+    parser.add_argument('--port', '-p', type=int, default=DOT_PORT, help=f'DoT服务器端口 (默认: {DOT_PORT})')
+    parser.add_argument('--name', '-n', help='用于SNI和证书校验的服务器名称 (默认与服务器IP相同)')
+    parser.add_argument('--insecure', '-k', action='store_true', help='不校验服务器证书')
+    parser.add_argument('--type', '-t', default='A', choices=list(QTYPE_MAP.keys()), help='查询类型 (默认: A)')
+    parser.add_argument('--count', '-c', type=int, default=5, help='查询次数 (默认: 5)')
+    parser.add_argument('--interval', '-i', type=int, default=1000, help='查询间隔(毫秒) (默认: 1000)')
+    parser.add_argument('--pipeline', '-P', action='store_true', help='在单个连接上连续发送所有查询')
+    parser.add_argument('--reconnect', '-r', action='store_true', help='每次查询后断开，重连时恢复TLS会话')
+    parser.add_argument('--json', '-j', action='store_true', help='以JSON格式输出结果')
+    
+    args = parser.parse_args()
+    
+    result = dot_dns_test(args.domain, args.server, args.port, args.type, args.count, args.interval,
+                          args.name, not args.insecure, args.pipeline, args.reconnect)
+    
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"DoT DNS查询: {args.domain} ({args.type})")
+        print(f"DoT服务器: {args.server}:{args.port}\n")
+        
+        for query in result['results']:
+            if 'handshake' in query:
+                handshake = query['handshake']
+                print(f"握手: TCP = {handshake['tcp_connect']:.2f} ms, TLS = {handshake['tls_handshake']:.2f} ms, "
+                      f"{handshake['tls_version']}, 会话恢复 = {handshake['resumed']}")
+            if query['status'] == 'success':
+                print(f"查询 {query['seq']}: 成功，RTT = {query['rtt']:.2f} ms，找到 {len(query['answers'])} 条记录")
+                for answer in query['answers']:
+                    print(f"  {answer['name']} {answer['ttl']} IN {answer['type']} {answer['data']}")
+            else:
+                print(f"查询 {query['seq']}: {query['status']} - {query.get('message', '未知错误')}")
+        
+        print("\n统计信息:")
+        stats = result['stats']
+        print(f"发送 = {stats['transmitted']}, 接收 = {stats['received']}, 丢包率 = {stats['loss']}%")
+        
+        if stats['received'] > 0:
+            print(f"往返时间 (ms): 最小 = {stats['min_rtt']:.2f}, 平均 = {stats['avg_rtt']:.2f}, 最大 = {stats['max_rtt']:.2f}")
+        
+        print(f"握手次数 = {stats['handshakes']}, 会话恢复 = {stats['resumed']}")
+        if 'avg_tls_handshake_full' in stats:
+            print(f"完整TLS握手平均 = {stats['avg_tls_handshake_full']:.2f} ms")
+        if 'avg_tls_handshake_resumed' in stats:
+            print(f"恢复TLS握手平均 = {stats['avg_tls_handshake_resumed']:.2f} ms")
+        if 'qps' in stats:
+            print(f"总耗时 = {stats['duration']:.2f} ms, QPS = {stats['qps']}")
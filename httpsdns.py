@@ -1,36 +1,24 @@
 #!/usr/bin/env python
 
 import requests
+import urllib3
 import json
 import time
 import sys
 import base64
-import struct
-import socket
-
-# DNS查询类型常量
-QTYPE_A = 1      # IPv4地址
-QTYPE_NS = 2     # 域名服务器
-QTYPE_CNAME = 5  # 规范名称
-QTYPE_SOA = 6    # 权威记录开始
-QTYPE_PTR = 12   # 指针记录
-QTYPE_MX = 15    # 邮件交换
-QTYPE_TXT = 16   # 文本记录
-QTYPE_AAAA = 28  # IPv6地址
-QTYPE_ANY = 255  # 任何记录
-
-# 查询类型映射
-QTYPE_MAP = {
-    'A': QTYPE_A,
-    'NS': QTYPE_NS,
-    'CNAME': QTYPE_CNAME,
-    'SOA': QTYPE_SOA,
-    'PTR': QTYPE_PTR,
-    'MX': QTYPE_MX,
-    'TXT': QTYPE_TXT,
-    'AAAA': QTYPE_AAAA,
-    'ANY': QTYPE_ANY
-}
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import OrderedDict
+
+# HTTP/2 传输依赖 httpx[http2]，未安装时只能使用HTTP/1.1
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from dnscodec import (QTYPE_A, QTYPE_AAAA, QTYPE_SOA, QTYPE_MAP, QTYPE_NAMES, RCODE_NXDOMAIN, build_query,
+                      parse_dns_response)
+from rtt import get_estimator, query_with_retries
 
 # 默认DoH服务器
 DEFAULT_DOH_SERVERS = {
@@ -39,39 +27,144 @@ DEFAULT_DOH_SERVERS = {
     'Quad9': 'https://dns.quad9.net/dns-query'
 }
 
-def encode_domain_name(domain):
-    """将域名编码为DNS查询格式"""
-    result = b''
-    for part in domain.split('.'):
-        result += struct.pack('B', len(part)) + part.encode('ascii')
-    result += b'\x00'  # 以0字节结束
-    return result
+# 每个DoH URL的连接池大小
+POOL_MAXSIZE = 10
+
+# 按DoH URL共享的会话，跨查询和跨测试复用TCP/TLS连接
+_sessions = {}
+_session_pool_sizes = {}
+_sessions_lock = threading.Lock()
+
+# 当前线程最近一次请求是否新建了连接；连接总是在发起请求的线程中建立，并发请求之间互不影响
+_connection_state = threading.local()
+
+class _TrackingPoolMixin(object):
+    """新建连接时在当前线程上做标记"""
+    
+    def _new_conn(self):
+        _connection_state.new_connection = True
+        return super()._new_conn()
+
+class _TrackingHTTPConnectionPool(_TrackingPoolMixin, urllib3.HTTPConnectionPool):
+    pass
+
+class _TrackingHTTPSConnectionPool(_TrackingPoolMixin, urllib3.HTTPSConnectionPool):
+    pass
+
+class _TrackingAdapter(requests.adapters.HTTPAdapter):
+    """使用能记录新建连接的连接池的适配器"""
+    
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TrackingHTTPConnectionPool,
+            'https': _TrackingHTTPSConnectionPool
+        }
 
-def create_dns_wire_format(domain, query_type='A'):
-    """创建DNS查询的二进制格式（wire format）"""
-    # 获取查询类型的数值
-    qtype_value = QTYPE_MAP.get(query_type, QTYPE_A)
+def get_session(doh_url, pool_maxsize=None):
+    """获取指定DoH URL的共享会话，pool_maxsize大于当前连接池时扩大连接池
     
-    # 生成随机查询ID
-    query_id = 0x1234  # 固定ID，因为DoH服务器会忽略它
+    扩大连接池时换上新的适配器并关闭旧的，旧适配器中的空闲连接随之关闭，之后的请求会新建连接
+    """
+    pool_maxsize = max(pool_maxsize or 0, POOL_MAXSIZE)
+    with _sessions_lock:
+        session = _sessions.get(doh_url)
+        if session is None:
+            session = requests.Session()
+            _sessions[doh_url] = session
+            _session_pool_sizes[doh_url] = 0
+        if _session_pool_sizes[doh_url] < pool_maxsize:
+            old_adapter = session.adapters.get('https://') if _session_pool_sizes[doh_url] else None
+            adapter = _TrackingAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session_pool_sizes[doh_url] = pool_maxsize
+            if old_adapter is not None:
+                old_adapter.close()
+        return session
+
+def close_sessions():
+    """关闭所有共享会话及其连接"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _session_pool_sizes.clear()
+    with _h2_clients_lock:
+        for client in _h2_clients.values():
+            client.close()
+        _h2_clients.clear()
+
+def doh_request(method, doh_url, pooled=True, **kwargs):
+    """发送DoH请求，返回 (响应, 是否新建了连接)
     
-    # 构建DNS头部
-    # ID, 标志, 问题数, 回答数, 授权记录数, 附加记录数
-    header = struct.pack('!HHHHHH', query_id, 0x0100, 1, 0, 0, 0)
+    pooled为True时使用共享会话，保持连接(keep-alive)；否则每次请求独立建立连接
+    """
+    if not pooled:
+        return requests.request(method, doh_url, **kwargs), True
     
-    # 构建问题部分
-    question = encode_domain_name(domain) + struct.pack('!HH', qtype_value, 1)  # 查询类型和查询类(IN)
+    session = get_session(doh_url)
+    _connection_state.new_connection = False
+    response = session.request(method, doh_url, **kwargs)
+    return response, _connection_state.new_connection
+
+# 按DoH URL共享的HTTP/2客户端，各线程的查询作为同一个连接上的不同流并发发送
+_h2_clients = {}
+_h2_clients_lock = threading.Lock()
+
+def get_h2_client(doh_url):
+    """获取指定DoH URL的共享HTTP/2客户端"""
+    with _h2_clients_lock:
+        client = _h2_clients.get(doh_url)
+        if client is None:
+            client = httpx.Client(http2=True)
+            _h2_clients[doh_url] = client
+        return client
+
+def h2_request(method, doh_url, **kwargs):
+    """通过共享的HTTP/2客户端发送DoH请求，返回 (响应, 是否新建了连接)
+    
+    是否新建连接由本次请求的httpcore跟踪事件判断，不受其他线程的请求影响
+    """
+    events = []
+    
+    def trace(name, info):
+        if name == 'connection.connect_tcp.started':
+            events.append(name)
+    
+    response = get_h2_client(doh_url).request(method, doh_url, extensions={'trace': trace}, **kwargs)
+    return response, bool(events)
+
+def create_dns_wire_format(domain, query_type='A', query_id=0x1234):
+    """创建DNS查询的二进制格式（wire format）
     
-    # 组合完整的查询包
-    return header + question
+    DoH服务器会忽略查询ID，因此使用固定值；GET请求应使用0以便HTTP缓存命中(RFC 8484)
+    """
+    return bytes(build_query(domain, query_type, query_id)[1])
+
+def get_json_negative_ttl(json_data):
+    """从JSON响应授权部分的SOA记录取否定回答的缓存时间(RFC 2308)，没有SOA记录时返回None"""
+    for record in json_data.get('Authority', []):
+        if record.get('type') == QTYPE_SOA:
+            try:
+                return min(record.get('TTL', 0), int(record.get('data', '').rsplit(' ', 1)[1]))
+            except (IndexError, ValueError):
+                return None
+    return None
 
 def parse_json_response(json_data, query_type):
     """解析DoH JSON响应"""
     if 'Status' in json_data and json_data['Status'] != 0:
-        return {
+        result = {
             'status': 'error',
+            'rcode': json_data['Status'],
             'message': f'DNS响应错误: 状态码 {json_data["Status"]}'
         }
+        if json_data['Status'] == RCODE_NXDOMAIN:
+            negative_ttl = get_json_negative_ttl(json_data)
+            if negative_ttl is not None:
+                result['negative_ttl'] = negative_ttl
+        return result
     
     answers = []
     if 'Answer' in json_data:
@@ -87,17 +180,91 @@ def parse_json_response(json_data, query_type):
             
             answers.append({
                 'name': answer.get('name', '').rstrip('.'),
-                'type': {v: k for k, v in QTYPE_MAP.items()}.get(record_type, str(record_type)),
+                'type': QTYPE_NAMES.get(record_type, str(record_type)),
                 'ttl': answer.get('TTL', 0),
                 'data': record_data
             })
     
-    return {
+    result = {
         'status': 'success',
         'answers': answers
     }
+    if not answers:
+        negative_ttl = get_json_negative_ttl(json_data)
+        if negative_ttl is not None:
+            result['negative_ttl'] = negative_ttl
+    return result
+
+# 本地HTTP缓存，按 (DoH URL, base64url编码的查询) 保存仍然新鲜的GET响应
+HTTP_CACHE_MAXSIZE = 1024
+_http_cache = OrderedDict()
+_http_cache_lock = threading.Lock()
 
-def https_dns_query(domain, doh_url=None, query_type='A', timeout=5):
+def parse_cache_control(value):
+    """解析Cache-Control头部，返回 {指令: 参数或True}"""
+    directives = {}
+    for part in (value or '').split(','):
+        name, _, argument = part.strip().partition('=')
+        if name:
+            directives[name.strip().lower()] = argument.strip().strip('"') or True
+    return directives
+
+def get_cache_info(response):
+    """从HTTP响应中提取缓存相关的头部"""
+    cache_control = response.headers.get('Cache-Control')
+    directives = parse_cache_control(cache_control)
+    
+    try:
+        max_age = int(directives['max-age'])
+    except (KeyError, TypeError, ValueError):
+        max_age = None
+    try:
+        age = int(response.headers.get('Age'))
+    except (TypeError, ValueError):
+        age = None
+    
+    return {
+        'cache_control': cache_control,
+        'max_age': max_age,
+        'age': age,
+        # Age大于0说明响应来自CDN或中间缓存
+        'edge_hit': age is not None and age > 0,
+        'no_store': 'no-store' in directives or 'no-cache' in directives
+    }
+
+def http_cache_get(key):
+    """读取本地HTTP缓存中仍然新鲜的响应，没有时返回None"""
+    with _http_cache_lock:
+        entry = _http_cache.get(key)
+        if entry is None:
+            return None
+        expires, content = entry
+        if expires <= time.time():
+            del _http_cache[key]
+            return None
+        _http_cache.move_to_end(key)
+        return content
+
+def http_cache_put(key, content, cache_info):
+    """按 max-age 减去 Age 的剩余新鲜时间保存响应"""
+    if cache_info['no_store'] or cache_info['max_age'] is None:
+        return
+    freshness = cache_info['max_age'] - (cache_info['age'] or 0)
+    if freshness <= 0:
+        return
+    
+    with _http_cache_lock:
+        _http_cache[key] = (time.time() + freshness, content)
+        _http_cache.move_to_end(key)
+        while len(_http_cache) > HTTP_CACHE_MAXSIZE:
+            _http_cache.popitem(last=False)
+
+def clear_http_cache():
+    """清空本地HTTP缓存"""
+    with _http_cache_lock:
+        _http_cache.clear()
+
+def https_dns_query(domain, doh_url=None, query_type='A', timeout=5, pooled=True):
     """执行单次HTTPS DNS查询"""
     start_time = time.time()
     
@@ -119,7 +286,7 @@ def https_dns_query(domain, doh_url=None, query_type='A', timeout=5):
         
         # 发送GET请求
         try:
-            response = requests.get(doh_url, headers=headers, params=params, timeout=timeout)
+            response, cold = doh_request('GET', doh_url, pooled, headers=headers, params=params, timeout=timeout)
         except requests.exceptions.ConnectionError as e:
             return {
                 'status': 'error',
@@ -159,6 +326,7 @@ def https_dns_query(domain, doh_url=None, query_type='A', timeout=5):
         
         if result['status'] == 'success':
             result['rtt'] = rtt
+            result['cold'] = cold
         
         return result
     
@@ -168,8 +336,20 @@ def https_dns_query(domain, doh_url=None, query_type='A', timeout=5):
             'message': f'查询错误: {str(e)}'
         }
 
-def https_dns_query_wire_format(domain, doh_url=None, query_type='A', timeout=5):
-    """使用二进制格式执行HTTPS DNS查询"""
+def https_dns_query_wire_format(domain, doh_url=None, query_type='A', timeout=5, pooled=True, method='POST', use_cache=False,
+                                http2=False):
+    """使用二进制格式执行HTTPS DNS查询
+    
+    method为GET时按RFC 8484以 ?dns=<base64url> 发送ID为0的查询，可被HTTP缓存；
+    use_cache为True时先查本地HTTP缓存，只对GET生效；
+    http2为True时通过该URL共享的HTTP/2连接发送(需要 httpx[http2])，此时忽略pooled
+    """
+    if http2 and httpx is None:
+        return {
+            'status': 'error',
+            'message': '使用HTTP/2需要安装 httpx[http2]'
+        }
+    
     start_time = time.time()
     
     # 如果没有提供DoH URL，使用Google的默认服务
@@ -177,73 +357,89 @@ def https_dns_query_wire_format(domain, doh_url=None, query_type='A', timeout=5)
         doh_url = DEFAULT_DOH_SERVERS['Google']
     
     try:
-        # 创建DNS查询的二进制格式
-        dns_wire = create_dns_wire_format(domain, query_type)
-        
-        # 准备请求头
-        headers = {
-            'Accept': 'application/dns-message',
-            'Content-Type': 'application/dns-message'
-        }
+        cache_key = None
+        cache_info = None
+        cold = False
+        binary_response = None
         
-        # 发送POST请求
-        try:
-            response = requests.post(doh_url, headers=headers, data=dns_wire, timeout=timeout)
-        except requests.exceptions.ConnectionError as e:
-            return {
-                'status': 'error',
-                'message': f'连接错误: {str(e)}'
-            }
-        except requests.exceptions.Timeout:
-            return {
-                'status': 'timeout',
-                'message': 'DNS查询超时'
-            }
-        except requests.exceptions.RequestException as e:
-            return {
-                'status': 'error',
-                'message': f'请求错误: {str(e)}'
-            }
+        if method == 'GET':
+            # 创建ID为0的查询，并进行无填充的base64url编码
+            dns_wire = create_dns_wire_format(domain, query_type, query_id=0)
+            encoded = base64.urlsafe_b64encode(dns_wire).rstrip(b'=').decode('ascii')
+            if use_cache:
+                cache_key = (doh_url, encoded)
+                binary_response = http_cache_get(cache_key)
+        else:
+            # 创建DNS查询的二进制格式
+            dns_wire = create_dns_wire_format(domain, query_type)
         
-        # 检查响应状态
-        if response.status_code != 200:
-            return {
-                'status': 'error',
-                'message': f'HTTP错误: {response.status_code} - {response.reason}'
-            }
+        cache_hit = binary_response is not None
         
-        # 解析二进制响应
-        binary_response = response.content
+        if not cache_hit:
+            # 发送GET或POST请求
+            try:
+                if http2:
+                    if method == 'GET':
+                        response, cold = h2_request('GET', doh_url, params={'dns': encoded}, timeout=timeout,
+                                                    headers={'Accept': 'application/dns-message'})
+                    else:
+                        response, cold = h2_request('POST', doh_url, content=dns_wire, timeout=timeout, headers={
+                            'Accept': 'application/dns-message',
+                            'Content-Type': 'application/dns-message'
+                        })
+                elif method == 'GET':
+                    response, cold = doh_request('GET', doh_url, pooled, params={'dns': encoded}, timeout=timeout,
+                                                 headers={'Accept': 'application/dns-message'})
+                else:
+                    response, cold = doh_request('POST', doh_url, pooled, data=dns_wire, timeout=timeout, headers={
+                        'Accept': 'application/dns-message',
+                        'Content-Type': 'application/dns-message'
+                    })
+            except requests.exceptions.ConnectionError as e:
+                return {
+                    'status': 'error',
+                    'message': f'连接错误: {str(e)}'
+                }
+            except requests.exceptions.Timeout:
+                return {
+                    'status': 'timeout',
+                    'message': 'DNS查询超时'
+                }
+            except requests.exceptions.RequestException as e:
+                return {
+                    'status': 'error',
+                    'message': f'请求错误: {str(e)}'
+                }
+            except Exception as e:
+                # httpx的异常，HTTP/2传输时才会出现
+                if httpx is None or not isinstance(e, httpx.HTTPError):
+                    raise
+                if isinstance(e, httpx.TimeoutException):
+                    return {
+                        'status': 'timeout',
+                        'message': 'DNS查询超时'
+                    }
+                return {
+                    'status': 'error',
+                    'message': f'请求错误: {str(e)}'
+                }
         
-        # 检查响应长度
-        if len(binary_response) < 12:
-            return {
-                'status': 'error',
-                'message': f'响应数据太短: 只有{len(binary_response)}字节'
-            }
-            
-        try:
-            header = struct.unpack('!HHHHHH', binary_response[:12])
-            flags = header[1]
-            rcode = flags & 0x0F
-            
-            if rcode != 0:
+            # 检查响应状态
+            if response.status_code != 200:
+                reason = response.reason_phrase if http2 else response.reason
                 return {
                     'status': 'error',
-                    'message': f'DNS响应错误: 状态码 {rcode}'
+                    'message': f'HTTP错误: {response.status_code} - {reason}'
                 }
-        except struct.error as e:
-            return {
-                'status': 'error',
-                'message': f'解析DNS头部失败: {str(e)}'
-            }
         
+            binary_response = response.content
+            cache_info = get_cache_info(response)
+            if cache_key is not None:
+                http_cache_put(cache_key, binary_response, cache_info)
+    
         # 计算往返时间
         rtt = (time.time() - start_time) * 1000  # 毫秒
         
-        # 导入解析DNS响应的函数
-        from udpdns import parse_dns_response
-        
         # 解析二进制响应
         parsed = parse_dns_response(binary_response)
         
@@ -252,6 +448,12 @@ def https_dns_query_wire_format(domain, doh_url=None, query_type='A', timeout=5)
         
         # 添加RTT信息
         parsed['rtt'] = rtt
+        parsed['cold'] = cold
+        parsed['cache_hit'] = cache_hit
+        if cache_info is not None:
+            parsed['http_cache'] = cache_info
+        if http2 and not cache_hit:
+            parsed['http_version'] = response.http_version
         return parsed
     
     except Exception as e:
@@ -260,8 +462,15 @@ def https_dns_query_wire_format(domain, doh_url=None, query_type='A', timeout=5)
             'message': f'查询错误: {str(e)}'
         }
 
-def https_dns_test(domain, doh_url=None, query_type='A', count=5, interval=1000, use_wire_format=False):
-    """执行多次HTTPS DNS查询测试"""
+def https_dns_test(domain, doh_url=None, query_type='A', count=5, interval=1000, use_wire_format=False, pooled=True, concurrency=1,
+                   wire_method='POST', use_cache=False, retries=0, timeout=5, http2=False):
+    """执行多次HTTPS DNS查询测试
+    
+    concurrency大于1时使用线程池并发执行查询，interval为相邻两次查询开始的间隔；
+    wire_method和use_cache用于二进制格式，见 https_dns_query_wire_format；
+    http2为True时使用二进制格式，所有查询作为一个HTTP/2连接上的流发送，concurrency即同时进行的流数；
+    retries大于0时每次等待时间由该DoH URL的RTT估计器给出，超时后重试，timeout为单次查询的总超时(秒)
+    """
     results = []
     rtts = []
     transmitted = 0
@@ -271,34 +480,243 @@ def https_dns_test(domain, doh_url=None, query_type='A', count=5, interval=1000,
     if not doh_url:
         doh_url = DEFAULT_DOH_SERVERS['Google']
     
-    for i in range(count):
+    estimator = get_estimator('https', doh_url)
+    
+    if http2:
+        if httpx is None:
+            return {'error': '使用HTTP/2需要安装 httpx[http2]'}
+        use_wire_format = True
+    
+    def query_once(attempt_timeout):
+        if use_wire_format:
+            return https_dns_query_wire_format(domain, doh_url, query_type, attempt_timeout, pooled=pooled,
+                                               method=wire_method, use_cache=use_cache, http2=http2)
+        return https_dns_query(domain, doh_url, query_type, attempt_timeout, pooled=pooled)
+    
+    def run_query(seq):
+        # 执行查询
+        result = query_with_retries(query_once, estimator, retries, timeout)
+        result['seq'] = seq
+        return result
+    
+    start_time = time.time()
+    
+    if concurrency <= 1:
+        for i in range(count):
+            results.append(run_query(i + 1))
+            
+            # 等待指定的间隔时间
+            if i < count - 1:
+                time.sleep(interval / 1000)  # 转换为秒
+    else:
+        # 连接池至少要容纳所有并发的查询
+        if pooled and not http2:
+            get_session(doh_url, concurrency)
+        
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = []
+            if http2 and count > 0:
+                # 第一个查询单独发送，建立连接并完成HTTP/2协商，后续查询作为同一连接上的流并发发送
+                futures.append(executor.submit(run_query, 1))
+                futures[0].result()
+            for i in range(len(futures), count):
+                futures.append(executor.submit(run_query, i + 1))
+                if interval > 0 and i < count - 1:
+                    time.sleep(interval / 1000)
+            results = [future.result() for future in futures]
+    
+    duration = (time.time() - start_time) * 1000
+    
+    for result in results:
         transmitted += 1
         
-        # 执行查询
+        # 统计成功的查询
+        if result['status'] == 'success':
+            received += 1
+            rtts.append(result['rtt'])
+    
+    # 计算统计信息
+    stats = {
+        'transmitted': transmitted,
+        'received': received,
+        'loss': 0 if transmitted == 0 else round((transmitted - received) / transmitted * 100, 1),
+        'concurrency': max(concurrency, 1),
+        'duration': round(duration, 2),
+        'qps': round(received / (duration / 1000), 1) if duration > 0 else 0,
+        'retries': sum(r['attempts'] - 1 for r in results),
+        'rtt_estimator': estimator.snapshot()
+    }
+    
+    if rtts:
+        stats['min_rtt'] = round(min(rtts), 2)
+        stats['avg_rtt'] = round(sum(rtts) / len(rtts), 2)
+        stats['max_rtt'] = round(max(rtts), 2)
+    
+    # 分别统计新建连接(冷)和复用连接(热)的查询延迟，本地缓存命中不计入
+    cold_rtts = [r['rtt'] for r in results if r['status'] == 'success' and r.get('cold')]
+    warm_rtts = [r['rtt'] for r in results if r['status'] == 'success' and not r.get('cold') and not r.get('cache_hit')]
+    stats['cold_count'] = len(cold_rtts)
+    stats['warm_count'] = len(warm_rtts)
+    if cold_rtts:
+        stats['cold_avg_rtt'] = round(sum(cold_rtts) / len(cold_rtts), 2)
+    if warm_rtts:
+        stats['warm_min_rtt'] = round(min(warm_rtts), 2)
+        stats['warm_avg_rtt'] = round(sum(warm_rtts) / len(warm_rtts), 2)
+        stats['warm_max_rtt'] = round(max(warm_rtts), 2)
+    
+    # 本地缓存命中和CDN/中间缓存命中(Age > 0)的次数
+    if use_wire_format:
+        stats['cache_hits'] = sum(1 for r in results if r.get('cache_hit'))
+        stats['edge_hits'] = sum(1 for r in results if r.get('http_cache', {}).get('edge_hit'))
+    
+    if http2:
+        stats['http_version'] = next((r['http_version'] for r in results if 'http_version' in r), None)
+    
+    return {
+        'domain': domain,
+        'doh_url': doh_url,
+        'query_type': query_type,
+        'results': results,
+        'stats': stats
+    }
+
+# 提供商选择: EWMA平滑系数、连续失败多少次视为不健康、不健康后多久重新尝试(秒)
+EWMA_ALPHA = 0.3
+MAX_CONSECUTIVE_FAILURES = 3
+UNHEALTHY_RETRY_AFTER = 30
+
+class DohProviderSelector(object):
+    """为每个DoH提供商维护EWMA延迟和失败估计，把查询发往当前最快的健康提供商"""
+    
+    def __init__(self, providers=None, alpha=EWMA_ALPHA, max_failures=MAX_CONSECUTIVE_FAILURES,
+                 retry_after=UNHEALTHY_RETRY_AFTER):
+        self.providers = dict(providers or DEFAULT_DOH_SERVERS)
+        self.alpha = alpha
+        self.max_failures = max_failures
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=2 * len(self.providers))
+        self.state = {}
+        for name in self.providers:
+            self.state[name] = {'ewma_rtt': None, 'failures': 0, 'queries': 0, 'errors': 0, 'down_until': 0}
+    
+    def record(self, name, result):
+        """根据一次查询结果更新提供商的延迟和失败估计"""
+        with self.lock:
+            state = self.state[name]
+            state['queries'] += 1
+            if result['status'] == 'success':
+                rtt = result['rtt']
+                if state['ewma_rtt'] is None:
+                    state['ewma_rtt'] = rtt
+                else:
+                    state['ewma_rtt'] += self.alpha * (rtt - state['ewma_rtt'])
+                state['failures'] = 0
+                state['down_until'] = 0
+            else:
+                state['errors'] += 1
+                state['failures'] += 1
+                if state['failures'] >= self.max_failures:
+                    state['down_until'] = time.time() + self.retry_after
+    
+    def ranked(self):
+        """按优先级排列提供商
+        
+        从未查询过的优先探测，其余健康的按EWMA延迟升序(连续失败会放大延迟估计)，
+        从未成功过的排在其后，不健康的排在最后
+        """
+        now = time.time()
+        with self.lock:
+            def priority(name):
+                state = self.state[name]
+                if state['down_until'] > now:
+                    return (2, state['down_until'])
+                if state['queries'] == 0:
+                    return (0, 0)
+                if state['ewma_rtt'] is None:
+                    return (1, state['failures'])
+                return (0, state['ewma_rtt'] * (1 + state['failures']))
+            return sorted(self.providers, key=priority)
+    
+    def _query(self, name, domain, query_type, use_wire_format, timeout):
+        doh_url = self.providers[name]
         if use_wire_format:
-            result = https_dns_query_wire_format(domain, doh_url, query_type)
+            result = https_dns_query_wire_format(domain, doh_url, query_type, timeout)
         else:
-            result = https_dns_query(domain, doh_url, query_type)
+            result = https_dns_query(domain, doh_url, query_type, timeout)
+        self.record(name, result)
+        result['provider'] = name
+        return result
+    
+    def query(self, domain, query_type='A', use_wire_format=False, race=False, timeout=5):
+        """向最快的提供商发送查询；race为True时同时查询最快的两个，采用先返回的成功结果"""
+        candidates = self.ranked()
+        if not race or len(candidates) < 2:
+            return self._query(candidates[0], domain, query_type, use_wire_format, timeout)
         
+        futures = [self.executor.submit(self._query, name, domain, query_type, use_wire_format, timeout)
+                   for name in candidates[:2]]
+        result = None
+        for future in as_completed(futures):
+            result = future.result()
+            if result['status'] == 'success':
+                break
+        return result
+    
+    def snapshot(self):
+        """返回各提供商当前的估计值"""
+        now = time.time()
+        with self.lock:
+            return {
+                name: {
+                    'ewma_rtt': round(state['ewma_rtt'], 2) if state['ewma_rtt'] is not None else None,
+                    'queries': state['queries'],
+                    'errors': state['errors'],
+                    'healthy': state['down_until'] <= now
+                }
+                for name, state in self.state.items()
+            }
+
+# 跨测试共享的默认选择器，使延迟估计在web.py的多次测试之间延续
+_default_selector = None
+_default_selector_lock = threading.Lock()
+
+def get_default_selector():
+    """获取基于 DEFAULT_DOH_SERVERS 的共享选择器"""
+    global _default_selector
+    with _default_selector_lock:
+        if _default_selector is None:
+            _default_selector = DohProviderSelector()
+        return _default_selector
+
+def https_dns_select_test(domain, query_type='A', count=5, interval=1000, use_wire_format=False, race=False, selector=None):
+    """执行多次DoH查询，每次由选择器挑选当前最快的健康提供商"""
+    if selector is None:
+        selector = get_default_selector()
+    
+    results = []
+    rtts = []
+    answered_by = {}
+    
+    for i in range(count):
+        result = selector.query(domain, query_type, use_wire_format, race)
         result['seq'] = i + 1
-        
-        # 添加到结果列表
         results.append(result)
         
-        # 统计成功的查询
         if result['status'] == 'success':
-            received += 1
             rtts.append(result['rtt'])
+            answered_by[result['provider']] = answered_by.get(result['provider'], 0) + 1
         
         # 等待指定的间隔时间
         if i < count - 1:
             time.sleep(interval / 1000)  # 转换为秒
     
-    # 计算统计信息
     stats = {
-        'transmitted': transmitted,
-        'received': received,
-        'loss': 0 if transmitted == 0 else round((transmitted - received) / transmitted * 100, 1)
+        'transmitted': count,
+        'received': len(rtts),
+        'loss': 0 if count == 0 else round((count - len(rtts)) / count * 100, 1),
+        'answered_by': answered_by,
+        'providers': selector.snapshot()
     }
     
     if rtts:
@@ -308,7 +726,7 @@ def https_dns_test(domain, doh_url=None, query_type='A', count=5, interval=1000,
     
     return {
         'domain': domain,
-        'doh_url': doh_url,
+        'doh_url': 'auto',
         'query_type': query_type,
         'results': results,
         'stats': stats
@@ -327,6 +745,15 @@ if __name__ == "__main__":
     parser.add_argument('--count', '-c', type=int, default=5, help='查询次数 (默认: 5)')
     parser.add_argument('--interval', '-i', type=int, default=1000, help='查询间隔(毫秒) (默认: 1000)')
     parser.add_argument('--wire', '-w', action='store_true', help='使用二进制格式 (wire format)')
+    parser.add_argument('--get', action='store_true', help='二进制格式使用RFC 8484 GET请求 (可被HTTP缓存)')
+    parser.add_argument('--cache', action='store_true', help='GET请求使用本地HTTP缓存')
+    parser.add_argument('--no-pool', action='store_true', help='不复用连接，每次查询重新建立连接')
+    parser.add_argument('--select', action='store_true', help='每次查询自动选择延迟最低的健康提供商')
+    parser.add_argument('--race', action='store_true', help='与 --select 一起使用，同时查询最快的两个提供商')
+    parser.add_argument('--concurrency', type=int, default=1, help='并发执行的查询数 (默认: 1，即串行)')
+    parser.add_argument('--http2', action='store_true', help='使用HTTP/2在一个连接上并发发送二进制格式查询 (需要 httpx[http2])')
+    parser.add_argument('--streams', type=int, default=10, help='HTTP/2 最大并发流数 (默认: 10)')
+    parser.add_argument('--retries', '-R', type=int, default=0, help='超时后按估计的RTO重试的次数 (默认: 0)')
     parser.add_argument('--json', '-j', action='store_true', help='以JSON格式输出结果')
     
     args = parser.parse_args()
@@ -334,7 +761,19 @@ if __name__ == "__main__":
     # 确定DoH服务器URL
     doh_url = args.url if args.url else DEFAULT_DOH_SERVERS[args.server]
     
-    result = https_dns_test(args.domain, doh_url, args.type, args.count, args.interval, args.wire)
+    if args.select:
+        doh_url = 'auto'
+        result = https_dns_select_test(args.domain, args.type, args.count, args.interval, args.wire, args.race)
+    elif args.http2:
+        result = https_dns_test(args.domain, doh_url, args.type, args.count, args.interval, True, True, args.streams,
+                                'GET' if args.get else 'POST', args.cache, args.retries, http2=True)
+    else:
+        result = https_dns_test(args.domain, doh_url, args.type, args.count, args.interval, args.wire or args.get, not args.no_pool,
+                                args.concurrency, 'GET' if args.get else 'POST', args.cache, args.retries)
+    
+    if 'error' in result:
+        print(result['error'])
+        sys.exit(1)
     
     if args.json:
         print(json.dumps(result, indent=2))
@@ -344,7 +783,8 @@ if __name__ == "__main__":
         
         for query in result['results']:
             if query['status'] == 'success':
-                print(f"查询 {query['seq']}: 成功，RTT = {query['rtt']:.2f} ms，找到 {len(query['answers'])} 条记录")
+                provider = f"，提供商 = {query['provider']}" if 'provider' in query else ''
+                print(f"查询 {query['seq']}: 成功，RTT = {query['rtt']:.2f} ms，找到 {len(query['answers'])} 条记录{provider}")
                 for answer in query['answers']:
                     print(f"  {answer['name']} {answer.get('ttl', 0)} IN {answer['type']} {answer['data']}")
             else:
@@ -356,3 +796,17 @@ if __name__ == "__main__":
         
         if stats['received'] > 0:
             print(f"往返时间 (ms): 最小 = {stats.get('min_rtt', 0):.2f}, 平均 = {stats.get('avg_rtt', 0):.2f}, 最大 = {stats.get('max_rtt', 0):.2f}")
+        
+        if 'http_version' in stats:
+            print(f"HTTP版本 = {stats['http_version']}, 总耗时 = {stats['duration']:.2f} ms, QPS = {stats['qps']}")
+        elif stats.get('concurrency', 1) > 1:
+            print(f"并发数 = {stats['concurrency']}, 总耗时 = {stats['duration']:.2f} ms, QPS = {stats['qps']}")
+        if 'providers' in stats:
+            for name, provider in stats['providers'].items():
+                print(f"{name}: EWMA = {provider['ewma_rtt']} ms, 查询 = {provider['queries']}, 错误 = {provider['errors']}, 健康 = {provider['healthy']}")
+        if 'cache_hits' in stats:
+            print(f"本地缓存命中 = {stats['cache_hits']}, 边缘缓存命中 = {stats['edge_hits']}")
+        if 'cold_avg_rtt' in stats:
+            print(f"冷查询 (新建连接): {stats['cold_count']} 次, 平均 = {stats['cold_avg_rtt']:.2f} ms")
+        if 'warm_avg_rtt' in stats:
+            print(f"热查询 (复用连接): {stats['warm_count']} 次, 最小 = {stats['warm_min_rtt']:.2f}, 平均 = {stats['warm_avg_rtt']:.2f}, 最大 = {stats['warm_max_rtt']:.2f}")
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+# 按服务器维护的RTT估计器(RFC 6298)，用于计算重传超时并在超时后重试查询
+
+import threading
+import time
+
+# RFC 6298 平滑系数
+ALPHA = 1 / 8.0
+BETA = 1 / 4.0
+K = 4
+
+# 时钟粒度(毫秒)
+CLOCK_GRANULARITY = 1.0
+
+# 还没有RTT样本时的初始RTO(毫秒)，RFC 6298 建议1秒
+INITIAL_RTO = 1000.0
+
+# RTO下限和上限(毫秒)；RFC 6298 的1秒下限针对TCP，DNS查询使用更小的下限以便快速重传
+MIN_RTO = 50.0
+MAX_RTO = 60000.0
+
+class RttEstimator(object):
+    """RFC 6298 的SRTT/RTTVAR估计器，时间单位为毫秒"""
+    
+    def __init__(self, initial_rto=INITIAL_RTO, min_rto=MIN_RTO, max_rto=MAX_RTO):
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+        self.samples = 0
+        self.timeouts = 0
+        self.lock = threading.Lock()
+    
+    def update(self, rtt):
+        """加入一个RTT样本；调用方须保证样本对应的发送是明确的(Karn算法)"""
+        with self.lock:
+            if self.srtt is None:
+                self.srtt = rtt
+                self.rttvar = rtt / 2.0
+            else:
+                self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - rtt)
+                self.srtt = (1 - ALPHA) * self.srtt + ALPHA * rtt
+            self.rto = min(max(self.srtt + max(CLOCK_GRANULARITY, K * self.rttvar), self.min_rto), self.max_rto)
+            self.samples += 1
+    
+    def record_timeout(self):
+        """记录一次超时
+        
+        估计器被多个并发查询共享，超时退避(RFC 6298 5.5)按查询进行，见attempt_timeout，
+        不修改共享的RTO，避免并发超时把RTO叠加到上限
+        """
+        with self.lock:
+            self.timeouts += 1
+    
+    def attempt_timeout(self, attempt):
+        """第attempt次发送(从0开始)的等待时间(毫秒)，每次重传指数退避"""
+        return min(self.rto * (2 ** attempt), self.max_rto)
+    
+    def snapshot(self):
+        with self.lock:
+            return {
+                'srtt': None if self.srtt is None else round(self.srtt, 2),
+                'rttvar': None if self.rttvar is None else round(self.rttvar, 2),
+                'rto': round(self.rto, 2),
+                'samples': self.samples,
+                'timeouts': self.timeouts
+            }
+
+# 进程内共享的估计器，键为 (协议, 服务器, 端口) 或 (协议, URL)
+_estimators = {}
+_estimators_lock = threading.Lock()
+
+def get_estimator(*key):
+    """获取指定服务器的RTT估计器，不存在时创建"""
+    with _estimators_lock:
+        estimator = _estimators.get(key)
+        if estimator is None:
+            estimator = RttEstimator()
+            _estimators[key] = estimator
+        return estimator
+
+def reset_estimators():
+    """清空所有服务器的RTT估计"""
+    with _estimators_lock:
+        _estimators.clear()
+
+def query_with_retries(query_func, estimator, retries=0, timeout=5):
+    """按估计的RTO执行查询并在超时后重试
+    
+    query_func(attempt_timeout) 执行一次查询，参数为本次等待时间(秒)，返回结果字典；
+    最后一次尝试使用剩余的全部时间，总耗时不超过timeout秒。结果中记录尝试次数attempts
+    """
+    deadline = time.time() + timeout
+    attempt = 0
+    while True:
+        remaining = deadline - time.time()
+        if attempt < retries:
+            attempt_timeout = min(estimator.attempt_timeout(attempt) / 1000.0, remaining)
+        else:
+            attempt_timeout = remaining
+        
+        result = query_func(max(attempt_timeout, 0.001))
+        attempt += 1
+        
+        if result['status'] == 'timeout':
+            estimator.record_timeout()
+            if attempt <= retries and time.time() < deadline:
+                continue
+        elif result['status'] == 'success' and 'rtt' in result and not result.get('cache_hit'):
+            # 每次重试都是新的请求，样本不会与之前的尝试混淆；本地缓存命中不是网络往返，不作为样本
+            estimator.update(result['rtt'])
+        
+        result['attempts'] = attempt
+        return result
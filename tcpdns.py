@@ -6,224 +6,66 @@ import random
 import time
 import sys
 import json
+import threading
 
-# DNS查询类型常量
-QTYPE_A = 1      # IPv4地址
-QTYPE_NS = 2     # 域名服务器
-QTYPE_CNAME = 5  # 规范名称
-QTYPE_SOA = 6    # 权威记录开始
-QTYPE_PTR = 12   # 指针记录
-QTYPE_MX = 15    # 邮件交换
-QTYPE_TXT = 16   # 文本记录
-QTYPE_AAAA = 28  # IPv6地址
-QTYPE_ANY = 255  # 任何记录
+from tcpinfo import get_tcp_info, summarize_tcp_info, sendto_fastopen
+from rtt import get_estimator, query_with_retries
 
-# DNS响应码
-RCODE_NOERROR = 0    # 没有错误
-RCODE_FORMERR = 1    # 格式错误
-RCODE_SERVFAIL = 2   # 服务器失败
-RCODE_NXDOMAIN = 3   # 不存在的域名
-RCODE_NOTIMP = 4     # 未实现
-RCODE_REFUSED = 5    # 查询被拒绝
+from dnscodec import QTYPE_MAP, build_query, parse_dns_response
 
-# 查询类型映射
-QTYPE_MAP = {
-    'A': QTYPE_A,
-    'NS': QTYPE_NS,
-    'CNAME': QTYPE_CNAME,
-    'SOA': QTYPE_SOA,
-    'PTR': QTYPE_PTR,
-    'MX': QTYPE_MX,
-    'TXT': QTYPE_TXT,
-    'AAAA': QTYPE_AAAA,
-    'ANY': QTYPE_ANY
-}
-
-# 响应码映射
-RCODE_MAP = {
-    RCODE_NOERROR: "没有错误",
-    RCODE_FORMERR: "格式错误",
-    RCODE_SERVFAIL: "服务器失败",
-    RCODE_NXDOMAIN: "不存在的域名",
-    RCODE_NOTIMP: "未实现",
-    RCODE_REFUSED: "查询被拒绝"
-}
-
-def generate_query_id():
-    """生成随机的DNS查询ID"""
-    return random.randint(0, 65535)
-
-def encode_domain_name(domain):
-    """将域名编码为DNS查询格式"""
-    result = b''
-    for part in domain.split('.'):
-        result += struct.pack('B', len(part)) + part.encode('ascii')
-    result += b'\x00'  # 以0字节结束
-    return result
-
-def decode_domain_name(message, offset):
-    """从DNS响应中解码域名"""
-    domain_parts = []
-    while True:
-        length = message[offset]
-        offset += 1
-        
-        # 检查是否有压缩指针
-        if (length & 0xC0) == 0xC0:
-            # 这是一个指针，获取指向的位置
-            pointer = ((length & 0x3F) << 8) | message[offset]
-            offset += 1
-            # 递归解析指针指向的域名
-            pointed_domain, _ = decode_domain_name(message, pointer)
-            domain_parts.append(pointed_domain)
-            break
-        elif length == 0:
-            # 域名结束
-            break
-        else:
-            # 正常的标签
-            domain_parts.append(message[offset:offset+length].decode('ascii'))
-            offset += length
-    
-    return '.'.join(domain_parts), offset
+def create_dns_query(domain, query_type='A'):
+    """创建带TCP长度前缀的DNS查询数据包"""
+    return build_query(domain, query_type, tcp=True)
 
-def parse_dns_response(response_data):
-    """解析DNS响应数据"""
-    # 解析DNS头部
-    header = struct.unpack('!HHHHHH', response_data[:12])
-    query_id = header[0]
-    flags = header[1]
-    qdcount = header[2]  # 问题数
-    ancount = header[3]  # 回答数
-    nscount = header[4]  # 授权记录数
-    arcount = header[5]  # 附加记录数
-    
-    # 检查响应码
-    rcode = flags & 0x0F
-    if rcode != RCODE_NOERROR:
+def tcp_dns_query(domain, server, port=53, query_type='A', timeout=5, fastopen=False, header_only=False):
+    """执行单次TCP DNS查询，fastopen为True时查询随SYN一起发送(TCP Fast Open)"""
+    if fastopen and not hasattr(socket, 'MSG_FASTOPEN'):
         return {
             'status': 'error',
-            'message': f'DNS响应错误: {RCODE_MAP.get(rcode, "未知错误")}'
+            'message': '当前平台不支持TCP Fast Open'
         }
     
-    # 跳过问题部分
-    offset = 12
-    for _ in range(qdcount):
-        # 跳过域名
-        while True:
-            length = response_data[offset]
-            offset += 1
-            if length == 0 or (length & 0xC0) == 0xC0:
-                if (length & 0xC0) == 0xC0:
-                    offset += 1  # 跳过指针的第二个字节
-                break
-            offset += length
-        # 跳过查询类型和查询类
-        offset += 4
+    # 创建DNS查询
+    query_id, query_packet = create_dns_query(domain, query_type)
     
-    # 解析回答部分
-    answers = []
-    for _ in range(ancount):
-        # 解析域名
-        name, offset = decode_domain_name(response_data, offset)
-        
-        # 解析记录类型、类、TTL和数据长度
-        record_type, record_class, ttl, data_length = struct.unpack('!HHIH', response_data[offset:offset+10])
-        offset += 10
-        
-        # 根据记录类型解析数据
-        record_data = ''
-        if record_type == QTYPE_A:
-            # A记录 - IPv4地址
-            ip_bytes = response_data[offset:offset+data_length]
-            record_data = '.'.join(str(b) for b in ip_bytes)
-        elif record_type == QTYPE_AAAA:
-            # AAAA记录 - IPv6地址
-            ip_bytes = response_data[offset:offset+data_length]
-            record_data = ':'.join(f'{ip_bytes[i*2:i*2+2].hex()}' for i in range(8))
-        elif record_type == QTYPE_MX:
-            # MX记录 - 邮件交换
-            preference = struct.unpack('!H', response_data[offset:offset+2])[0]
-            mx_name, _ = decode_domain_name(response_data, offset+2)
-            record_data = f'{preference} {mx_name}'
-        elif record_type == QTYPE_NS or record_type == QTYPE_CNAME or record_type == QTYPE_PTR:
-            # NS, CNAME, PTR记录 - 域名
-            record_data, _ = decode_domain_name(response_data, offset)
-        elif record_type == QTYPE_TXT:
-            # TXT记录 - 文本
-            txt_length = response_data[offset]
-            record_data = response_data[offset+1:offset+1+txt_length].decode('ascii', errors='ignore')
-        else:
-            # 其他记录类型
-            record_data = response_data[offset:offset+data_length].hex()
-        
-        # 添加到回答列表
-        answers.append({
-            'name': name,
-            'type': {v: k for k, v in QTYPE_MAP.items()}.get(record_type, str(record_type)),
-            'class': 'IN' if record_class == 1 else str(record_class),
-            'ttl': ttl,
-            'data': record_data
-        })
-        
-        offset += data_length
-    
-    return {
-        'status': 'success',
-        'answers': answers
-    }
-
-def create_dns_query(domain, query_type='A'):
-    """创建DNS查询数据包"""
-    # 获取查询类型的数值
-    qtype_value = QTYPE_MAP.get(query_type, QTYPE_A)
-    
-    # 生成随机查询ID
-    query_id = generate_query_id()
-    
-    # 构建DNS头部
-    # ID, 标志, 问题数, 回答数, 授权记录数, 附加记录数
-    header = struct.pack('!HHHHHH', query_id, 0x0100, 1, 0, 0, 0)
-    
-    # 构建问题部分
-    question = encode_domain_name(domain) + struct.pack('!HH', qtype_value, 1)  # 查询类型和查询类(IN)
-    
-    # 组合完整的查询包
-    query_packet = header + question
-    
-    # 为TCP添加长度前缀
-    tcp_packet = struct.pack('!H', len(query_packet)) + query_packet
-    
-    return query_id, tcp_packet
-
-def tcp_dns_query(domain, server, port=53, query_type='A', timeout=5):
-    """执行单次TCP DNS查询"""
     start_time = time.time()
     
     try:
         # 创建TCP套接字
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        family = socket.AF_INET6 if server.find(':') != -1 else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
         sock.settimeout(timeout)
         
-        # 连接到DNS服务器
-        try:
-            sock.connect((server, port))
-        except socket.error as e:
-            return {
-                'status': 'error',
-                'message': f'连接DNS服务器失败: {str(e)}'
-            }
-        
-        # 创建并发送DNS查询
-        query_id, query_packet = create_dns_query(domain, query_type)
-        try:
-            sock.sendall(query_packet)
-        except socket.error as e:
-            sock.close()
-            return {
-                'status': 'error',
-                'message': f'发送查询失败: {str(e)}'
-            }
+        if fastopen:
+            # 连接并在SYN中携带查询
+            try:
+                sendto_fastopen(sock, query_packet, (server, port))
+            except socket.error as e:
+                sock.close()
+                return {
+                    'status': 'error',
+                    'message': f'TCP Fast Open 发送查询失败: {str(e)}'
+                }
+        else:
+            # 连接到DNS服务器
+            try:
+                sock.connect((server, port))
+            except socket.error as e:
+                sock.close()
+                return {
+                    'status': 'error',
+                    'message': f'连接DNS服务器失败: {str(e)}'
+                }
+            
+            # 发送DNS查询
+            try:
+                sock.sendall(query_packet)
+            except socket.error as e:
+                sock.close()
+                return {
+                    'status': 'error',
+                    'message': f'发送查询失败: {str(e)}'
+                }
         
         # 接收响应长度
         try:
@@ -259,16 +101,23 @@ def tcp_dns_query(domain, server, port=53, query_type='A', timeout=5):
                 'message': f'接收响应失败: {str(e)}'
             }
         
-        # 关闭套接字
-        sock.close()
-        
         # 计算往返时间
         rtt = (time.time() - start_time) * 1000  # 毫秒
         
+        # 关闭前读取内核TCP统计
+        tcp_info = get_tcp_info(sock)
+        
+        # 关闭套接字
+        sock.close()
+        
         # 解析响应
-        result = parse_dns_response(response_data)
+        result = parse_dns_response(response_data, header_only)
         if result['status'] == 'success':
             result['rtt'] = rtt
+        if tcp_info is not None:
+            result['tcp_info'] = tcp_info
+            if fastopen:
+                result['tfo'] = tcp_info['syn_data_acked']
         
         return result
     
@@ -300,8 +149,13 @@ def tcp_dns_query(domain, server, port=53, query_type='A', timeout=5):
             'message': f'查询错误: {str(e)}'
         }
 
-def tcp_dns_test(domain, server, port=53, query_type='A', count=5, interval=1000):
-    """执行多次TCP DNS查询测试"""
+def tcp_dns_test(domain, server, port=53, query_type='A', count=5, interval=1000, fastopen=False, header_only=False,
+                 retries=0, timeout=5):
+    """执行多次TCP DNS查询测试
+    
+    retries大于0时每次等待时间由该服务器的RTT估计器给出，超时后用新连接重试，timeout为单次查询的总超时(秒)
+    """
+    estimator = get_estimator('tcp', server, port)
     results = []
     rtts = []
     transmitted = 0
@@ -311,7 +165,9 @@ def tcp_dns_test(domain, server, port=53, query_type='A', count=5, interval=1000
         transmitted += 1
         
         # 执行查询
-        result = tcp_dns_query(domain, server, port, query_type)
+        result = query_with_retries(
+            lambda attempt_timeout: tcp_dns_query(domain, server, port, query_type, attempt_timeout, fastopen, header_only),
+            estimator, retries, timeout)
         result['seq'] = i + 1
         
         # 添加到结果列表
@@ -330,7 +186,9 @@ def tcp_dns_test(domain, server, port=53, query_type='A', count=5, interval=1000
     stats = {
         'transmitted': transmitted,
         'received': received,
-        'loss': 0 if transmitted == 0 else round((transmitted - received) / transmitted * 100, 1)
+        'loss': 0 if transmitted == 0 else round((transmitted - received) / transmitted * 100, 1),
+        'retries': sum(r['attempts'] - 1 for r in results),
+        'rtt_estimator': estimator.snapshot()
     }
     
     if rtts:
@@ -338,6 +196,10 @@ def tcp_dns_test(domain, server, port=53, query_type='A', count=5, interval=1000
         stats['avg_rtt'] = round(sum(rtts) / len(rtts), 2)
         stats['max_rtt'] = round(max(rtts), 2)
     
+    stats.update(summarize_tcp_info([r.get('tcp_info') for r in results]))
+    if fastopen:
+        stats['tfo_used'] = sum(1 for r in results if r.get('tfo'))
+    
     return {
         'domain': domain,
         'server': server,
@@ -347,6 +209,147 @@ def tcp_dns_test(domain, server, port=53, query_type='A', count=5, interval=1000
         'stats': stats
     }
 
+def recv_exact(sock, length):
+    """从TCP连接读取指定长度的数据，连接提前关闭时返回已读取的部分"""
+    buf = bytearray(length)
+    view = memoryview(buf)
+    received = 0
+    while received < length:
+        nbytes = sock.recv_into(view[received:])
+        if not nbytes:
+            return buf[:received]
+        received += nbytes
+    return buf
+
+def tcp_dns_pipeline_test(domain, server, port=53, query_type='A', count=5, timeout=5, header_only=False):
+    """在单个TCP连接上连续发送多个查询(RFC 7766)，按查询ID匹配乱序返回的响应"""
+    count = min(count, 65536)
+    
+    # 每个查询使用不同的ID，以便匹配乱序的响应
+    query_ids = random.sample(range(65536), count)
+    packets = []
+    for query_id in query_ids:
+        packets.append(build_query(domain, query_type, query_id, tcp=True)[1])
+    seq_by_id = {query_id: i for i, query_id in enumerate(query_ids)}
+    
+    results = [None] * count
+    send_times = [None] * count
+    counters = {'reordered': 0, 'unexpected': 0}
+    connect_time = None
+    tcp_info = None
+    error = None
+    
+    family = socket.AF_INET6 if server.find(':') != -1 else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    
+    def receive_responses():
+        received = 0
+        highest_seq = -1
+        try:
+            while received < count:
+                length_bytes = recv_exact(sock, 2)
+                if len(length_bytes) < 2:
+                    break
+                response_length = struct.unpack('!H', length_bytes)[0]
+                response_data = recv_exact(sock, response_length)
+                recv_time = time.time()
+                if len(response_data) < response_length:
+                    break
+                
+                seq = seq_by_id.get(struct.unpack_from('!H', response_data)[0])
+                if seq is None or results[seq] is not None:
+                    counters['unexpected'] += 1
+                    continue
+                if seq < highest_seq:
+                    counters['reordered'] += 1
+                else:
+                    highest_seq = seq
+                
+                result = parse_dns_response(response_data, header_only)
+                if result['status'] == 'success':
+                    result['rtt'] = (recv_time - send_times[seq]) * 1000
+                results[seq] = result
+                received += 1
+        except (socket.timeout, socket.error):
+            pass
+    
+    receiver = None
+    start_time = time.time()
+    try:
+        sock.connect((server, port))
+        connect_time = (time.time() - start_time) * 1000
+        
+        receiver = threading.Thread(target=receive_responses)
+        receiver.daemon = True
+        receiver.start()
+        
+        # 连续发送所有查询，不等待响应
+        for i, packet in enumerate(packets):
+            send_times[i] = time.time()
+            sock.sendall(packet)
+        
+        receiver.join()
+        tcp_info = get_tcp_info(sock)
+    except socket.timeout:
+        error = '连接DNS服务器超时'
+    except socket.error as e:
+        error = f'连接DNS服务器失败: {str(e)}'
+    finally:
+        if receiver is not None and receiver.is_alive():
+            # 发送出错时接收线程可能仍阻塞在recv上，关闭连接使其退出，之后才能安全地汇总结果
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        sock.close()
+        if receiver is not None:
+            receiver.join(timeout)
+    
+    duration = (time.time() - start_time) * 1000
+    
+    rtts = []
+    for i in range(count):
+        if results[i] is None:
+            if error:
+                results[i] = {'status': 'error', 'message': error}
+            else:
+                results[i] = {'status': 'timeout', 'message': 'DNS查询超时'}
+        elif results[i]['status'] == 'success':
+            rtts.append(results[i]['rtt'])
+        results[i]['seq'] = i + 1
+        results[i]['id'] = query_ids[i]
+    
+    stats = {
+        'transmitted': count,
+        'received': len(rtts),
+        'loss': 0 if count == 0 else round((count - len(rtts)) / count * 100, 1),
+        'connect_time': round(connect_time, 2) if connect_time is not None else None,
+        'duration': round(duration, 2),
+        'qps': round(len(rtts) / (duration / 1000), 1) if duration > 0 else 0,
+        'reordered': counters['reordered'],
+        'unexpected': counters['unexpected']
+    }
+    
+    if rtts:
+        stats['min_rtt'] = round(min(rtts), 2)
+        stats['avg_rtt'] = round(sum(rtts) / len(rtts), 2)
+        stats['max_rtt'] = round(max(rtts), 2)
+    
+    if tcp_info is not None:
+        stats['tcp_info'] = tcp_info
+    
+    return {
+        'domain': domain,
+        'server': server,
+        'port': port,
+        'query_type': query_type,
+        'mode': 'pipeline',
+        'results': results,
+        'stats': stats
+    }
+
 # 命令行接口
 if __name__ == "__main__":
     import argparse
@@ -358,11 +361,20 @@ if __name__ == "__main__":
     parser.add_argument('--type', '-t', default='A', choices=list(QTYPE_MAP.keys()), help='查询类型 (默认: A)')
     parser.add_argument('--count', '-c', type=int, default=5, help='查询次数 (默认: 5)')
     parser.add_argument('--interval', '-i', type=int, default=1000, help='查询间隔(毫秒) (默认: 1000)')
+    parser.add_argument('--fastopen', '-f', action='store_true', help='使用TCP Fast Open发送查询')
+    parser.add_argument('--pipeline', '-P', action='store_true', help='在单个连接上连续发送所有查询 (RFC 7766)')
+    parser.add_argument('--header-only', '-H', action='store_true', help='只解析响应头部，不解码记录')
+    parser.add_argument('--retries', '-R', type=int, default=0, help='超时后按估计的RTO重试的次数 (默认: 0)')
     parser.add_argument('--json', '-j', action='store_true', help='以JSON格式输出结果')
     
     args = parser.parse_args()
     
-    result = tcp_dns_test(args.domain, args.server, args.port, args.type, args.count, args.interval)
+    if args.pipeline:
+        result = tcp_dns_pipeline_test(args.domain, args.server, args.port, args.type, args.count,
+                                       header_only=args.header_only)
+    else:
+        result = tcp_dns_test(args.domain, args.server, args.port, args.type, args.count, args.interval, args.fastopen,
+                              args.header_only, args.retries)
     
     if args.json:
         print(json.dumps(result, indent=2))
@@ -372,8 +384,8 @@ if __name__ == "__main__":
         
         for query in result['results']:
             if query['status'] == 'success':
-                print(f"查询 {query['seq']}: 成功，RTT = {query['rtt']:.2f} ms，找到 {len(query['answers'])} 条记录")
-                for answer in query['answers']:
+                print(f"查询 {query['seq']}: 成功，RTT = {query['rtt']:.2f} ms，找到 {query['answer_count']} 条记录")
+                for answer in query.get('answers', []):
                     print(f"  {answer['name']} {answer['ttl']} IN {answer['type']} {answer['data']}")
             else:
                 print(f"查询 {query['seq']}: {query['status']} - {query.get('message', '未知错误')}")
@@ -383,4 +395,7 @@ if __name__ == "__main__":
         print(f"发送 = {stats['transmitted']}, 接收 = {stats['received']}, 丢包率 = {stats['loss']}%")
         
         if stats['received'] > 0:
-            print(f"往返时间 (ms): 最小 = {stats.get('min_rtt', 0):.2f}, 平均 = {stats.get('avg_rtt', 0):.2f}, 最大 = {stats.get('max_rtt', 0):.2f}")
\ No newline at end of file
+            print(f"往返时间 (ms): 最小 = {stats.get('min_rtt', 0):.2f}, 平均 = {stats.get('avg_rtt', 0):.2f}, 最大 = {stats.get('max_rtt', 0):.2f}")
+        
+        if args.pipeline and stats['connect_time'] is not None:
+            print(f"建立连接 = {stats['connect_time']:.2f} ms, 总耗时 = {stats['duration']:.2f} ms, QPS = {stats['qps']}, 乱序 = {stats['reordered']}")
\ No newline at end of file
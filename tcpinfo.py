@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+# TCP探测共用的内核特性: TCP_INFO统计和TCP Fast Open
+
+import os
+import select
+import socket
+import struct
+
+# Linux struct tcp_info 的前104字节: 8个u8字段 + 24个u32字段 (本机字节序)
+TCP_INFO_STRUCT = struct.Struct('=8B24I')
+
+# tcpi_options 标志位: SYN携带的数据被对端确认(TCP Fast Open 生效)
+TCPI_OPT_SYN_DATA = 0x20
+
+def get_tcp_info(sock):
+    """读取内核TCP_INFO统计，时间单位为毫秒；不支持的平台返回None"""
+    if not hasattr(socket, 'TCP_INFO'):
+        return None
+    
+    try:
+        raw = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, TCP_INFO_STRUCT.size)
+    except (OSError, socket.error):
+        return None
+    
+    if len(raw) < TCP_INFO_STRUCT.size:
+        return None
+    
+    fields = TCP_INFO_STRUCT.unpack(raw)
+    return {
+        'state': fields[0],
+        'retransmits': fields[2],
+        'syn_data_acked': bool(fields[5] & TCPI_OPT_SYN_DATA),
+        'rto': round(fields[8] / 1000.0, 3),
+        'snd_mss': fields[10],
+        'unacked': fields[12],
+        'lost': fields[14],
+        'retrans': fields[15],
+        'pmtu': fields[21],
+        'rtt': round(fields[23] / 1000.0, 3),
+        'rttvar': round(fields[24] / 1000.0, 3),
+        'snd_ssthresh': fields[25],
+        'snd_cwnd': fields[26],
+        'total_retrans': fields[31]
+    }
+
+def summarize_tcp_info(infos, final_infos=None):
+    """汇总多次探测的TCP_INFO，返回可合并到stats中的字段
+    
+    重传计数在连接内是累计值，final_infos 为每个连接最后一次的快照，默认与 infos 相同
+    """
+    infos = [info for info in infos if info]
+    if not infos:
+        return {}
+    if final_infos is None:
+        final_infos = infos
+    final_infos = [info for info in final_infos if info]
+    
+    rtts = [info['rtt'] for info in infos]
+    return {
+        'tcp_rtt_min': round(min(rtts), 3),
+        'tcp_rtt_avg': round(sum(rtts) / len(rtts), 3),
+        'tcp_rtt_max': round(max(rtts), 3),
+        'tcp_rttvar_avg': round(sum(info['rttvar'] for info in infos) / len(infos), 3),
+        'tcp_total_retrans': sum(info['total_retrans'] for info in final_infos),
+        'tcp_lost': sum(info['lost'] for info in final_infos)
+    }
+
+def sendto_fastopen(sock, data, address):
+    """使用TCP Fast Open建立连接并发送数据
+    
+    有cookie时数据随SYN发出；没有cookie时内核只发送请求cookie的SYN，
+    此时等待握手完成后再发送数据
+    """
+    try:
+        sent = sock.sendto(data, socket.MSG_FASTOPEN, address)
+    except BlockingIOError:
+        _, writable, _ = select.select([], [sock], [], sock.gettimeout())
+        if not writable:
+            raise socket.timeout('timed out')
+        err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err != 0:
+            raise socket.error(err, os.strerror(err))
+        sent = 0
+    
+    if sent < len(data):
+        sock.sendall(memoryview(data)[sent:])
@@ -10,156 +10,412 @@ import random
 import signal
 import sys
 import os
+import struct
+import errno
+import selectors
+
+from tcpinfo import get_tcp_info, summarize_tcp_info, sendto_fastopen
 
 INTERVAL = 1000  # unit ms
 LEN = 64
+PERSISTENT = 0
+FASTOPEN = 0
 IP = ""
 PORT = 0
 
-count = 0
-count_of_received = 0
-rtt_sum = 0.0
-rtt_min = 99999999.0
-rtt_max = 0.0
-
-def signal_handler(signal, frame):
-	if count != 0 and count_of_received != 0:
-		print('')
-		print('--- ping statistics ---')
-	if count != 0:
-		print('%d packets transmitted, %d received, %.2f%% packet loss'%(count, count_of_received, (count-count_of_received)*100.0/count))
-	if count_of_received != 0:
-		print('rtt min/avg/max = %.2f/%.2f/%.2f ms'%(rtt_min, rtt_sum/count_of_received, rtt_max))
-	os._exit(0)
+# 写入载荷前4字节的探测序号
+PROBE_SEQ = struct.Struct("!I")
+
+RANDOM_CHARS = string.ascii_letters + string.digits
 
 def random_string(length):
-        return ''.join(random.choice(string.ascii_letters + string.digits) for m in range(length))
+        return ''.join(random.choices(RANDOM_CHARS, k=length))
 
-# 添加一个函数，用于从web.py调用
-def tcp_ping(target_ip, target_port, packet_len=64, interval=1000, count_limit=10):
-    global IP, PORT, LEN, INTERVAL
-    global count, count_of_received, rtt_sum, rtt_min, rtt_max
-    
-    # 重置全局变量
-    count = 0
-    count_of_received = 0
-    rtt_sum = 0.0
-    rtt_min = 99999999.0
-    rtt_max = 0.0
-    
-    IP = target_ip
-    PORT = int(target_port)
-    LEN = packet_len
-    INTERVAL = interval
-    
-    is_ipv6 = 0
-    if IP.find(":") != -1:
-        is_ipv6 = 1
-    
-    if LEN < 5:
-        return {"error": "LEN must be >=5"}
-    if INTERVAL < 50:
-        return {"error": "INTERVAL must be >=50"}
-    
-    results = []
-    
-    for i in range(count_limit):
-        payload = random_string(LEN)
-        
+# 单个TCP Ping会话，统计数据保存在实例中，不同线程或事件循环中的会话互不干扰
+class TcpPinger(object):
+    def __init__(self, target_ip, target_port, packet_len=64, interval=1000, persistent=False, fastopen=False):
+        self.ip = target_ip
+        self.port = int(target_port)
+        self.packet_len = packet_len
+        self.interval = interval
+        self.is_ipv6 = self.ip.find(":") != -1
+
+        # 长连接模式下复用同一个连接，只测量应用层回显的RTT
+        self.persistent = persistent
+        self.sock = None
+
+        # TCP Fast Open: 载荷随SYN一起发送，握手时间无法单独测量
+        self.fastopen = fastopen
+
+        # 载荷和接收缓冲区只分配一次，每次探测仅改写载荷中的序号
+        self.payload = bytearray(random_string(self.packet_len).encode())
+        self.payload_view = memoryview(self.payload)
+        self.recv_buffer = bytearray(max(self.packet_len, 0))
+        self.recv_view = memoryview(self.recv_buffer)
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.count_of_received = 0
+        self.rtt_sum = 0.0
+        self.rtt_min = 99999999.0
+        self.rtt_max = 0.0
+        self.connect_times = []
+        self.tcp_infos = []
+        self.final_tcp_infos = []
+        self.results = []
+
+    # 检查参数，返回错误信息或None
+    def validate(self):
+        if self.packet_len < 5:
+            return "LEN must be >=5"
+        if self.fastopen and not hasattr(socket, "MSG_FASTOPEN"):
+            return "TCP Fast Open is not supported on this platform"
+        if self.persistent:
+            if self.interval < 1:
+                return "INTERVAL must be >=1"
+        elif self.interval < 50:
+            return "INTERVAL must be >=50"
+        return None
+
+    # 把下一个序号写入载荷，返回同一个缓冲区
+    def next_payload(self):
+        PROBE_SEQ.pack_into(self.payload, 0, self.count & 0xFFFFFFFF)
+        return self.payload
+
+    # 记录一次探测的结果，status为success时rtt有效
+    def record(self, status, rtt=None, message=None):
+        self.count += 1
+        result = {"seq": self.count, "time": None, "status": status}
+
+        if status == "success":
+            self.count_of_received += 1
+            self.rtt_sum += rtt
+            self.rtt_max = max(self.rtt_max, rtt)
+            self.rtt_min = min(self.rtt_min, rtt)
+            result["time"] = round(rtt, 2)
+        if message is not None:
+            result["message"] = message
+
+        self.results.append(result)
+        return result
+
+    # 建立TCP连接，返回套接字和握手耗时(ms)
+    def connect(self):
         # 创建TCP套接字
+        if not self.is_ipv6:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+
+        # 设置连接超时
+        sock.settimeout(self.interval/1000.0)
+        if self.persistent:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        time_of_connect = time.time()
         try:
-            if not is_ipv6:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            else:
-                sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
-            
-            # 设置连接超时
-            sock.settimeout(INTERVAL/1000.0)
-            
-            # 记录发送时间
-            time_of_send = time.time()
-            
-            # 尝试连接
-            sock.connect((IP, PORT))
-            
-            # 发送数据
-            sock.sendall(payload.encode())
-            
-            # 接收数据
-            received_data = b""
-            while len(received_data) < LEN:
-                chunk = sock.recv(LEN - len(received_data))
-                if not chunk:
-                    break
-                received_data += chunk
-            
-            # 计算RTT
-            rtt = ((time.time() - time_of_send) * 1000)
-            
-            # 检查接收到的数据是否与发送的相同
-            received = 0
-            if received_data == payload.encode():
-                received = 1
-            
-            # 关闭套接字
+            sock.connect((self.ip, self.port))
+        except:
             sock.close()
-            
+            raise
+        connect_time = ((time.time() - time_of_connect) * 1000)
+        self.connect_times.append(connect_time)
+        return sock, connect_time
+
+    # 使用TCP Fast Open建立连接，载荷随SYN发出，返回套接字
+    def connect_fastopen(self, payload):
+        if not self.is_ipv6:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+
+        sock.settimeout(self.interval/1000.0)
+        if self.persistent:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        try:
+            sendto_fastopen(sock, payload, (self.ip, self.port))
+        except:
+            sock.close()
+            raise
+        return sock
+
+    # 发送载荷并读取完整回显，返回回显是否与载荷一致
+    def echo(self, sock, payload, sent=False):
+        if not sent:
+            sock.sendall(payload)
+
+        received = 0
+        while received < self.packet_len:
+            nbytes = sock.recv_into(self.recv_view[received:])
+            if not nbytes:
+                break
+            received += nbytes
+
+        return received == self.packet_len and self.recv_view == self.payload_view
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    # 发送并接收回显，普通模式每次重新建立连接，间隔剩余的时间在返回前睡眠
+    def ping_once(self):
+        payload = self.next_payload()
+
+        # 记录发送时间
+        time_of_send = time.time()
+        connect_time = None
+        sent = False
+        sock = self.sock
+
+        try:
+            time_of_echo = time_of_send
+            if sock is None and self.fastopen:
+                sock = self.connect_fastopen(payload)
+                sent = True
+            elif sock is None:
+                sock, connect_time = self.connect()
+                # 长连接模式不把握手计入RTT
+                if self.persistent:
+                    time_of_echo = time.time()
+            if self.persistent:
+                self.sock = sock
+
+            matched = self.echo(sock, payload, sent)
+            rtt = ((time.time() - time_of_echo) * 1000)
+
+            # 内核统计的平滑RTT、重传等，不受解释器调度影响
+            tcp_info = get_tcp_info(sock)
+
+            # 检查接收到的数据是否与发送的相同
+            if matched:
+                result = self.record("success", rtt)
+            else:
+                result = self.record("timeout", message="invalid data received")
+                self.close()
+
+            if tcp_info is not None:
+                result["tcp_info"] = tcp_info
+                if sent:
+                    result["tfo"] = tcp_info["syn_data_acked"]
+                self.tcp_infos.append(tcp_info)
+                # 同一连接上的重传计数是累计值，只保留每个连接最后一次的快照
+                if connect_time is None and not sent and self.final_tcp_infos:
+                    self.final_tcp_infos[-1] = tcp_info
+                else:
+                    self.final_tcp_infos.append(tcp_info)
+
         except socket.timeout:
-            # 连接超时
-            count += 1
-            result = {"seq": count, "time": None, "status": "timeout"}
-            results.append(result)
-            
-            # 等待下一次发送
-            deadline = time_of_send + INTERVAL/1000.0
-            time_remaining = deadline - time.time()
-            if time_remaining > 0:
-                time.sleep(time_remaining)
-            
-            continue
+            # 连接或回显超时，长连接需要重建以免读到迟到的数据
+            result = self.record("timeout")
+            self.close()
         except socket.error as e:
             # 连接错误
-            count += 1
-            result = {"seq": count, "time": None, "status": "error", "message": str(e)}
-            results.append(result)
-            
-            # 等待下一次发送
-            deadline = time_of_send + INTERVAL/1000.0
-            time_remaining = deadline - time.time()
-            if time_remaining > 0:
-                time.sleep(time_remaining)
-            
-            continue
-        
-        count += 1
-        result = {"seq": count, "time": None, "status": "timeout"}
-        
-        if received == 1:
-            count_of_received += 1
-            rtt_sum += rtt
-            rtt_max = max(rtt_max, rtt)
-            rtt_min = min(rtt_min, rtt)
-            result["time"] = round(rtt, 2)
-            result["status"] = "success"
-        
-        results.append(result)
-        
+            result = self.record("error", message=str(e))
+            self.close()
+        finally:
+            # 关闭套接字
+            if not self.persistent and sock is not None:
+                sock.close()
+
+        if connect_time is not None:
+            result["connect_time"] = round(connect_time, 2)
+
         # 等待下一次发送
-        deadline = time_of_send + INTERVAL/1000.0
+        deadline = time_of_send + self.interval/1000.0
         time_remaining = deadline - time.time()
         if time_remaining > 0:
             time.sleep(time_remaining)
-    
-    # 计算统计信息
+
+        return result
+
+    def stats(self):
+        count = self.count
+        count_of_received = self.count_of_received
+        connect_times = self.connect_times
+        stats = {
+            "transmitted": count,
+            "received": count_of_received,
+            "loss": round((count - count_of_received) * 100.0 / count, 2) if count > 0 else 0,
+            "min": round(self.rtt_min, 2) if count_of_received > 0 else None,
+            "avg": round(self.rtt_sum / count_of_received, 2) if count_of_received > 0 else None,
+            "max": round(self.rtt_max, 2) if count_of_received > 0 else None,
+            "connects": len(connect_times),
+            "connect_min": round(min(connect_times), 2) if connect_times else None,
+            "connect_avg": round(sum(connect_times) / len(connect_times), 2) if connect_times else None,
+            "connect_max": round(max(connect_times), 2) if connect_times else None
+        }
+        stats.update(summarize_tcp_info(self.tcp_infos, self.final_tcp_infos))
+        if self.fastopen:
+            stats["tfo_used"] = sum(1 for result in self.results if result.get("tfo"))
+        return stats
+
+    def run(self, count_limit=10):
+        error = self.validate()
+        if error:
+            return {"error": error}
+
+        self.reset()
+        try:
+            for i in range(count_limit):
+                self.ping_once()
+        finally:
+            self.close()
+
+        return {"results": self.results, "stats": self.stats()}
+
+    def print_stats(self):
+        if self.count != 0 and self.count_of_received != 0:
+            print('')
+            print('--- ping statistics ---')
+        if self.count != 0:
+            print('%d packets transmitted, %d received, %.2f%% packet loss'%(self.count, self.count_of_received, (self.count-self.count_of_received)*100.0/self.count))
+        if self.count_of_received != 0:
+            print('rtt min/avg/max = %.2f/%.2f/%.2f ms'%(self.rtt_min, self.rtt_sum/self.count_of_received, self.rtt_max))
+
+    def signal_handler(self, signal, frame):
+        self.print_stats()
+        os._exit(0)
+
+# 添加一个函数，用于从web.py调用
+def tcp_ping(target_ip, target_port, packet_len=64, interval=1000, count_limit=10, persistent=False, fastopen=False):
+    return TcpPinger(target_ip, target_port, packet_len, interval, persistent, fastopen).run(count_limit)
+
+# 并发TCP扫描: 基于非阻塞套接字，同时最多保持concurrency个连接
+# connect_only为True时只测量握手时间，否则在连接后再测量一次载荷回显
+def tcp_sweep(targets, timeout=1000, concurrency=256, connect_only=True, packet_len=64):
+    targets = [(ip, int(port)) for ip, port in targets]
+    results = [None] * len(targets)
+    payload = random_string(packet_len).encode()
+    selector = selectors.DefaultSelector()
+    pending = iter(enumerate(targets))
+    active = {}
+
+    def finish(sock, status, message=None):
+        state = active.pop(sock)
+        selector.unregister(sock)
+        ip, port = targets[state["index"]]
+        result = {"target": "%s:%d" % (ip, port), "status": status, "connect_time": None, "time": None}
+        if state["connect_time"] is not None:
+            result["connect_time"] = round(state["connect_time"], 2)
+        if status == "success" and not connect_only:
+            result["time"] = round((time.time() - state["time_of_echo"]) * 1000, 2)
+        if status == "success":
+            tcp_info = get_tcp_info(sock)
+            if tcp_info is not None:
+                result["tcp_info"] = tcp_info
+        if message is not None:
+            result["message"] = message
+        sock.close()
+        results[state["index"]] = result
+
+    # 发起下一个目标的连接，没有剩余目标时返回False
+    def start_next():
+        for index, (ip, port) in pending:
+            family = socket.AF_INET6 if ip.find(":") != -1 else socket.AF_INET
+            time_of_connect = time.time()
+            sock = None
+            try:
+                sock = socket.socket(family, socket.SOCK_STREAM)
+                sock.setblocking(False)
+                err = sock.connect_ex((ip, port))
+            except socket.error as e:
+                # 例如主机名无法解析(socket.gaierror)，关闭已创建的套接字
+                if sock is not None:
+                    sock.close()
+                results[index] = {"target": "%s:%d" % (ip, port), "status": "error", "connect_time": None, "time": None, "message": str(e)}
+                continue
+            active[sock] = {
+                "index": index,
+                "time_of_connect": time_of_connect,
+                "deadline": time_of_connect + timeout / 1000.0,
+                "connect_time": None,
+                "time_of_echo": None,
+                "sent": 0,
+                "received": 0,
+                "buffer": None
+            }
+            selector.register(sock, selectors.EVENT_WRITE)
+            if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN):
+                finish(sock, "error", os.strerror(err))
+            return True
+        return False
+
+    def handle(sock, mask):
+        state = active[sock]
+        if state["connect_time"] is None:
+            err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err != 0:
+                finish(sock, "error", os.strerror(err))
+                return
+            state["connect_time"] = (time.time() - state["time_of_connect"]) * 1000
+            if connect_only:
+                finish(sock, "success")
+                return
+            state["time_of_echo"] = time.time()
+            state["buffer"] = bytearray(packet_len)
+
+        if state["sent"] < packet_len:
+            state["sent"] += sock.send(payload[state["sent"]:])
+            if state["sent"] == packet_len:
+                selector.modify(sock, selectors.EVENT_READ)
+            return
+
+        view = memoryview(state["buffer"])
+        nbytes = sock.recv_into(view[state["received"]:])
+        if not nbytes:
+            finish(sock, "error", "connection closed")
+            return
+        state["received"] += nbytes
+        if state["received"] == packet_len:
+            if state["buffer"] == payload:
+                finish(sock, "success")
+            else:
+                finish(sock, "error", "invalid data received")
+
+    try:
+        while len(active) < concurrency and start_next():
+            pass
+
+        while active:
+            now = time.time()
+            next_deadline = min(state["deadline"] for state in active.values())
+            for key, mask in selector.select(max(next_deadline - now, 0)):
+                if key.fileobj in active:
+                    try:
+                        handle(key.fileobj, mask)
+                    except socket.error as e:
+                        finish(key.fileobj, "error", str(e))
+
+            now = time.time()
+            for sock in [sock for sock, state in active.items() if state["deadline"] <= now]:
+                finish(sock, "timeout")
+
+            while len(active) < concurrency and start_next():
+                pass
+    finally:
+        for sock in list(active):
+            finish(sock, "error", "sweep aborted")
+        selector.close()
+
+    connect_times = [r["connect_time"] for r in results if r["status"] == "success"]
     stats = {
-        "transmitted": count,
-        "received": count_of_received,
-        "loss": round((count - count_of_received) * 100.0 / count, 2) if count > 0 else 0,
-        "min": round(rtt_min, 2) if count_of_received > 0 else None,
-        "avg": round(rtt_sum / count_of_received, 2) if count_of_received > 0 else None,
-        "max": round(rtt_max, 2) if count_of_received > 0 else None
+        "transmitted": len(results),
+        "received": len(connect_times),
+        "loss": round((len(results) - len(connect_times)) * 100.0 / len(results), 2) if results else 0,
+        "min": round(min(connect_times), 2) if connect_times else None,
+        "avg": round(sum(connect_times) / len(connect_times), 2) if connect_times else None,
+        "max": round(max(connect_times), 2) if connect_times else None
     }
-    
+    if not connect_only:
+        echo_times = [r["time"] for r in results if r["status"] == "success"]
+        stats["echo_min"] = round(min(echo_times), 2) if echo_times else None
+        stats["echo_avg"] = round(sum(echo_times) / len(echo_times), 2) if echo_times else None
+        stats["echo_max"] = round(max(echo_times), 2) if echo_times else None
+    stats.update(summarize_tcp_info([r.get("tcp_info") for r in results]))
+
     return {"results": results, "stats": stats}
 
 # 主程序入口
@@ -173,11 +429,14 @@ if __name__ == "__main__":
         print(""" options:""")
         print("""   LEN         the length of payload, unit:byte""")
         print("""   INTERVAL    the seconds waited between sending each packet, as well as the timeout for reply packet, unit: ms""")
+        print("""   PERSISTENT  keep one connection open and measure only the echo RTT, 0 or 1""")
+        print("""   FASTOPEN    send the payload with the SYN using TCP Fast Open, 0 or 1""")
 
         print()
         print(" examples:")
         print("   ./tcpping.py 44.55.66.77 4000")
         print('   ./tcpping.py 44.55.66.77 4000 "LEN=400;INTERVAL=2000"')
+        print('   ./tcpping.py 44.55.66.77 4000 "INTERVAL=10;PERSISTENT=1"')
         print("   ./tcpping.py fe80::5400:ff:aabb:ccdd 4000")
         print()
 
@@ -186,85 +445,30 @@ if __name__ == "__main__":
     IP = sys.argv[1]
     PORT = int(sys.argv[2])
 
-    is_ipv6 = 0
-
-    if IP.find(":") != -1:
-        is_ipv6 = 1
-
     if len(sys.argv) == 4:
         exec(sys.argv[3])
-        
-    if LEN < 5:
-        print("LEN must be >=5")
-        exit()
-    if INTERVAL < 50:
-        print("INTERVAL must be >=50")
+
+    pinger = TcpPinger(IP, PORT, LEN, INTERVAL, bool(PERSISTENT), bool(FASTOPEN))
+    error = pinger.validate()
+    if error:
+        print(error)
         exit()
 
-    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGINT, pinger.signal_handler)
 
     print("TCPping %s via port %d with %d bytes of payload"% (IP, PORT, LEN))
     sys.stdout.flush()
 
     while True:
-        payload = random_string(LEN)
-        
-        # 创建TCP套接字
-        try:
-            if not is_ipv6:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            else:
-                sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
-            
-            # 设置连接超时
-            sock.settimeout(INTERVAL/1000.0)
-            
-            # 记录发送时间
-            time_of_send = time.time()
-            
-            # 尝试连接
-            sock.connect((IP, PORT))
-            
-            # 发送数据
-            sock.sendall(payload.encode())
-            
-            # 接收数据
-            received_data = b""
-            while len(received_data) < LEN:
-                chunk = sock.recv(LEN - len(received_data))
-                if not chunk:
-                    break
-                received_data += chunk
-            
-            # 计算RTT
-            rtt = ((time.time() - time_of_send) * 1000)
-            
-            # 检查接收到的数据是否与发送的相同
-            if received_data == payload.encode():
-                print("Reply from", IP, "seq=%d"%count, "time=%.2f"%(rtt), "ms")
-                sys.stdout.flush()
-                count_of_received += 1
-                rtt_sum += rtt
-                rtt_max = max(rtt_max, rtt)
-                rtt_min = min(rtt_min, rtt)
-            else:
-                print("Reply from", IP, "seq=%d"%count, "invalid data received")
-                sys.stdout.flush()
-            
-            # 关闭套接字
-            sock.close()
-            
-        except socket.timeout:
+        result = pinger.ping_once()
+        if result["status"] == "success" and "connect_time" in result:
+            print("Reply from", IP, "seq=%d"%(result["seq"] - 1), "time=%.2f"%(result["time"]), "ms", "connect=%.2f"%(result["connect_time"]), "ms")
+        elif result["status"] == "success":
+            print("Reply from", IP, "seq=%d"%(result["seq"] - 1), "time=%.2f"%(result["time"]), "ms")
+        elif result.get("message") == "invalid data received":
+            print("Reply from", IP, "seq=%d"%(result["seq"] - 1), "invalid data received")
+        elif result["status"] == "timeout":
             print("Request timed out")
-            sys.stdout.flush()
-        except socket.error as e:
-            print(f"Connection error: {e}")
-            sys.stdout.flush()
-        
-        count += 1
-        
-        # 等待下一次发送
-        deadline = time_of_send + INTERVAL/1000.0
-        time_remaining = deadline - time.time()
-        if time_remaining > 0:
-            time.sleep(time_remaining)
\ No newline at end of file
+        else:
+            print(f"Connection error: {result['message']}")
+        sys.stdout.flush()
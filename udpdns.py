@@ -2,288 +2,612 @@
 
 from __future__ import print_function
 
+import asyncio
+import errno
 import socket
 import sys
 import time
-import string
-import random
-import struct
-import binascii
+import threading
+from collections import OrderedDict
 
-# DNS查询类型
-QTYPE_A = 1      # IPv4地址
-QTYPE_NS = 2     # 域名服务器
-QTYPE_CNAME = 5  # 规范名称
-QTYPE_SOA = 6    # 权威记录开始
-QTYPE_PTR = 12   # 指针记录
-QTYPE_MX = 15    # 邮件交换
-QTYPE_TXT = 16   # 文本记录
-QTYPE_AAAA = 28  # IPv6地址
-QTYPE_ANY = 255  # 任何记录
+from dnscodec import (QTYPE_A, QTYPE_NS, QTYPE_CNAME, QTYPE_SOA, QTYPE_PTR, QTYPE_MX, QTYPE_TXT,
+                      QTYPE_AAAA, QTYPE_ANY, QTYPE_NAMES, HEADER, QUESTION_TAIL, UINT16,
+                      build_query, get_qtype, parse_dns_response, skip_domain_name)
+from tcpdns import tcp_dns_query
+from rtt import get_estimator
 
-# DNS查询类型名称映射
-QTYPE_NAMES = {
-    QTYPE_A: "A",
-    QTYPE_NS: "NS",
-    QTYPE_CNAME: "CNAME",
-    QTYPE_SOA: "SOA",
-    QTYPE_PTR: "PTR",
-    QTYPE_MX: "MX",
-    QTYPE_TXT: "TXT",
-    QTYPE_AAAA: "AAAA",
-    QTYPE_ANY: "ANY"
-}
+# 每个DNS服务器地址保持的已连接UDP套接字数量
+POOL_SIZE = 4
 
-# DNS响应代码
-RCODE_NOERROR = 0   # 没有错误
-RCODE_FORMERR = 1   # 格式错误
-RCODE_SERVFAIL = 2  # 服务器失败
-RCODE_NXDOMAIN = 3  # 不存在的域名
-RCODE_NOTIMP = 4    # 未实现
-RCODE_REFUSED = 5   # 查询被拒绝
+# 连接池最多为多少个DNS服务器保持套接字，超过后关闭最久未使用的服务器的套接字
+MAX_POOL_SERVERS = 64
 
-# DNS响应代码名称映射
-RCODE_NAMES = {
-    RCODE_NOERROR: "NOERROR",
-    RCODE_FORMERR: "FORMERR",
-    RCODE_SERVFAIL: "SERVFAIL",
-    RCODE_NXDOMAIN: "NXDOMAIN",
-    RCODE_NOTIMP: "NOTIMP",
-    RCODE_REFUSED: "REFUSED"
-}
+# 服务器的套接字空闲超过该时间(秒)后被关闭
+POOL_IDLE_TIMEOUT = 300
 
-# 生成随机DNS查询ID
-def generate_query_id():
-    return random.randint(0, 65535)
+# UDP响应的最大长度
+MAX_UDP_RESPONSE = 65535
 
-# 将域名转换为DNS查询格式
-def encode_dns_name(domain_name):
-    encoded = b""
-    for part in domain_name.split("."):
-        encoded += struct.pack("B", len(part)) + part.encode()
-    return encoded + b"\x00"
+# 查询超时后的默认重传次数
+RETRIES = 2
 
-# 从DNS响应中解析域名
-def decode_dns_name(message, offset):
-    name_parts = []
-    while True:
-        length = message[offset]
-        if length == 0:
-            offset += 1
-            break
-        # 处理压缩指针 (0xC0 = 192)
-        if (length & 0xC0) == 0xC0:
-            pointer = ((length & 0x3F) << 8) | message[offset + 1]
-            offset += 2
-            # 递归解析指针指向的域名
-            pointed_parts, _ = decode_dns_name(message, pointer)
-            name_parts.extend(pointed_parts)
-            break
-        else:
-            offset += 1
-            name_part = message[offset:offset + length].decode()
-            name_parts.append(name_part)
-            offset += length
-    return name_parts, offset
+# 默认的EDNS0 UDP缓冲区大小，1232字节可避免绝大多数路径上的IP分片(DNS Flag Day 2020)
+EDNS_BUFFER_SIZE = 1232
 
-# 解析DNS响应
-def parse_dns_response(response):
-    if len(response) < 12:
-        return {"error": "响应太短，无法解析"}
-    
-    # 解析DNS头部
-    header = struct.unpack("!HHHHHH", response[:12])
-    query_id = header[0]
-    flags = header[1]
-    qdcount = header[2]  # 问题数
-    ancount = header[3]  # 回答数
-    nscount = header[4]  # 授权记录数
-    arcount = header[5]  # 附加记录数
-    
-    # 解析响应代码
-    rcode = flags & 0x0F
-    rcode_name = RCODE_NAMES.get(rcode, f"未知({rcode})")
-    
-    # 检查是否为响应
-    is_response = (flags & 0x8000) != 0
-    if not is_response:
-        return {"error": "不是DNS响应"}
-    
-    # 检查响应代码
-    if rcode != RCODE_NOERROR:
-        return {
-            "id": query_id,
-            "status": "error",
-            "rcode": rcode,
-            "rcode_name": rcode_name,
-            "message": f"DNS服务器返回错误: {rcode_name}"
-        }
+# 异步解析器套接字的接收缓冲区大小
+RECV_BUFFER_SIZE = 4 * 1024 * 1024
+
+# 创建DNS查询包，edns为EDNS0的UDP缓冲区大小，为None时不附加OPT记录
+def create_dns_query(domain, query_type=QTYPE_A, edns=None):
+    return build_query(domain, query_type, edns=edns)
+
+# 响应头部的TC标志，服务器因UDP缓冲区不足截断了响应
+def is_truncated(response):
+    return len(response) >= HEADER.size and bool(response[2] & 0x02)
+
+# 截断的UDP响应改用TCP重新查询，RTT为UDP往返与TCP查询耗时之和
+def tcp_fallback_query(domain, server_ip, server_port, query_type, timeout, header_only, udp_rtt):
+    start_time = time.time()
+    result = tcp_dns_query(domain, server_ip, server_port, query_type, timeout, header_only=header_only)
+    tcp_time = (time.time() - start_time) * 1000
     
-    # 跳过问题部分
-    offset = 12
-    for _ in range(qdcount):
-        # 跳过查询名称
-        while offset < len(response):
-            length = response[offset]
-            if length == 0 or (length & 0xC0) == 0xC0:
-                if (length & 0xC0) == 0xC0:
-                    offset += 2
-                else:
-                    offset += 1
-                break
-            offset += length + 1
-        # 跳过查询类型和类
-        offset += 4
+    result["truncated"] = True
+    result["fallback"] = "tcp"
+    result["udp_rtt"] = round(udp_rtt, 2)
+    result["tcp_rtt"] = round(tcp_time, 2)
+    if result["status"] == "success":
+        result["rtt"] = round(udp_rtt + tcp_time, 2)
+    return result
+
+# 返回查询报文中问题部分的字节，用于匹配响应
+def get_question(packet):
+    return bytes(packet[HEADER.size:skip_domain_name(packet, HEADER.size) + QUESTION_TAIL.size])
+
+# 连接到一个DNS服务器的UDP套接字及其响应分发器
+# 多个线程可以同时在一个通道上查询: 同一时刻只有一个线程负责接收，
+# 收到的响应按 (来源地址, 查询ID, 问题) 交给对应的等待者，伪造或过期的响应被丢弃
+class UdpChannel(object):
+    def __init__(self, server_ip, server_port=53):
+        family, _, _, _, address = socket.getaddrinfo(server_ip, server_port, 0, socket.SOCK_DGRAM)[0]
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            self.sock.connect(address)
+        except OSError:
+            self.sock.close()
+            raise
+        self.peer = self.sock.getpeername()
+        self.pending = {}
+        self.cond = threading.Condition()
+        self.reading = False
+        self.dropped = 0
+        self.queries = 0
+        self.active = 0
+        self.closed = False
+    
+    # 关闭套接字；仍有查询在进行时推迟到最后一个查询结束后关闭
+    def close(self):
+        with self.cond:
+            self.closed = True
+            if self.active:
+                return
+        self.sock.close()
+    
+    # 预留通道供一次查询使用，通道已关闭时返回False；预留期间close()推迟关闭套接字
+    def acquire(self):
+        with self.cond:
+            if self.closed:
+                return False
+            self.active += 1
+            return True
+    
+    # 结束预留，通道已关闭且没有其他查询时关闭套接字
+    def release(self):
+        with self.cond:
+            self.active -= 1
+            close_now = self.closed and self.active == 0
+        if close_now:
+            self.sock.close()
     
-    # 解析回答部分
-    answers = []
-    for _ in range(ancount):
+    # 发送查询并等待匹配的响应，返回 (响应数据, 往返时间ms, 发送次数)，超时抛出socket.timeout
+    # 提供estimator时，每次等待按估计的RTO指数退避，超时后用新的查询ID重传最多retries次；
+    # 之前发送的查询仍然有效，先到的响应被采用，RTT按对应那次发送计算；总耗时不超过timeout秒
+    # reserved为True表示调用方已通过acquire()预留了通道，查询结束后同样释放
+    def query(self, domain, query_type=QTYPE_A, timeout=5, edns=None, retries=0, estimator=None, reserved=False):
+        if not reserved and not self.acquire():
+            raise OSError(errno.EBADF, "通道已关闭")
+        deadline = time.time() + timeout
+        slot = {"response": None, "time": None, "key": None}
+        send_times = {}
+        if estimator is None:
+            retries = 0
+        
         try:
-            # 解析记录名称
-            name_parts, offset = decode_dns_name(response, offset)
-            name = ".".join(name_parts)
+            attempt = 0
+            while True:
+                with self.cond:
+                    # 避开本通道上仍在等待响应的查询ID
+                    while True:
+                        query_id, packet = build_query(domain, query_type, edns=edns)
+                        key = (query_id, get_question(packet))
+                        if key not in self.pending:
+                            break
+                    self.pending[key] = slot
+                    self.queries += 1
+                
+                send_times[key] = time.time()
+                self.sock.send(packet)
+                
+                if attempt < retries:
+                    attempt_deadline = min(send_times[key] + estimator.attempt_timeout(attempt) / 1000.0, deadline)
+                else:
+                    attempt_deadline = deadline
+                attempt += 1
+                
+                if self._wait(slot, attempt_deadline):
+                    break
+                if estimator is not None:
+                    estimator.record_timeout()
+                if attempt > retries or time.time() >= deadline:
+                    error = socket.timeout("timed out")
+                    error.attempts = attempt
+                    raise error
             
-            # 解析记录类型、类、TTL和数据长度
-            if offset + 10 > len(response):
-                break
-            record_type, record_class, ttl, rdlength = struct.unpack("!HHIH", response[offset:offset+10])
-            offset += 10
+            rtt = (slot["time"] - send_times[slot["key"]]) * 1000
+            if estimator is not None:
+                estimator.update(rtt)
+            return slot["response"], rtt, attempt
+        finally:
+            with self.cond:
+                for key in send_times:
+                    self.pending.pop(key, None)
+            self.release()
+    
+    # 等待响应直到deadline，收到返回True，超时返回False
+    def _wait(self, slot, deadline):
+        while True:
+            with self.cond:
+                while slot["response"] is None and self.reading:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self.cond.wait(remaining)
+                if slot["response"] is not None:
+                    return True
+                self.reading = True
             
-            # 解析记录数据
-            record_data = ""
-            if record_type == QTYPE_A and rdlength == 4:
-                # IPv4地址
-                ip_bytes = response[offset:offset+rdlength]
-                record_data = ".".join(str(b) for b in ip_bytes)
-            elif record_type == QTYPE_AAAA and rdlength == 16:
-                # IPv6地址
-                ip_bytes = response[offset:offset+rdlength]
-                record_data = ":"
-                for i in range(0, 16, 2):
-                    record_data += f"{ip_bytes[i]:02x}{ip_bytes[i+1]:02x}"
-                    if i < 14:
-                        record_data += ":"
-            elif record_type == QTYPE_MX:
-                # 邮件交换记录
-                preference = struct.unpack("!H", response[offset:offset+2])[0]
-                mx_parts, _ = decode_dns_name(response, offset+2)
-                record_data = f"{preference} {'.'.join(mx_parts)}"
-            elif record_type in [QTYPE_NS, QTYPE_CNAME, QTYPE_PTR]:
-                # 域名指针
-                name_parts, _ = decode_dns_name(response, offset)
-                record_data = ".".join(name_parts)
-            elif record_type == QTYPE_TXT:
-                # 文本记录
-                txt_length = response[offset]
-                record_data = response[offset+1:offset+1+txt_length].decode(errors='replace')
-            else:
-                # 其他记录类型，以十六进制显示
-                record_data = binascii.hexlify(response[offset:offset+rdlength]).decode()
+            # 当前线程负责接收，直到自己的响应到达或超时
+            try:
+                self._receive(slot, deadline)
+            except socket.timeout:
+                return False
+            finally:
+                with self.cond:
+                    self.reading = False
+                    self.cond.notify_all()
+            if slot["response"] is not None:
+                return True
+    
+    def _receive(self, slot, deadline):
+        while slot["response"] is None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise socket.timeout("timed out")
+            self.sock.settimeout(remaining)
+            data, addr = self.sock.recvfrom(MAX_UDP_RESPONSE)
+            recv_time = time.time()
             
-            answers.append({
-                "name": name,
-                "type": QTYPE_NAMES.get(record_type, str(record_type)),
-                "class": record_class,
-                "ttl": ttl,
-                "data": record_data
-            })
+            key = None
+            if addr[:2] == self.peer[:2] and len(data) >= HEADER.size:
+                try:
+                    key = (UINT16.unpack_from(data)[0], get_question(data))
+                except (IndexError, ValueError):
+                    key = None
             
-            offset += rdlength
-        except Exception as e:
-            answers.append({"error": f"解析记录时出错: {str(e)}"})
-            break
+            with self.cond:
+                waiter = self.pending.get(key) if key is not None else None
+                if waiter is None or waiter["response"] is not None:
+                    self.dropped += 1
+                    continue
+                waiter["response"] = data
+                waiter["time"] = recv_time
+                waiter["key"] = key
+                self.cond.notify_all()
+
+# 按DNS服务器地址复用已连接UDP套接字的连接池
+# 最多为max_servers个服务器保持套接字，按最近使用顺序淘汰，空闲超过idle_timeout秒的服务器也被关闭
+class UdpSocketPool(object):
+    def __init__(self, size=POOL_SIZE, max_servers=MAX_POOL_SERVERS, idle_timeout=POOL_IDLE_TIMEOUT):
+        self.size = size
+        self.max_servers = max_servers
+        self.idle_timeout = idle_timeout
+        self.channels = OrderedDict()
+        self.next_index = {}
+        self.last_used = {}
+        self.evictions = 0
+        self.lock = threading.Lock()
     
-    return {
-        "id": query_id,
-        "status": "success",
-        "rcode": rcode,
-        "rcode_name": rcode_name,
-        "answers": answers,
-        "answer_count": len(answers)
-    }
+    # 轮流返回指定服务器的一个通道，需要时创建
+    # 通道在持有连接池锁时被预留，淘汰不会在查询开始前关闭它；调用方用完后必须调用channel.release()
+    def get_channel(self, server_ip, server_port=53):
+        key = (server_ip, server_port)
+        now = time.time()
+        with self.lock:
+            channels = self.channels.get(key)
+            if channels is None:
+                channels = self.channels[key] = []
+            else:
+                self.channels.move_to_end(key)
+            self.last_used[key] = now
+            index = self.next_index.get(key, 0)
+            self.next_index[key] = (index + 1) % self.size
+            if index >= len(channels):
+                channels.append(UdpChannel(server_ip, server_port))
+                index = len(channels) - 1
+            channel = channels[index]
+            if not channel.acquire():
+                channel = channels[index] = UdpChannel(server_ip, server_port)
+                channel.acquire()
+            evicted = self._evict(now)
+        
+        for old in evicted:
+            old.close()
+        return channel
+    
+    # 移出超过数量上限或空闲超时的服务器，返回需要关闭的通道；调用方持有锁
+    def _evict(self, now):
+        evicted = []
+        while self.channels:
+            key = next(iter(self.channels))
+            if len(self.channels) <= self.max_servers and now - self.last_used[key] < self.idle_timeout:
+                break
+            evicted.extend(self.channels.pop(key))
+            del self.last_used[key]
+            self.next_index.pop(key, None)
+            self.evictions += 1
+        return evicted
+    
+    def query(self, domain, server_ip, server_port=53, query_type=QTYPE_A, timeout=5, edns=None, retries=0,
+              estimator=None):
+        channel = self.get_channel(server_ip, server_port)
+        return channel.query(domain, query_type, timeout, edns, retries, estimator, reserved=True)
+    
+    def stats(self):
+        with self.lock:
+            channels = [channel for group in self.channels.values() for channel in group]
+        return {
+            "servers": len(self.channels),
+            "sockets": len(channels),
+            "queries": sum(channel.queries for channel in channels),
+            "dropped": sum(channel.dropped for channel in channels),
+            "evictions": self.evictions
+        }
+    
+    def close(self):
+        with self.lock:
+            for group in self.channels.values():
+                for channel in group:
+                    channel.close()
+            self.channels.clear()
+            self.next_index.clear()
+            self.last_used.clear()
 
-# 创建DNS查询包
-def create_dns_query(domain, query_type=QTYPE_A):
-    # 生成随机查询ID
-    query_id = generate_query_id()
-    
-    # 构建DNS头部
-    # 标志: 标准查询，递归期望
-    flags = 0x0100
-    qdcount = 1  # 一个问题
-    ancount = 0  # 没有回答
-    nscount = 0  # 没有授权记录
-    arcount = 0  # 没有附加记录
-    
-    header = struct.pack("!HHHHHH", query_id, flags, qdcount, ancount, nscount, arcount)
-    
-    # 构建问题部分
-    question = encode_dns_name(domain)
-    question += struct.pack("!HH", query_type, 1)  # 类型和类(1=IN)
-    
-    return query_id, header + question
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+# 返回进程内共享的UDP套接字池
+def get_default_pool():
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = UdpSocketPool()
+        return _default_pool
 
 # 执行DNS查询
-def dns_query(domain, server_ip, server_port=53, query_type=QTYPE_A, timeout=5):
+# header_only为True时只解析响应头部，适合只关心丢包和延迟的大量查询；
+# pooled为True时使用共享套接字池，否则为本次查询单独创建套接字；
+# edns为EDNS0的UDP缓冲区大小(None或0表示不使用EDNS)，响应被截断且tcp_fallback为True时自动改用TCP；
+# 每次等待时间由该服务器的RTT估计器给出，超时后最多重传retries次，timeout为总的超时时间
+def dns_query(domain, server_ip, server_port=53, query_type=QTYPE_A, timeout=5, header_only=False, pooled=True,
+              edns=EDNS_BUFFER_SIZE, tcp_fallback=True, retries=RETRIES):
+    channel = None
+    edns = edns or None
+    estimator = get_estimator("udp", server_ip, server_port)
     try:
-        # 创建UDP套接字
-        is_ipv6 = server_ip.find(":") != -1
-        if not is_ipv6:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if pooled:
+            response, rtt, attempts = get_default_pool().query(domain, server_ip, server_port, query_type, timeout,
+                                                               edns, retries, estimator)
         else:
-            sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
-        
-        sock.settimeout(timeout)
+            channel = UdpChannel(server_ip, server_port)
+            response, rtt, attempts = channel.query(domain, query_type, timeout, edns, retries, estimator)
         
-        # 创建DNS查询包
-        query_id, query_packet = create_dns_query(domain, query_type)
+        truncated = is_truncated(response)
+        if truncated and tcp_fallback:
+            result = tcp_fallback_query(domain, server_ip, server_port, query_type, timeout, header_only, rtt)
+            result["attempts"] = attempts
+            return result
         
-        # 发送查询
-        start_time = time.time()
-        sock.sendto(query_packet, (server_ip, server_port))
-        
-        # 接收响应
-        response, addr = sock.recvfrom(4096)
-        end_time = time.time()
-        rtt = (end_time - start_time) * 1000  # 毫秒
-        
-        # 解析响应
-        parsed = parse_dns_response(response)
-        
-        # 检查响应ID是否匹配
-        if parsed.get("id") != query_id:
-            return {
-                "status": "error",
-                "message": f"响应ID不匹配: 预期{query_id}，收到{parsed.get('id')}"
-            }
+        # 响应已按查询ID和问题匹配，直接解析
+        parsed = parse_dns_response(response, header_only)
         
         # 添加RTT信息
         parsed["rtt"] = round(rtt, 2)
+        parsed["attempts"] = attempts
+        if truncated:
+            parsed["truncated"] = True
         return parsed
         
-    except socket.timeout:
-        return {"status": "timeout", "message": "查询超时"}
+    except socket.timeout as e:
+        return {"status": "timeout", "message": "查询超时", "attempts": getattr(e, "attempts", 1)}
     except Exception as e:
         return {"status": "error", "message": str(e)}
     finally:
-        sock.close()
+        if channel is not None:
+            channel.close()
+
+# asyncio版本的UDP DNS客户端协议，按 (查询ID, 问题) 把响应交给等待的future
+class _DnsClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.transport = None
+        self.peer = None
+        self.waiters = {}
+        self.dropped = 0
+    
+    def connection_made(self, transport):
+        self.transport = transport
+        self.peer = transport.get_extra_info("peername")
+        # 大量并发查询的响应可能同时到达，扩大接收缓冲区避免内核丢包
+        sock = transport.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_SIZE)
+    
+    def datagram_received(self, data, addr):
+        waiter = None
+        if addr[:2] == self.peer[:2] and len(data) >= HEADER.size:
+            try:
+                waiter = self.waiters.pop((UINT16.unpack_from(data)[0], get_question(data)), None)
+            except (IndexError, ValueError):
+                waiter = None
+        if waiter is None or waiter.done():
+            self.dropped += 1
+            return
+        waiter.set_result((data, time.time()))
+    
+    def error_received(self, exc):
+        # 已连接套接字收到ICMP不可达，说明服务器不可用，让所有等待中的查询立即失败
+        waiters = list(self.waiters.values())
+        self.waiters.clear()
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_exception(exc)
+
+# 异步UDP DNS解析器，在少量已连接套接字上同时保持大量未完成的查询
+# 用法:
+#     async with AsyncDnsResolver("8.8.8.8") as resolver:
+#         result = await resolver.query("example.com", "A")
+#         results = await resolver.query_many(["a.com", "b.com"])
+class AsyncDnsResolver(object):
+    def __init__(self, server_ip, server_port=53, sockets=POOL_SIZE, timeout=5, edns=EDNS_BUFFER_SIZE,
+                 tcp_fallback=True, retries=RETRIES, cache=None):
+        self.server_ip = server_ip
+        self.server_port = server_port
+        self.sockets = sockets
+        self.timeout = timeout
+        self.edns = edns or None
+        self.tcp_fallback = tcp_fallback
+        self.retries = retries
+        self.estimator = get_estimator("udp", server_ip, server_port)
+        self.cache = cache
+        # 正在查询的缓存键 -> future，相同名称的并发查询只发送一次
+        self.inflight = {}
+        self.coalesced = 0
+        self.endpoints = []
+        self.next_index = 0
+        self.open_lock = None
+    
+    async def open(self):
+        if self.open_lock is None:
+            self.open_lock = asyncio.Lock()
+        async with self.open_lock:
+            if self.endpoints:
+                return
+            loop = asyncio.get_running_loop()
+            endpoints = []
+            try:
+                for _ in range(self.sockets):
+                    endpoints.append(await loop.create_datagram_endpoint(
+                        _DnsClientProtocol, remote_addr=(self.server_ip, self.server_port)))
+            except OSError:
+                for transport, _ in endpoints:
+                    transport.close()
+                raise
+            self.endpoints = endpoints
+    
+    def close(self):
+        for transport, _ in self.endpoints:
+            transport.close()
+        self.endpoints = []
+    
+    async def __aenter__(self):
+        await self.open()
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+    
+    # 执行一次查询，返回与dns_query相同格式的结果；任务被取消时撤销等待并抛出CancelledError
+    # 设置了cache(dnscache.DnsCache)时先查缓存，未命中的相同查询在完成前只发送一次，结果按TTL写入缓存
+    async def query(self, domain, query_type=QTYPE_A, timeout=None, header_only=False):
+        if self.cache is None:
+            return await self._query(domain, query_type, timeout, header_only)
+        
+        key = self.cache.make_key("udp", self.server_ip, self.server_port, domain, query_type)
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+        
+        inflight_key = (key, header_only)
+        pending = self.inflight.get(inflight_key)
+        if pending is not None:
+            # 等待已在进行的相同查询；该查询被取消时自己重新查询
+            await asyncio.wait([pending])
+            if not pending.cancelled():
+                self.coalesced += 1
+                result = dict(pending.result())
+                result["coalesced"] = True
+                return result
+            return await self.query(domain, query_type, timeout, header_only)
+        
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[inflight_key] = future
+        try:
+            result = await self._query(domain, query_type, timeout, header_only)
+            self.cache.put(key, result)
+            result["cache_hit"] = False
+            future.set_result(result)
+            return result
+        finally:
+            del self.inflight[inflight_key]
+            if not future.done():
+                future.cancel()
+    
+    # 与UdpChannel.query相同，按RTT估计器给出的RTO重传，之前发送的查询仍可被响应
+    async def _query(self, domain, query_type=QTYPE_A, timeout=None, header_only=False):
+        if timeout is None:
+            timeout = self.timeout
+        loop = asyncio.get_running_loop()
+        send_times = {}
+        keys = []
+        attempt = 0
+        try:
+            if not self.endpoints:
+                await self.open()
+            transport, protocol = self.endpoints[self.next_index % len(self.endpoints)]
+            self.next_index += 1
+            waiter = loop.create_future()
+            deadline = time.time() + timeout
+            
+            try:
+                while True:
+                    # 避开本套接字上仍在等待响应的查询ID
+                    while True:
+                        query_id, packet = build_query(domain, query_type, edns=self.edns)
+                        key = (query_id, get_question(packet))
+                        if key not in protocol.waiters:
+                            break
+                    protocol.waiters[key] = waiter
+                    keys.append(key)
+                    send_times[query_id] = time.time()
+                    transport.sendto(packet)
+                    
+                    remaining = deadline - time.time()
+                    if attempt < self.retries:
+                        attempt_timeout = min(self.estimator.attempt_timeout(attempt) / 1000.0, remaining)
+                    else:
+                        attempt_timeout = remaining
+                    attempt += 1
+                    
+                    try:
+                        response, recv_time = await asyncio.wait_for(asyncio.shield(waiter), max(attempt_timeout, 0))
+                        break
+                    except asyncio.TimeoutError:
+                        self.estimator.record_timeout()
+                        if attempt > self.retries or time.time() >= deadline:
+                            raise
+            finally:
+                for key in keys:
+                    if protocol.waiters.get(key) is waiter:
+                        del protocol.waiters[key]
+                if not waiter.done():
+                    waiter.cancel()
+            
+            rtt = (recv_time - send_times[UINT16.unpack_from(response)[0]]) * 1000
+            self.estimator.update(rtt)
+            truncated = is_truncated(response)
+            if truncated and self.tcp_fallback:
+                # TCP回退是阻塞调用，放到默认线程池中执行
+                result = await loop.run_in_executor(
+                    None, tcp_fallback_query, domain, self.server_ip, self.server_port, query_type,
+                    timeout, header_only, rtt)
+                result["attempts"] = attempt
+                return result
+            
+            parsed = parse_dns_response(response, header_only)
+            parsed["rtt"] = round(rtt, 2)
+            parsed["attempts"] = attempt
+            if truncated:
+                parsed["truncated"] = True
+            return parsed
+        
+        except asyncio.TimeoutError:
+            return {"status": "timeout", "message": "查询超时", "attempts": attempt}
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+    
+    # 批量查询，names的元素可以是域名或 (域名, 查询类型)；concurrency限制同时未完成的查询数
+    # 返回与names顺序一致的结果列表
+    async def query_many(self, names, query_type=QTYPE_A, timeout=None, header_only=False, concurrency=None):
+        semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+        
+        async def run(name):
+            qtype = query_type
+            if isinstance(name, (tuple, list)):
+                name, qtype = name
+            if semaphore is None:
+                result = await self.query(name, qtype, timeout, header_only)
+            else:
+                async with semaphore:
+                    result = await self.query(name, qtype, timeout, header_only)
+            result["domain"] = name
+            return result
+        
+        return await asyncio.gather(*(run(name) for name in names))
+    
+    def stats(self):
+        return {
+            "sockets": len(self.endpoints),
+            "outstanding": sum(len(protocol.waiters) for _, protocol in self.endpoints),
+            "dropped": sum(protocol.dropped for _, protocol in self.endpoints),
+            "coalesced": self.coalesced
+        }
+
+# 同步入口，在新的事件循环中批量查询，返回与names顺序一致的结果列表；cache为dnscache.DnsCache时跨调用复用回答
+def dns_query_many(names, server_ip, server_port=53, query_type=QTYPE_A, timeout=5, header_only=False,
+                   concurrency=None, sockets=POOL_SIZE, edns=EDNS_BUFFER_SIZE, tcp_fallback=True, retries=RETRIES,
+                   cache=None):
+    async def run():
+        async with AsyncDnsResolver(server_ip, server_port, sockets, timeout, edns, tcp_fallback,
+                                    retries, cache) as resolver:
+            return await resolver.query_many(names, query_type, header_only=header_only, concurrency=concurrency)
+    
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(run())
+    finally:
+        loop.close()
 
 # 执行多次DNS查询并返回统计信息
-def dns_test(domain, server_ip, server_port=53, query_type=QTYPE_A, count=5, interval=1000):
+def dns_test(domain, server_ip, server_port=53, query_type=QTYPE_A, count=5, interval=1000, header_only=False,
+             pooled=True, edns=EDNS_BUFFER_SIZE, tcp_fallback=True, retries=RETRIES, timeout=5):
     results = []
     success_count = 0
+    fallback_count = 0
+    retransmits = 0
     total_rtt = 0
     min_rtt = float('inf')
     max_rtt = 0
     
-    query_type_code = query_type
-    if isinstance(query_type, str):
-        # 将字符串类型转换为代码
-        query_type_code = next((code for code, name in QTYPE_NAMES.items() if name == query_type), QTYPE_A)
+    # 将字符串类型转换为代码
+    query_type_code = get_qtype(query_type)
     
     for i in range(count):
-        result = dns_query(domain, server_ip, server_port, query_type_code)
+        result = dns_query(domain, server_ip, server_port, query_type_code, timeout, header_only, pooled,
+                           edns, tcp_fallback, retries)
         result["seq"] = i + 1
+        if result.get("fallback"):
+            fallback_count += 1
+        retransmits += result.get("attempts", 1) - 1
         
         if result["status"] == "success":
             success_count += 1
@@ -302,7 +626,10 @@ def dns_test(domain, server_ip, server_port=53, query_type=QTYPE_A, count=5, int
     stats = {
         "transmitted": count,
         "received": success_count,
-        "loss": round((count - success_count) * 100.0 / count, 2) if count > 0 else 0
+        "loss": round((count - success_count) * 100.0 / count, 2) if count > 0 else 0,
+        "tcp_fallbacks": fallback_count,
+        "retransmits": retransmits,
+        "rtt_estimator": get_estimator("udp", server_ip, server_port).snapshot()
     }
     
     if success_count > 0:
@@ -315,6 +642,7 @@ def dns_test(domain, server_ip, server_port=53, query_type=QTYPE_A, count=5, int
         "server": server_ip,
         "port": server_port,
         "query_type": QTYPE_NAMES.get(query_type_code, str(query_type_code)),
+        "edns": edns or None,
         "results": results,
         "stats": stats
     }
@@ -322,9 +650,9 @@ def dns_test(domain, server_ip, server_port=53, query_type=QTYPE_A, count=5, int
 # 命令行入口
 if __name__ == "__main__":
     if len(sys.argv) < 3:
-        print("用法: python udpdns.py <域名> <DNS服务器IP> [端口] [查询类型] [查询次数] [间隔(ms)]")
+        print("用法: python udpdns.py <域名> <DNS服务器IP> [端口] [查询类型] [查询次数] [间隔(ms)] [EDNS缓冲区大小(0为禁用)]")
         print("示例: python udpdns.py example.com 8.8.8.8")
-        print("示例: python udpdns.py example.com 8.8.8.8 53 A 5 1000")
+        print("示例: python udpdns.py example.com 8.8.8.8 53 A 5 1000 1232")
         sys.exit(1)
     
     domain = sys.argv[1]
@@ -333,19 +661,24 @@ if __name__ == "__main__":
     query_type_str = sys.argv[4] if len(sys.argv) > 4 else "A"
     count = int(sys.argv[5]) if len(sys.argv) > 5 else 5
     interval = int(sys.argv[6]) if len(sys.argv) > 6 else 1000
+    edns = int(sys.argv[7]) if len(sys.argv) > 7 else EDNS_BUFFER_SIZE
     
     # 将查询类型字符串转换为代码
-    query_type = next((code for code, name in QTYPE_NAMES.items() if name == query_type_str), QTYPE_A)
+    query_type = get_qtype(query_type_str)
     
     print(f"正在查询 {domain} 的 {query_type_str} 记录，使用DNS服务器 {server_ip}:{server_port}...")
     
-    results = dns_test(domain, server_ip, server_port, query_type, count, interval)
+    results = dns_test(domain, server_ip, server_port, query_type, count, interval, edns=edns)
     
     # 打印结果
     for result in results["results"]:
         if result["status"] == "success":
-            print(f"查询 {result['seq']}: 成功，RTT = {result['rtt']} ms，找到 {len(result['answers'])} 条记录")
-            for answer in result["answers"]:
+            print(f"查询 {result['seq']}: 成功，RTT = {result['rtt']} ms，找到 {result['answer_count']} 条记录")
+            if result.get("fallback"):
+                print(f"  响应被截断，已改用TCP: UDP = {result['udp_rtt']} ms, TCP = {result['tcp_rtt']} ms")
+            elif result.get("truncated"):
+                print("  响应被截断")
+            for answer in result.get("answers", []):
                 print(f"  {answer['name']} {answer['ttl']} IN {answer['type']} {answer['data']}")
         else:
             print(f"查询 {result['seq']}: {result['status']} - {result.get('message', '')}")
@@ -356,4 +689,8 @@ if __name__ == "__main__":
     print(f"发送 = {stats['transmitted']}, 接收 = {stats['received']}, 丢包率 = {stats['loss']}%")
     
     if stats["received"] > 0:
-        print(f"往返时间 (ms): 最小 = {stats['min_rtt']}, 平均 = {stats['avg_rtt']}, 最大 = {stats['max_rtt']}")
\ No newline at end of file
+        print(f"往返时间 (ms): 最小 = {stats['min_rtt']}, 平均 = {stats['avg_rtt']}, 最大 = {stats['max_rtt']}")
+    if stats["tcp_fallbacks"] > 0:
+        print(f"TCP回退 = {stats['tcp_fallbacks']}")
+    if stats["retransmits"] > 0:
+        print(f"重传 = {stats['retransmits']}, 当前RTO = {stats['rtt_estimator']['rto']} ms")
\ No newline at end of file
@@ -10,134 +10,429 @@ import random
 import signal
 import sys
 import os
+import asyncio
+import struct
+import threading
 
 INTERVAL = 1000  #unit ms
 LEN = 64
+COUNT = 10  # 多目标模式下每个目标的探测次数
 IP = ""
 PORT = 0
 
-count = 0
-count_of_received = 0
-rtt_sum = 0.0
-rtt_min = 99999999.0
-rtt_max = 0.0
-
-def signal_handler(signal, frame):
-	if count != 0 and count_of_received != 0:
-		print('')
-		print('--- ping statistics ---')
-	if count != 0:
-		print('%d packets transmitted, %d received, %.2f%% packet loss'%(count, count_of_received, (count-count_of_received)*100.0/count))
-	if count_of_received != 0:
-		print('rtt min/avg/max = %.2f/%.2f/%.2f ms'%(rtt_min, rtt_sum/count_of_received, rtt_max))
-	os._exit(0)
+# 流水线模式的报文头: 会话标识(4字节) + 序号(4字节) + 发送时间戳(8字节)
+PIPELINE_HEADER = struct.Struct("!IId")
+
+# 普通模式下写入载荷前4字节的探测序号
+PROBE_SEQ = struct.Struct("!I")
+
+RANDOM_CHARS = string.ascii_letters + string.digits
+
+# 多目标模式下每个数据报端点负责的目标数，目标更多时分散到多个端点(套接字)
+TARGETS_PER_ENDPOINT = 256
+
+# 多目标模式下端点套接字的接收缓冲区大小，所有目标的回包都进入少数几个套接字
+RECV_BUFFER_SIZE = 4 * 1024 * 1024
 
 def random_string(length):
-        return ''.join(random.choice(string.ascii_letters + string.digits) for m in range(length))
+        return ''.join(random.choices(RANDOM_CHARS, k=length))
 
-# 添加一个函数，用于从web.py调用
-def udp_ping(target_ip, target_port, packet_len=64, interval=1000, count_limit=10):
-    global IP, PORT, LEN, INTERVAL
-    global count, count_of_received, rtt_sum, rtt_min, rtt_max
-    
-    # 重置全局变量
-    count = 0
-    count_of_received = 0
-    rtt_sum = 0.0
-    rtt_min = 99999999.0
-    rtt_max = 0.0
-    
-    IP = target_ip
-    PORT = int(target_port)
-    LEN = packet_len
-    INTERVAL = interval
-    
-    is_ipv6 = 0
-    if IP.find(":") != -1:
-        is_ipv6 = 1
-    
-    if LEN < 5:
-        return {"error": "LEN must be >=5"}
-    if INTERVAL < 50:
-        return {"error": "INTERVAL must be >=50"}
-    
-    if not is_ipv6:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    else:
-        sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
-    
-    results = []
-    
-    for i in range(count_limit):
-        payload = random_string(LEN)
-        sock.sendto(payload.encode(), (IP, PORT))
+# 单个UDP Ping会话，统计数据保存在实例中，不同线程或事件循环中的会话互不干扰
+class UdpPinger(object):
+    def __init__(self, target_ip, target_port, packet_len=64, interval=1000):
+        self.ip = target_ip
+        self.port = int(target_port)
+        self.packet_len = packet_len
+        self.interval = interval
+        self.is_ipv6 = self.ip.find(":") != -1
+
+        # 载荷只分配一次，每次探测仅改写载荷中的序号
+        self.payload = bytearray(random_string(self.packet_len).encode())
+        self.payload_view = memoryview(self.payload)
+        # 接收缓冲区只在阻塞探测(ping_once)第一次使用时分配，异步多目标探测不需要
+        self.recv_buffer = None
+        self.recv_view = None
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.count_of_received = 0
+        self.rtt_sum = 0.0
+        self.rtt_min = 99999999.0
+        self.rtt_max = 0.0
+        self.results = []
+
+    # 检查参数，返回错误信息或None
+    def validate(self):
+        if self.packet_len < 5:
+            return "LEN must be >=5"
+        if self.interval < 50:
+            return "INTERVAL must be >=50"
+        return None
+
+    def open_socket(self):
+        if not self.is_ipv6:
+            return socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        return socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+
+    # 把下一个序号写入载荷，返回同一个缓冲区
+    def next_payload(self):
+        PROBE_SEQ.pack_into(self.payload, 0, self.count & 0xFFFFFFFF)
+        return self.payload
+
+    # 记录一次探测的结果，rtt为None表示超时
+    def record(self, rtt):
+        self.count += 1
+        result = {"seq": self.count, "time": None, "status": "timeout"}
+
+        if rtt is not None:
+            self.count_of_received += 1
+            self.rtt_sum += rtt
+            self.rtt_max = max(self.rtt_max, rtt)
+            self.rtt_min = min(self.rtt_min, rtt)
+            result["time"] = round(rtt, 2)
+            result["status"] = "success"
+
+        self.results.append(result)
+        return result
+
+    # 发送一个探测包并等待回包，间隔剩余的时间在返回前睡眠
+    def ping_once(self, sock):
+        if self.recv_buffer is None:
+            self.recv_buffer = bytearray(65536)
+            self.recv_view = memoryview(self.recv_buffer)
+        payload = self.next_payload()
+        sock.sendto(payload, (self.ip, self.port))
         time_of_send = time.time()
-        deadline = time.time() + INTERVAL/1000.0
-        received = 0
-        rtt = 0.0
-        
+        deadline = time.time() + self.interval/1000.0
+        rtt = None
+
         while True:
             timeout = deadline - time.time()
             if timeout < 0:
                 break
             sock.settimeout(timeout)
             try:
-                recv_data, addr = sock.recvfrom(65536)
-                if recv_data == payload.encode() and addr[0] == IP and addr[1] == PORT:
+                nbytes, addr = sock.recvfrom_into(self.recv_buffer)
+                if nbytes == self.packet_len and self.recv_view[:nbytes] == self.payload_view and addr[0] == self.ip and addr[1] == self.port:
                     rtt = ((time.time() - time_of_send) * 1000)
-                    received = 1
                     break
             except socket.timeout:
                 break
             except:
                 pass
-        
-        count += 1
-        result = {"seq": count, "time": None, "status": "timeout"}
-        
-        if received == 1:
-            count_of_received += 1
-            rtt_sum += rtt
-            rtt_max = max(rtt_max, rtt)
-            rtt_min = min(rtt_min, rtt)
-            result["time"] = round(rtt, 2)
-            result["status"] = "success"
-        
-        results.append(result)
-        
+
+        result = self.record(rtt)
+
         time_remaining = deadline - time.time()
         if time_remaining > 0:
             time.sleep(time_remaining)
-    
-    # 计算统计信息
+
+        return result
+
+    def stats(self):
+        count = self.count
+        count_of_received = self.count_of_received
+        return {
+            "transmitted": count,
+            "received": count_of_received,
+            "loss": round((count - count_of_received) * 100.0 / count, 2) if count > 0 else 0,
+            "min": round(self.rtt_min, 2) if count_of_received > 0 else None,
+            "avg": round(self.rtt_sum / count_of_received, 2) if count_of_received > 0 else None,
+            "max": round(self.rtt_max, 2) if count_of_received > 0 else None
+        }
+
+    def run(self, count_limit=10):
+        error = self.validate()
+        if error:
+            return {"error": error}
+
+        self.reset()
+        sock = self.open_socket()
+        try:
+            for i in range(count_limit):
+                self.ping_once(sock)
+        finally:
+            sock.close()
+
+        return {"results": self.results, "stats": self.stats()}
+
+    def print_stats(self):
+        if self.count != 0 and self.count_of_received != 0:
+            print('')
+            print('--- ping statistics ---')
+        if self.count != 0:
+            print('%d packets transmitted, %d received, %.2f%% packet loss'%(self.count, self.count_of_received, (self.count-self.count_of_received)*100.0/self.count))
+        if self.count_of_received != 0:
+            print('rtt min/avg/max = %.2f/%.2f/%.2f ms'%(self.rtt_min, self.rtt_sum/self.count_of_received, self.rtt_max))
+
+    def signal_handler(self, signal, frame):
+        self.print_stats()
+        os._exit(0)
+
+# 添加一个函数，用于从web.py调用
+def udp_ping(target_ip, target_port, packet_len=64, interval=1000, count_limit=10):
+    return UdpPinger(target_ip, target_port, packet_len, interval).run(count_limit)
+
+# 流水线模式: 按固定间隔连续发送，接收线程按序号匹配回包，不再停等
+def udp_ping_pipelined(target_ip, target_port, packet_len=64, interval=10, count_limit=100, timeout=1000):
+    ip = target_ip
+    port = int(target_port)
+
+    if packet_len < PIPELINE_HEADER.size:
+        return {"error": "LEN must be >=%d" % PIPELINE_HEADER.size}
+    if interval < 1:
+        return {"error": "INTERVAL must be >=1"}
+
+    if ip.find(":") == -1:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    else:
+        sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+    sock.settimeout(0.05)
+
+    session = random.getrandbits(32)
+    payload = bytearray(PIPELINE_HEADER.size) + random_string(packet_len - PIPELINE_HEADER.size).encode()
+    recv_buffer = bytearray(65536)
+    rtts = [None] * count_limit
+    counters = {"duplicates": 0, "reordered": 0, "late": 0}
+    stop = threading.Event()
+
+    def receive_replies():
+        highest_seq = -1
+        while not stop.is_set():
+            try:
+                nbytes, addr = sock.recvfrom_into(recv_buffer)
+            except socket.timeout:
+                continue
+            except socket.error:
+                continue
+            time_of_recv = time.time()
+            if addr[0] != ip or addr[1] != port or nbytes < PIPELINE_HEADER.size:
+                continue
+            token, seq, time_of_send = PIPELINE_HEADER.unpack_from(recv_buffer)
+            if token != session or seq >= count_limit:
+                continue
+            if rtts[seq] is not None:
+                counters["duplicates"] += 1
+                continue
+            rtt = (time_of_recv - time_of_send) * 1000
+            if rtt > timeout:
+                counters["late"] += 1
+                continue
+            if seq < highest_seq:
+                counters["reordered"] += 1
+            else:
+                highest_seq = seq
+            rtts[seq] = rtt
+
+    receiver = threading.Thread(target=receive_replies)
+    receiver.daemon = True
+    receiver.start()
+
+    try:
+        start = time.time()
+        for seq in range(count_limit):
+            time_remaining = start + seq * interval / 1000.0 - time.time()
+            if time_remaining > 0:
+                time.sleep(time_remaining)
+            PIPELINE_HEADER.pack_into(payload, 0, session, seq, time.time())
+            try:
+                sock.sendto(payload, (ip, port))
+            except socket.error:
+                pass
+
+        # 最后一个包发出后再等待一个超时周期
+        time.sleep(timeout / 1000.0)
+    finally:
+        stop.set()
+        receiver.join()
+        sock.close()
+
+    results = []
+    received = [rtt for rtt in rtts if rtt is not None]
+    for seq, rtt in enumerate(rtts):
+        if rtt is None:
+            results.append({"seq": seq + 1, "time": None, "status": "timeout"})
+        else:
+            results.append({"seq": seq + 1, "time": round(rtt, 2), "status": "success"})
+
     stats = {
-        "transmitted": count,
-        "received": count_of_received,
-        "loss": round((count - count_of_received) * 100.0 / count, 2) if count > 0 else 0,
-        "min": round(rtt_min, 2) if count_of_received > 0 else None,
-        "avg": round(rtt_sum / count_of_received, 2) if count_of_received > 0 else None,
-        "max": round(rtt_max, 2) if count_of_received > 0 else None
+        "transmitted": count_limit,
+        "received": len(received),
+        "loss": round((count_limit - len(received)) * 100.0 / count_limit, 2) if count_limit > 0 else 0,
+        "min": round(min(received), 2) if received else None,
+        "avg": round(sum(received) / len(received), 2) if received else None,
+        "max": round(max(received), 2) if received else None,
+        "duplicates": counters["duplicates"],
+        "reordered": counters["reordered"],
+        "late": counters["late"]
     }
-    
+
     return {"results": results, "stats": stats}
 
+# 多目标异步UDP Ping使用的数据报协议，按 (ip, port, payload) 匹配回包
+class _MultiPingProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.waiters = {}
+
+    def connection_made(self, transport):
+        # 大量目标的回包同时到达，默认的接收缓冲区很快溢出，造成虚假的丢包
+        sock = transport.get_extra_info("socket")
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_SIZE)
+        except OSError:
+            pass
+
+    def datagram_received(self, data, addr):
+        waiter = self.waiters.pop((addr[0], addr[1], data), None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(time.time())
+
+    def error_received(self, exc):
+        # ICMP不可达等错误不影响其他目标，由超时统一处理
+        pass
+
+async def _udp_ping_target(transport, protocol, ip, port, packet_len, interval, count_limit, offset=0):
+    loop = asyncio.get_event_loop()
+    pinger = UdpPinger(ip, port, packet_len, interval)
+
+    # 各目标在间隔内错开开始时间，避免所有探测同时发出
+    if offset > 0:
+        await asyncio.sleep(offset)
+
+    for i in range(count_limit):
+        payload = bytes(pinger.next_payload())
+        key = (ip, port, payload)
+        waiter = loop.create_future()
+        protocol.waiters[key] = waiter
+
+        time_of_send = time.time()
+        deadline = time_of_send + interval/1000.0
+        transport.sendto(payload, (ip, port))
+
+        rtt = None
+        try:
+            time_of_recv = await asyncio.wait_for(waiter, interval/1000.0)
+            rtt = ((time_of_recv - time_of_send) * 1000)
+        except asyncio.TimeoutError:
+            protocol.waiters.pop(key, None)
+
+        pinger.record(rtt)
+
+        time_remaining = deadline - time.time()
+        if time_remaining > 0:
+            await asyncio.sleep(time_remaining)
+
+    return {"results": pinger.results, "stats": pinger.stats()}
+
+# 在一个事件循环中同时Ping多个 (ip, port) 目标，每个地址族按目标数使用少量数据报端点，
+# 每个端点最多负责TARGETS_PER_ENDPOINT个目标；各目标的开始时间在一个间隔内均匀错开
+async def async_udp_ping_many(targets, packet_len=64, interval=1000, count_limit=10):
+    if packet_len < 5:
+        return {"error": "LEN must be >=5"}
+    if interval < 50:
+        return {"error": "INTERVAL must be >=50"}
+
+    loop = asyncio.get_event_loop()
+    targets = [(ip, int(port)) for ip, port in targets]
+
+    # 按地址族分组，每组目标轮流分配到该地址族的各个端点
+    groups = {}
+    for index, (ip, port) in enumerate(targets):
+        family = socket.AF_INET6 if ip.find(":") != -1 else socket.AF_INET
+        groups.setdefault(family, []).append(index)
+
+    endpoints = {}
+    try:
+        for family, indexes in groups.items():
+            count = (len(indexes) + TARGETS_PER_ENDPOINT - 1) // TARGETS_PER_ENDPOINT
+            endpoints[family] = []
+            for _ in range(count):
+                endpoints[family].append(await loop.create_datagram_endpoint(_MultiPingProtocol, family=family))
+
+        tasks = [None] * len(targets)
+        for family, indexes in groups.items():
+            for position, index in enumerate(indexes):
+                ip, port = targets[index]
+                transport, protocol = endpoints[family][position % len(endpoints[family])]
+                offset = interval / 1000.0 * index / len(targets)
+                tasks[index] = _udp_ping_target(transport, protocol, ip, port, packet_len, interval, count_limit, offset)
+        outcomes = await asyncio.gather(*tasks)
+    finally:
+        for group in endpoints.values():
+            for transport, _ in group:
+                transport.close()
+
+    return {"%s:%d" % (ip, port): outcome for (ip, port), outcome in zip(targets, outcomes)}
+
+# 同步入口，返回 {"ip:port": {"results": [...], "stats": {...}}}
+def udp_ping_many(targets, packet_len=64, interval=1000, count_limit=10):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(async_udp_ping_many(targets, packet_len, interval, count_limit))
+    finally:
+        loop.close()
+
+# 解析 "ip:port" 或 "[ipv6]:port" 形式的目标
+def parse_target(spec):
+    spec = spec.strip()
+    if spec.startswith("["):
+        ip, _, port = spec[1:].partition("]:")
+    else:
+        ip, _, port = spec.rpartition(":")
+    return ip, int(port)
+
+# 读取多目标参数: 逗号分隔的目标列表，或 @文件 (每行一个目标，忽略空行和#注释)
+def load_targets(arg):
+    if arg.startswith("@"):
+        with open(arg[1:]) as f:
+            specs = [line.split("#", 1)[0] for line in f]
+    else:
+        specs = arg.split(",")
+    return [parse_target(spec) for spec in specs if spec.strip()]
+
 # 主程序入口
 if __name__ == "__main__":
+    if len(sys.argv) in (3, 4) and sys.argv[1] == "--targets":
+        if len(sys.argv) == 4:
+            exec(sys.argv[3])
+
+        targets = load_targets(sys.argv[2])
+        print("UDPping %d targets with %d bytes of payload, %d probes each" % (len(targets), LEN, COUNT))
+        sys.stdout.flush()
+
+        outcomes = udp_ping_many(targets, LEN, INTERVAL, COUNT)
+        if "error" in outcomes:
+            print(outcomes["error"])
+            exit()
+
+        for target, outcome in outcomes.items():
+            stats = outcome["stats"]
+            line = "%s: transmitted=%d received=%d loss=%.2f%%" % (target, stats["transmitted"], stats["received"], stats["loss"])
+            if stats["received"] > 0:
+                line += " rtt min/avg/max=%.2f/%.2f/%.2f ms" % (stats["min"], stats["avg"], stats["max"])
+            print(line)
+        exit()
+
     if len(sys.argv) != 3 and len(sys.argv) != 4:
         print(""" usage:""")
         print("""   this_program <dest_ip> <dest_port>""")
         print("""   this_program <dest_ip> <dest_port> \"<options>\" """)
+        print("""   this_program --targets <ip:port,ip:port,...|@file> [\"<options>\"]""")
 
         print()
         print(""" options:""")
         print("""   LEN         the length of payload, unit:byte""")
         print("""   INTERVAL    the seconds waited between sending each packet, as well as the timeout for reply packet, unit: ms""")
+        print("""   COUNT       probes sent to each target in --targets mode""")
 
         print()
         print(" examples:")
         print("   ./udpping.py 44.55.66.77 4000")
         print('   ./udpping.py 44.55.66.77 4000 "LEN=400;INTERVAL=2000"')
         print("   ./udpping.py fe80::5400:ff:aabb:ccdd 4000")
+        print('   ./udpping.py --targets 44.55.66.77:4000,[fe80::1]:4000 "COUNT=5"')
+        print("   ./udpping.py --targets @targets.txt")
         print()
 
         exit()
@@ -145,67 +440,26 @@ if __name__ == "__main__":
     IP = sys.argv[1]
     PORT = int(sys.argv[2])
 
-    is_ipv6 = 0
-
-    if IP.find(":") != -1:
-        is_ipv6 = 1
-
     if len(sys.argv) == 4:
         exec(sys.argv[3])
-        
-    if LEN < 5:
-        print("LEN must be >=5")
-        exit()
-    if INTERVAL < 50:
-        print("INTERVAL must be >=50")
+
+    pinger = UdpPinger(IP, PORT, LEN, INTERVAL)
+    error = pinger.validate()
+    if error:
+        print(error)
         exit()
 
-    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGINT, pinger.signal_handler)
 
-    if not is_ipv6:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    else:
-        sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+    sock = pinger.open_socket()
 
     print("UDPping %s via port %d with %d bytes of payload"% (IP, PORT, LEN))
     sys.stdout.flush()
 
     while True:
-        payload = random_string(LEN)
-        sock.sendto(payload.encode(), (IP, PORT))
-        time_of_send = time.time()
-        deadline = time.time() + INTERVAL/1000.0
-        received = 0
-        rtt = 0.0
-        
-        while True:
-            timeout = deadline - time.time()
-            if timeout < 0:
-                break
-            #print "timeout=",timeout
-            sock.settimeout(timeout)
-            try:
-                recv_data, addr = sock.recvfrom(65536)
-                if recv_data == payload.encode() and addr[0] == IP and addr[1] == PORT:
-                    rtt = ((time.time() - time_of_send) * 1000)
-                    print("Reply from", IP, "seq=%d"%count, "time=%.2f"%(rtt), "ms")
-                    sys.stdout.flush()
-                    received = 1
-                    break
-            except socket.timeout:
-                break
-            except:
-                pass
-        count += 1
-        if received == 1:
-            count_of_received += 1
-            rtt_sum += rtt
-            rtt_max = max(rtt_max, rtt)
-            rtt_min = min(rtt_min, rtt)
+        result = pinger.ping_once(sock)
+        if result["status"] == "success":
+            print("Reply from", IP, "seq=%d"%(result["seq"] - 1), "time=%.2f"%(result["time"]), "ms")
         else:
             print("Request timed out")
-            sys.stdout.flush()
-
-        time_remaining = deadline - time.time()
-        if time_remaining > 0:
-            time.sleep(time_remaining)
+        sys.stdout.flush()
@@ -5,6 +5,8 @@ import udpping
 import udpdns
 import tcpdns
 import httpsdns
+import dotdns
+import dnsperf
 import tcpping
 import threading
 import json
@@ -22,6 +24,10 @@ tcp_dns_results = {}
 tcp_dns_threads = {}
 https_dns_results = {}
 https_dns_threads = {}
+dot_dns_results = {}
+dot_dns_threads = {}
+dns_perf_results = {}
+dns_perf_threads = {}
 
 @app.route('/')
 def index():
@@ -36,6 +42,8 @@ def start_ping():
     packet_len = data.get('packet_len', 64)
     interval = data.get('interval', 1000)
     count = data.get('count', 10)
+    pipelined = data.get('pipelined', False)
+    timeout = data.get('timeout', 1000)
     
     if not ip or not port:
         return jsonify({"error": "IP和端口是必须的"}), 400
@@ -45,8 +53,9 @@ def start_ping():
         packet_len = int(packet_len)
         interval = int(interval)
         count = int(count)
+        timeout = int(timeout)
     except ValueError:
-        return jsonify({"error": "端口、包长度、间隔和计数必须是整数"}), 400
+        return jsonify({"error": "端口、包长度、间隔、计数和超时必须是整数"}), 400
     
     # 创建一个唯一的测试ID
     test_id = f"{ip}:{port}_{threading.get_ident()}"
@@ -54,7 +63,10 @@ def start_ping():
     # 启动一个新线程来执行ping测试
     def run_ping_test():
         try:
-            result = udpping.udp_ping(ip, port, packet_len, interval, count)
+            if pipelined:
+                result = udpping.udp_ping_pipelined(ip, port, packet_len, interval, count, timeout)
+            else:
+                result = udpping.udp_ping(ip, port, packet_len, interval, count)
             ping_results[test_id] = result
         except Exception as e:
             ping_results[test_id] = {"error": str(e)}
@@ -101,6 +113,14 @@ def start_dns_test():
     query_type = data.get('query_type', 'A')
     count = data.get('count', 5)
     interval = data.get('interval', 1000)
+    header_only = data.get('header_only', False)
+    # 默认使用进程内共享的UDP套接字池
+    pooled = data.get('pooled', True)
+    # EDNS0 UDP缓冲区大小，0表示不使用EDNS；响应被截断时默认改用TCP重新查询
+    edns = data.get('edns', udpdns.EDNS_BUFFER_SIZE)
+    tcp_fallback = data.get('tcp_fallback', True)
+    # 超时后按RTT估计的RTO重传的次数
+    retries = data.get('retries', udpdns.RETRIES)
     
     if not domain or not server:
         return jsonify({"error": "域名和DNS服务器是必须的"}), 400
@@ -109,8 +129,10 @@ def start_dns_test():
         port = int(port)
         count = int(count)
         interval = int(interval)
+        edns = int(edns or 0)
+        retries = int(retries)
     except ValueError:
-        return jsonify({"error": "端口、查询次数和间隔必须是整数"}), 400
+        return jsonify({"error": "端口、查询次数、间隔、EDNS缓冲区大小和重传次数必须是整数"}), 400
     
     # 创建一个唯一的测试ID
     test_id = f"{domain}@{server}:{port}_{threading.get_ident()}"
@@ -118,7 +140,8 @@ def start_dns_test():
     # 启动一个新线程来执行DNS测试
     def run_dns_test():
         try:
-            result = udpdns.dns_test(domain, server, port, query_type, count, interval)
+            result = udpdns.dns_test(domain, server, port, query_type, count, interval, header_only, pooled,
+                                     edns, tcp_fallback, retries)
             dns_results[test_id] = result
         except Exception as e:
             dns_results[test_id] = {"error": str(e)}
@@ -155,6 +178,83 @@ def cancel_dns_test(test_id):
     else:
         return jsonify({"status": "not_found"}), 404
 
+# UDP DNS 压力测试相关API
+@app.route('/api/dnsperf', methods=['POST'])
+def start_dns_perf_test():
+    data = request.json
+    server = data.get('server')
+    port = data.get('port', 53)
+    domain = data.get('domain', 'example.com')
+    query_type = data.get('query_type', 'A')
+    # 查询列表，每项为 "域名 [查询类型]"，也可以是按行分隔的字符串
+    queries = data.get('queries')
+    qps = data.get('qps', 1000)
+    duration = data.get('duration', 10)
+    timeout = data.get('timeout', 2000)
+    sockets = data.get('sockets', dnsperf.SOCKETS)
+    
+    if not server:
+        return jsonify({"error": "DNS服务器是必须的"}), 400
+    
+    try:
+        port = int(port)
+        qps = int(qps)
+        duration = float(duration)
+        timeout = int(timeout)
+        sockets = int(sockets)
+    except ValueError:
+        return jsonify({"error": "端口、QPS、时长、超时和套接字数量必须是数字"}), 400
+    
+    if queries:
+        if isinstance(queries, str):
+            queries = queries.splitlines()
+        elif not isinstance(queries, list):
+            return jsonify({"error": "查询列表必须是字符串列表或按行分隔的字符串"}), 400
+        queries = dnsperf.parse_query_lines(queries)
+    
+    # 创建一个唯一的测试ID
+    test_id = f"perf_{server}:{port}_{threading.get_ident()}"
+    
+    # 启动一个新线程来执行压力测试
+    def run_dns_perf_test():
+        try:
+            result = dnsperf.dns_load_test(server, port, queries, domain, query_type, qps, duration, timeout, sockets)
+            dns_perf_results[test_id] = result
+        except Exception as e:
+            dns_perf_results[test_id] = {"error": str(e)}
+    
+    thread = threading.Thread(target=run_dns_perf_test)
+    thread.daemon = True
+    thread.start()
+    dns_perf_threads[test_id] = thread
+    
+    return jsonify({"test_id": test_id, "status": "started"})
+
+@app.route('/api/dnsperf/status/<test_id>')
+def get_dns_perf_status(test_id):
+    if test_id in dns_perf_results:
+        # 如果测试已完成，返回结果
+        return jsonify({"status": "completed", "result": dns_perf_results[test_id]})
+    elif test_id in dns_perf_threads:
+        # 如果测试正在进行中
+        if dns_perf_threads[test_id].is_alive():
+            return jsonify({"status": "running"})
+        else:
+            # 线程已结束但没有结果，可能出错了
+            return jsonify({"status": "error", "message": "测试异常终止"})
+    else:
+        # 找不到测试ID
+        return jsonify({"status": "not_found"}), 404
+
+@app.route('/api/dnsperf/cancel/<test_id>', methods=['POST'])
+def cancel_dns_perf_test(test_id):
+    if test_id in dns_perf_threads and dns_perf_threads[test_id].is_alive():
+        # 无法直接终止线程，但可以从字典中移除
+        del dns_perf_threads[test_id]
+        return jsonify({"status": "cancelled"})
+    else:
+        return jsonify({"status": "not_found"}), 404
+
 # TCP DNS 测试相关API
 @app.route('/api/tcpdns', methods=['POST'])
 def start_tcp_dns_test():
@@ -165,6 +265,10 @@ def start_tcp_dns_test():
     query_type = data.get('query_type', 'A')
     count = data.get('count', 5)
     interval = data.get('interval', 1000)
+    fastopen = data.get('fastopen', False)
+    pipeline = data.get('pipeline', False)
+    header_only = data.get('header_only', False)
+    retries = data.get('retries', 0)
     
     if not domain or not server:
         return jsonify({"error": "域名和DNS服务器是必须的"}), 400
@@ -173,8 +277,9 @@ def start_tcp_dns_test():
         port = int(port)
         count = int(count)
         interval = int(interval)
+        retries = int(retries)
     except ValueError:
-        return jsonify({"error": "端口、查询次数和间隔必须是整数"}), 400
+        return jsonify({"error": "端口、查询次数、间隔和重试次数必须是整数"}), 400
     
     # 创建一个唯一的测试ID
     test_id = f"tcp_{domain}@{server}:{port}_{threading.get_ident()}"
@@ -182,7 +287,11 @@ def start_tcp_dns_test():
     # 启动一个新线程来执行TCP DNS测试
     def run_tcp_dns_test():
         try:
-            result = tcpdns.tcp_dns_test(domain, server, port, query_type, count, interval)
+            if pipeline:
+                result = tcpdns.tcp_dns_pipeline_test(domain, server, port, query_type, count, header_only=header_only)
+            else:
+                result = tcpdns.tcp_dns_test(domain, server, port, query_type, count, interval, fastopen, header_only,
+                                             retries)
             tcp_dns_results[test_id] = result
         except Exception as e:
             tcp_dns_results[test_id] = {"error": str(e)}
@@ -229,6 +338,15 @@ def start_https_dns_test():
     count = data.get('count', 5)
     interval = data.get('interval', 1000)
     use_wire_format = data.get('use_wire_format', False)
+    pooled = data.get('pooled', True)
+    http2 = data.get('http2', False)
+    max_streams = data.get('max_streams', 10)
+    concurrency = data.get('concurrency', 1)
+    wire_method = data.get('wire_method', 'POST')
+    use_cache = data.get('use_cache', False)
+    select_provider = data.get('select_provider', False)
+    race = data.get('race', False)
+    retries = data.get('retries', 0)
     
     if not domain:
         return jsonify({"error": "域名是必须的"}), 400
@@ -236,8 +354,11 @@ def start_https_dns_test():
     try:
         count = int(count)
         interval = int(interval)
+        max_streams = int(max_streams)
+        concurrency = int(concurrency)
+        retries = int(retries)
     except ValueError:
-        return jsonify({"error": "查询次数和间隔必须是整数"}), 400
+        return jsonify({"error": "查询次数、间隔、并发流数、并发数和重试次数必须是整数"}), 400
     
     # 创建一个唯一的测试ID
     server_name = doh_url.split('//')[1].split('/')[0] if doh_url else 'default'
@@ -246,7 +367,14 @@ def start_https_dns_test():
     # 启动一个新线程来执行HTTPS DNS测试
     def run_https_dns_test():
         try:
-            result = httpsdns.https_dns_test(domain, doh_url, query_type, count, interval, use_wire_format)
+            if select_provider:
+                result = httpsdns.https_dns_select_test(domain, query_type, count, interval, use_wire_format, race)
+            elif http2:
+                result = httpsdns.https_dns_test(domain, doh_url, query_type, count, interval, True, True, max_streams,
+                                                 wire_method, use_cache, retries, http2=True)
+            else:
+                result = httpsdns.https_dns_test(domain, doh_url, query_type, count, interval, use_wire_format, pooled, concurrency,
+                                                 wire_method, use_cache, retries)
             https_dns_results[test_id] = result
         except Exception as e:
             https_dns_results[test_id] = {"error": str(e)}
@@ -283,6 +411,75 @@ def cancel_https_dns_test(test_id):
     else:
         return jsonify({"status": "not_found"}), 404
 
+# DNS over TLS (DoT) 测试相关API
+@app.route('/api/dotdns', methods=['POST'])
+def start_dot_dns_test():
+    data = request.json
+    domain = data.get('domain')
+    server = data.get('server')
+    port = data.get('port', dotdns.DOT_PORT)
+    query_type = data.get('query_type', 'A')
+    count = data.get('count', 5)
+    interval = data.get('interval', 1000)
+    server_name = data.get('server_name')
+    verify = data.get('verify', True)
+    pipeline = data.get('pipeline', False)
+    reconnect = data.get('reconnect', False)
+    
+    if not domain or not server:
+        return jsonify({"error": "域名和DNS服务器是必须的"}), 400
+    
+    try:
+        port = int(port)
+        count = int(count)
+        interval = int(interval)
+    except ValueError:
+        return jsonify({"error": "端口、查询次数和间隔必须是整数"}), 400
+    
+    # 创建一个唯一的测试ID
+    test_id = f"dot_{domain}@{server}:{port}_{threading.get_ident()}"
+    
+    # 启动一个新线程来执行DoT测试
+    def run_dot_dns_test():
+        try:
+            result = dotdns.dot_dns_test(domain, server, port, query_type, count, interval,
+                                         server_name, verify, pipeline, reconnect)
+            dot_dns_results[test_id] = result
+        except Exception as e:
+            dot_dns_results[test_id] = {"error": str(e)}
+    
+    thread = threading.Thread(target=run_dot_dns_test)
+    thread.daemon = True
+    thread.start()
+    dot_dns_threads[test_id] = thread
+    
+    return jsonify({"test_id": test_id, "status": "started"})
+
+@app.route('/api/dotdns/status/<test_id>')
+def get_dot_dns_status(test_id):
+    if test_id in dot_dns_results:
+        # 如果测试已完成，返回结果
+        return jsonify({"status": "completed", "result": dot_dns_results[test_id]})
+    elif test_id in dot_dns_threads:
+        # 如果测试正在进行中
+        if dot_dns_threads[test_id].is_alive():
+            return jsonify({"status": "running"})
+        else:
+            # 线程已结束但没有结果，可能出错了
+            return jsonify({"status": "error", "message": "测试异常终止"})
+    else:
+        # 找不到测试ID
+        return jsonify({"status": "not_found"}), 404
+
+@app.route('/api/dotdns/cancel/<test_id>', methods=['POST'])
+def cancel_dot_dns_test(test_id):
+    if test_id in dot_dns_threads and dot_dns_threads[test_id].is_alive():
+        # 无法直接终止线程，但可以从字典中移除
+        del dot_dns_threads[test_id]
+        return jsonify({"status": "cancelled"})
+    else:
+        return jsonify({"status": "not_found"}), 404
+
 # TCP Ping 相关API
 @app.route('/api/tcpping', methods=['POST'])
 def start_tcp_ping():
@@ -292,6 +489,8 @@ def start_tcp_ping():
     packet_len = data.get('packet_len', 64)
     interval = data.get('interval', 1000)
     count = data.get('count', 10)
+    persistent = data.get('persistent', False)
+    fastopen = data.get('fastopen', False)
     
     if not ip or not port:
         return jsonify({"error": "IP和端口是必须的"}), 400
@@ -310,7 +509,7 @@ def start_tcp_ping():
     # 启动一个新线程来执行ping测试
     def run_tcp_ping_test():
         try:
-            result = tcpping.tcp_ping(ip, port, packet_len, interval, count)
+            result = tcpping.tcp_ping(ip, port, packet_len, interval, count, persistent, fastopen)
             tcp_ping_results[test_id] = result
         except Exception as e:
             tcp_ping_results[test_id] = {"error": str(e)}
@@ -348,4 +547,4 @@ def cancel_tcp_ping(test_id):
         return jsonify({"status": "not_found"}), 404
 
 if __name__ == "__main__":
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file